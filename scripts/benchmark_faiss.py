@@ -0,0 +1,63 @@
+# File: scripts/benchmark_faiss.py
+# So sánh các loại index FAISS trên vector thật của corpus: recall@k (so với tìm kiếm chính xác), bộ nhớ, độ trễ.
+# Vector lấy từ checkpoint của create_vector_index.py -> không gọi lại API embedding.
+import os
+import sys
+import json
+import argparse
+import yaml
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+from src.core.vector_checkpoint import VectorCheckpoint
+from src.core.faiss_index import build_index, set_search_params, evaluate_index, sample_queries
+
+ARTIFACTS_DIR = os.path.join(BASE_DIR, "data", "artifacts")
+DEFAULT_SPECS = ["Flat", "IVF{nlist},Flat", "IVF{nlist},PQ16", "OPQ16,IVF{nlist},PQ16", "HNSW32,Flat"]
+
+def load_vectors(cfg):
+    with open(os.path.join(ARTIFACTS_DIR, "embedding.json"), "r", encoding="utf-8") as f:
+        name = json.load(f)["name"]
+    with open(os.path.join(ARTIFACTS_DIR, "metas.json"), "r", encoding="utf-8") as f:
+        hashes = [m["chunk_id"] for m in json.load(f)]
+    safe_name = "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in name)
+    checkpoint = VectorCheckpoint(os.path.join(BASE_DIR, cfg["index"].get("vector_cache_dir", "data/cache/vectors"), safe_name))
+    return checkpoint.get_matrix(hashes)
+
+def main():
+    with open(os.path.join(BASE_DIR, "config", "config.yaml"), "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f)
+    index_cfg = cfg["index"]
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--specs", nargs="*", default=DEFAULT_SPECS, help="Chuỗi index_factory cần so sánh")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200, help="Số query thử (lấy mẫu từ corpus)")
+    parser.add_argument("--nprobe", type=int, nargs="*", default=[index_cfg.get("faiss_nprobe", 10)])
+    parser.add_argument("--output", default=os.path.join(ARTIFACTS_DIR, "faiss_benchmark.json"))
+    args = parser.parse_args()
+
+    vectors = load_vectors(cfg)
+    queries = sample_queries(vectors, args.queries)
+    print(f"📐 {len(vectors)} vector x {vectors.shape[1]} chiều, {len(queries)} query thử, k={args.k}")
+
+    rows = []
+    for spec in args.specs:
+        index, factory = build_index(vectors, spec, nlist=index_cfg.get("faiss_nlist", 100),
+                                     train_size=index_cfg.get("faiss_train_size"))
+        for nprobe in (args.nprobe if "IVF" in factory else [None]):
+            set_search_params(index, nprobe, index_cfg.get("faiss_ef_search", 64))
+            row = {"spec": factory, "nprobe": nprobe}
+            row.update(evaluate_index(index, vectors, queries, k=args.k))
+            rows.append(row)
+            print(f"   {factory:<24} nprobe={str(nprobe):<5} recall@{row['k']}={row['recall_at_k']:.3f} "
+                  f"p50={row['latency_ms_p50']:.3f}ms p95={row['latency_ms_p95']:.3f}ms "
+                  f"mem={row['memory_bytes'] / 1e6:.2f}MB ({row['bytes_per_vector']:.1f} B/vec)")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(rows, f, ensure_ascii=False, indent=2)
+    print(f"✅ Đã lưu báo cáo tại {args.output}")
+
+if __name__ == "__main__":
+    main()
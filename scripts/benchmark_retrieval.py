@@ -0,0 +1,300 @@
+# File: scripts/benchmark_retrieval.py
+# Benchmark hot path truy xuất: phát lại bộ câu hỏi test qua các stage BM25, dense, hybrid, rerank, graph
+# trên corpus thật và corpus tổng hợp phóng to -> p50/p95/p99, QPS, RSS đỉnh, recall@k / MRR.
+# Chạy offline hoàn toàn: embedding "stub" (hash), LLM giả lập (StubLLM); artifact dựng trong thư mục tạm.
+import os
+import re
+import sys
+import copy
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import yaml
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+from src.core.bm25_index import SparseBM25
+from src.core.embeddings import build_embedder, as_langchain_embeddings
+from src.core.search_engine import HybridSearcher
+from src.utils.metrics import latency_summary, recall_at_k, reciprocal_rank, mean_metric, peak_rss_mb
+from src.utils.stub_llm import StubLLM
+from src.utils.text_utils import (ARTICLE_REF_RE, YEAR_RE, article_number, chunk_hash, get_meta_id,
+                                  parse_source_info, tokenize_vn)
+from src.utils.timing import LazyLoader
+
+ARTIFACTS_DIR = os.path.join(BASE_DIR, "data", "artifacts")
+GRAPH_PATH = os.path.join(BASE_DIR, "data", "knowledge_graph.json")
+DEFAULT_TEST_SETS = [os.path.join(BASE_DIR, "data", "test_set_mcq.json"), os.path.join(BASE_DIR, "data", "test_set_essay.json")]
+STAGES = ("bm25", "dense", "hybrid", "rerank", "graph")
+SEARCH_MODES = {"bm25": "bm25_only", "dense": "vector_only", "hybrid": "hybrid"}
+
+
+def chunk_key(doc, meta):
+    return get_meta_id(meta) or chunk_hash(doc)
+
+
+def load_cases(paths, limit=None):
+    cases = []
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"⚠️ Bỏ qua (không tồn tại): {path}")
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            for case in json.load(f):
+                cases.append(dict(case, test_set=os.path.basename(path)))
+    return cases[:limit] if limit else cases
+
+
+def label_cases(cases, docs, metas):
+    """
+    Gắn chunk đúng cho từng câu hỏi:
+    - test set có sẵn "relevant_ids" (chunk_id) -> dùng luôn
+    - ngược lại suy từ "Điều N" trong câu hỏi + đáp án chuẩn: chunk bắt đầu bằng Điều N,
+      ưu tiên văn bản có năm ban hành được nhắc tới (vd "Luật hôn nhân và gia đình năm 2014")
+    Câu không suy ra được nhãn (vd trắc nghiệm) chỉ dùng để đo độ trễ.
+    """
+    by_article = {}
+    for i, doc in enumerate(docs):
+        number = article_number(doc)
+        if number is not None:
+            by_article.setdefault(number, []).append(i)
+    years = [parse_source_info(m.get("source", ""))["year"] for m in metas]
+
+    for case in cases:
+        if case.get("relevant_ids"):
+            case["relevant"] = list(case["relevant_ids"])
+            continue
+        text = f"{case.get('question', '')} {case.get('ground_truth', '')}"
+        mentioned = {int(y) for y in YEAR_RE.findall(text)}
+        relevant = []
+        for ref in ARTICLE_REF_RE.findall(text):
+            candidates = by_article.get(int(re.match(r"\d+", ref).group(0)), [])
+            if mentioned:
+                candidates = [i for i in candidates if years[i] in mentioned]
+            relevant.extend(chunk_key(docs[i], metas[i]) for i in candidates)
+        case["relevant"] = list(dict.fromkeys(relevant))
+    return cases
+
+
+def scale_corpus(docs, metas, scale, drop=0.3, seed=0):
+    """
+    Corpus tổng hợp gấp `scale` lần: bản gốc + (scale - 1) bản sao nhiễu (bỏ ngẫu nhiên `drop` số từ, nguồn riêng).
+    Nhãn vẫn trỏ về chunk gốc -> bản sao đóng vai văn bản gây nhiễu như khi corpus lớn lên.
+    """
+    rng = random.Random(seed)
+    out_docs = list(docs)
+    out_metas = [dict(m, chunk_id=chunk_key(d, m)) for d, m in zip(docs, metas)]
+    for copy_no in range(1, scale):
+        for doc, meta in zip(docs, metas):
+            words = doc.split()
+            text = " ".join([w for w in words if rng.random() >= drop] or words)
+            out_docs.append(text)
+            out_metas.append({"source": f"synthetic_{copy_no}/{meta.get('source', '').strip()}", "chunk_id": chunk_hash(text)})
+    return out_docs, out_metas
+
+
+def bench_config(cfg, art_dir):
+    """Config dùng cho benchmark: artifact tạm, embedding stub không cache (đo đúng chi phí embed mỗi câu)"""
+    cfg = copy.deepcopy(cfg)
+    cfg["paths"]["artifacts_dir"] = art_dir
+    cfg["index"].update({"embedding_backend": "stub", "embedding_cache_dir": None, "embedding_cache_size": 0})
+    cfg.setdefault("answer_cache", {})["enabled"] = False
+    return cfg
+
+
+def build_artifacts(art_dir, docs, metas, cfg):
+    """docs/metas.json, BM25 CSR và FAISS (embedding stub) giống bố cục của create_vector_index.py"""
+    os.makedirs(art_dir, exist_ok=True)
+    with open(os.path.join(art_dir, "docs.json"), "w", encoding="utf-8") as f:
+        json.dump(docs, f, ensure_ascii=False)
+    with open(os.path.join(art_dir, "metas.json"), "w", encoding="utf-8") as f:
+        json.dump(metas, f, ensure_ascii=False)
+    SparseBM25.build([tokenize_vn(d) for d in docs]).save(os.path.join(art_dir, "bm25"))
+
+    embedder = build_embedder(cfg, use_cache=False)
+    vectors = np.asarray(embedder.embed_documents(docs), dtype=np.float32)
+    try:
+        # Docstore LangChain (faiss.pkl) cho stage graph (GraphRAGService đọc bằng FAISS.load_local)
+        from langchain_community.vectorstores import FAISS
+
+        FAISS.from_embeddings(list(zip(docs, vectors.tolist())), as_langchain_embeddings(embedder),
+                              metadatas=metas).save_local(art_dir, index_name="faiss")
+    except ImportError:
+        import faiss
+
+        index = faiss.IndexFlatL2(vectors.shape[1])
+        index.add(vectors)
+        faiss.write_index(index, os.path.join(art_dir, "faiss.faiss"))
+    with open(os.path.join(art_dir, "embedding.json"), "w", encoding="utf-8") as f:
+        json.dump({"name": embedder.name}, f)
+
+
+def summarize(latencies, rankings, cases, k):
+    out = latency_summary(latencies)
+    labelled = [(r, c["relevant"]) for r, c in zip(rankings, cases) if c.get("relevant")]
+    out["n_labelled"] = len(labelled)
+    out[f"recall_at_{k}"] = mean_metric([recall_at_k(r, rel, k) for r, rel in labelled])
+    out["mrr"] = mean_metric([reciprocal_rank(r, rel) for r, rel in labelled])
+    return out
+
+
+def run_search_stage(searcher, mode, cases, k, batch_size):
+    questions = [c["question"] for c in cases]
+    searcher.search(questions[0], k=k, mode=mode)  # warmup: load lười FAISS / embedder không tính vào độ trễ
+    latencies, rankings = [], []
+    for q in questions:
+        t0 = time.perf_counter()
+        results = searcher.search(q, k=k, mode=mode)
+        latencies.append(time.perf_counter() - t0)
+        rankings.append([chunk_key(r["doc"], r["meta"]) for r in results])
+
+    t0 = time.perf_counter()
+    for start in range(0, len(questions), batch_size):
+        searcher.search_batch(questions[start:start + batch_size], k=k, modes=(mode,))
+    batch_seconds = time.perf_counter() - t0
+    out = summarize(latencies, rankings, cases, k)
+    out["batch_qps"] = len(questions) / batch_seconds
+    return out
+
+
+def run_rerank_stage(searcher, cfg, cases, k, batch_size):
+    """Chỉ đo bước rerank trên ứng viên hybrid (cần torch/transformers + model đã tải về máy)"""
+    from src.core.reranker import CrossEncoderReranker
+
+    rerank_cfg = cfg.get("reranker", {})
+    reranker = CrossEncoderReranker(rerank_cfg.get("model_name", "BAAI/bge-reranker-v2-m3"),
+                                    backend=rerank_cfg.get("backend", "torch"),
+                                    max_length=rerank_cfg.get("max_length", 512), cache_size=0,
+                                    onnx_dir=rerank_cfg.get("onnx_dir", "data/cache/onnx"))
+    questions = [c["question"] for c in cases]
+    candidate_lists = searcher.search_batch(questions)["hybrid"]
+    pair_batch = rerank_cfg.get("batch_size", 16)
+    reranker.rerank(questions[0], candidate_lists[0], keep_topk=k, batch_size=pair_batch)
+
+    latencies, rankings = [], []
+    for q, candidates in zip(questions, candidate_lists):
+        t0 = time.perf_counter()
+        reranked, _ = reranker.rerank(q, candidates, keep_topk=k, batch_size=pair_batch)
+        latencies.append(time.perf_counter() - t0)
+        rankings.append([chunk_key(r["doc"], r["meta"]) for r in reranked])
+
+    t0 = time.perf_counter()
+    for start in range(0, len(questions), batch_size):
+        reranker.rerank_batch(questions[start:start + batch_size], candidate_lists[start:start + batch_size],
+                              keep_topk=k, batch_size=pair_batch)
+    batch_seconds = time.perf_counter() - t0
+    out = summarize(latencies, rankings, cases, k)
+    out["batch_qps"] = len(questions) / batch_seconds
+    return out
+
+
+def run_graph_stage(art_dir, cfg, cases):
+    """GraphRAGService đầu-cuối (vector search + mở rộng graph + sinh câu trả lời) với StubLLM"""
+    from src.services.graph_rag_service import GraphRAGService
+
+    config_path = os.path.join(art_dir, "config.yaml")
+    with open(config_path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(cfg, f, allow_unicode=True)
+    os.environ.setdefault("GROQ_API_KEY", "offline-benchmark")  # không dùng tới: LLM được thay bằng StubLLM
+    service = GraphRAGService(vector_db_path=art_dir, graph_path=GRAPH_PATH, config_path=config_path)
+    service._llm = LazyLoader(StubLLM, "LLM (stub)", service.timer)
+    questions = [c["question"] for c in cases]
+    latencies, ttfts = [], []
+    try:
+        if service.vector_db is None:
+            raise RuntimeError("không load được Vector DB")
+        service.query(questions[0])
+        for q in questions:
+            _, meta, latency = service.query(q)
+            latencies.append(latency)
+            ttfts.append(meta.get("ttft") or latency)
+    finally:
+        service.close()
+    out = latency_summary(latencies)
+    out["ttft_p50_ms"] = float(np.percentile(np.asarray(ttfts) * 1000, 50))
+    return out
+
+
+def print_table(name, report, k):
+    print(f"\n📊 {name}: {report['n_chunks']} chunk (dựng artifact {report['build_seconds']:.1f}s)")
+    print(f"   {'stage':<8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'QPS':>8} {'batch QPS':>10} "
+          f"{f'R@{k}':>7} {'MRR':>7} {'RSS MB':>8}")
+    fmt = lambda v, spec: format(v, spec) if v is not None else "-"
+    for stage, r in report["stages"].items():
+        if "skipped" in r:
+            print(f"   {stage:<8} ⏭️ bỏ qua: {r['skipped']}")
+            continue
+        print(f"   {stage:<8} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['qps']:>8.1f} "
+              f"{fmt(r.get('batch_qps'), '.1f'):>10} {fmt(r.get(f'recall_at_{k}'), '.3f'):>7} "
+              f"{fmt(r.get('mrr'), '.3f'):>7} {r['peak_rss_mb']:>8.0f}")
+
+
+def main():
+    with open(os.path.join(BASE_DIR, "config", "config.yaml"), "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--test-sets", nargs="*", default=DEFAULT_TEST_SETS)
+    parser.add_argument("--scales", type=int, nargs="*", default=[1, 10], help="Hệ số phóng to corpus (1 = corpus thật)")
+    parser.add_argument("--stages", nargs="*", default=list(STAGES), choices=STAGES)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32, help="Kích thước lô khi đo batch QPS")
+    parser.add_argument("--limit", type=int, default=None, help="Chỉ lấy N câu hỏi đầu")
+    parser.add_argument("--keep-artifacts", action="store_true", help="Giữ lại thư mục artifact tạm")
+    parser.add_argument("--output", default=os.path.join(ARTIFACTS_DIR, "retrieval_benchmark.json"))
+    args = parser.parse_args()
+
+    with open(os.path.join(ARTIFACTS_DIR, "docs.json"), "r", encoding="utf-8") as f:
+        docs = json.load(f)
+    with open(os.path.join(ARTIFACTS_DIR, "metas.json"), "r", encoding="utf-8") as f:
+        metas = json.load(f)
+    cases = label_cases(load_cases(args.test_sets, args.limit), docs, metas)
+    if not cases:
+        print("❌ Không có câu hỏi test.")
+        return
+    print(f"🧪 {len(cases)} câu hỏi, {sum(1 for c in cases if c['relevant'])} câu có nhãn chunk")
+
+    results = {"k": args.k, "n_queries": len(cases), "n_labelled": sum(1 for c in cases if c["relevant"]), "corpora": {}}
+    for scale in args.scales:
+        name = f"x{scale}"
+        art_dir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+        bcfg = bench_config(cfg, art_dir)
+        try:
+            t0 = time.perf_counter()
+            scaled_docs, scaled_metas = scale_corpus(docs, metas, scale)
+            build_artifacts(art_dir, scaled_docs, scaled_metas, bcfg)
+            report = {"n_chunks": len(scaled_docs), "build_seconds": time.perf_counter() - t0, "stages": {}}
+            searcher = HybridSearcher(bcfg)
+            for stage in args.stages:
+                print(f"⏱️ [{name}] {stage}...")
+                try:
+                    if stage in SEARCH_MODES:
+                        r = run_search_stage(searcher, SEARCH_MODES[stage], cases, args.k, args.batch_size)
+                    elif stage == "rerank":
+                        r = run_rerank_stage(searcher, bcfg, cases, args.k, args.batch_size)
+                    else:
+                        r = run_graph_stage(art_dir, bcfg, cases)
+                    r["peak_rss_mb"] = peak_rss_mb()
+                except Exception as e:
+                    r = {"skipped": f"{type(e).__name__}: {e}"}
+                report["stages"][stage] = r
+            results["corpora"][name] = report
+            print_table(name, report, args.k)
+        finally:
+            if not args.keep_artifacts:
+                shutil.rmtree(art_dir, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ Đã lưu: {args.output} (RSS là đỉnh của cả tiến trình tính đến hết stage)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,88 +1,247 @@
 # File: scripts/build_knowledge_graph.py
 import os
+import sys
 import json
-import re
-import time
+import argparse
+import threading
 from glob import glob
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.core.graph_index import GraphIndex
+from src.utils.text_utils import match_article_heading, extract_article_refs, chunk_hash, make_node_id
+from src.utils.rate_limit import RateLimiter, CooldownGate, retry_with_backoff
 
 # Load môi trường
 load_dotenv()
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-
-if not GROQ_API_KEY:
-    print("❌ LỖI: Chưa có GROQ_API_KEY trong file .env")
-    exit(1)
-
-# --- CẬP NHẬT MODEL MỚI TẠI ĐÂY ---
-# Model cũ 'llama3-70b-8192' đã bị xóa.
-# Dùng 'llama-3.3-70b-versatile' (Mạnh nhất) hoặc 'llama-3.1-8b-instant' (Nhanh nhất)
-llm = ChatGroq(
-    api_key=GROQ_API_KEY,
-    model_name="llama-3.3-70b-versatile",
-    temperature=0.1,
-    max_retries=3
-)
 
 CHUNKS_DIR = "data/chunks"
 OUTPUT_FILE = "data/knowledge_graph.json"
+GRAPH_INDEX_DIR = "data/artifacts/graph"
+CONFIG_PATH = "config/config.yaml"
 
-def extract_article_id(text):
-    """
-    Lấy ID: 'Điều 5', 'Điều 13a' từ văn bản.
-    """
-    match = re.search(r"^(Điều \d+[a-z]*)\b", text, re.IGNORECASE)
-    if match:
-        raw_id = match.group(1)
-        # Chuẩn hóa: "điều 5a" -> "Điều 5a"
-        return raw_id.capitalize().replace("điều", "Điều")
-    return None
-
-def get_ai_summary(text, retry_count=0):
-    """
-    Dùng Groq để tóm tắt nội dung điều luật.
-    Có cơ chế thử lại thủ công nếu gặp lỗi Rate Limit.
-    """
-    try:
-        prompt = f"""
+# Mặc định theo free tier của Groq; ghi đè trong config.yaml -> graph_build
+DEFAULT_BUILD_CFG = {
+    # Model cũ 'llama3-70b-8192' đã bị xóa.
+    # Dùng 'llama-3.3-70b-versatile' (Mạnh nhất) hoặc 'llama-3.1-8b-instant' (Nhanh nhất)
+    "model": "llama-3.3-70b-versatile",
+    "requests_per_minute": 30,
+    "tokens_per_minute": 6000,
+    "workers": 4,
+    "max_retries": 5,
+    "summary_cache": "data/cache/summaries.json",
+}
+
+SUMMARY_PROMPT = """
         Nhiệm vụ: Tóm tắt nội dung chính của văn bản luật dưới đây thành 1 cụm danh từ ngắn gọn (dưới 15 từ).
         Không dùng dấu ngoặc kép. Không giải thích dài dòng.
 
         Văn bản:
-        {text[:800]}
+        {text}
 
         Tóm tắt:
         """
-        response = llm.invoke(prompt)
-        return response.content.strip().replace('"', '').replace("Tóm tắt:", "").strip()
-    except Exception as e:
-        error_msg = str(e)
-        # Nếu lỗi do Rate Limit (429), thử đợi và gọi lại
-        if "429" in error_msg or "Rate limit" in error_msg:
-            if retry_count < 3:
-                wait_time = (retry_count + 1) * 5 # Đợi 5s, 10s, 15s
-                print(f"⚠️ Quá tải API (Rate Limit), đang đợi {wait_time}s để thử lại...")
-                time.sleep(wait_time)
-                return get_ai_summary(text, retry_count + 1)
-
-        print(f"❌ Lỗi Groq khi tóm tắt: {error_msg}")
-        # Lấy dòng đầu tiên làm fallback
-        lines = text.split('\n')
-        fallback = lines[0][:50] + "..." if lines else "Nội dung điều luật (Lỗi AI)"
-        return fallback
-
-def build_graph():
-    nodes = {}
-    edges = []
-
-    files = glob(os.path.join(CHUNKS_DIR, "*.json"))
-    print(f"🏗️  Đang xây dựng Knowledge Graph từ {len(files)} file...")
-    print("⚡ Đang sử dụng Groq API (Llama 3.3) để trích xuất Topic...")
 
-    request_count = 0
+def load_build_config():
+    cfg = dict(DEFAULT_BUILD_CFG)
+    if os.path.exists(CONFIG_PATH):
+        import yaml
+        with open(CONFIG_PATH, 'r', encoding='utf-8') as f:
+            cfg.update((yaml.safe_load(f) or {}).get("graph_build", {}) or {})
+    return cfg
+
+def create_llm(backend, model_name):
+    if backend == "stub":
+        from src.utils.stub_llm import StubLLM
+        return StubLLM()
+
+    groq_api_key = os.getenv("GROQ_API_KEY")
+    if not groq_api_key:
+        print("❌ LỖI: Chưa có GROQ_API_KEY trong file .env")
+        exit(1)
+    from langchain_groq import ChatGroq
+    # Retry do retry_with_backoff đảm nhiệm (dùng chung cooldown cho cả pool)
+    return ChatGroq(api_key=groq_api_key, model_name=model_name, temperature=0.1, max_retries=0)
+
+def extract_article_id(text):
+    """
+    Lấy ID: 'Điều 5', 'Điều 13a' từ văn bản (chuẩn hóa "điều 5A" -> "Điều 5a").
+    """
+    return match_article_heading(text)
+
+def fallback_topic(text):
+    # Lấy dòng đầu tiên làm fallback
+    lines = text.split('\n')
+    return lines[0][:50] + "..." if lines else "Nội dung điều luật (Lỗi AI)"
+
+class SummaryCache:
+    """
+    Cache tóm tắt lưu trên đĩa, khóa = chunk_hash(nội dung điều luật).
+    Build lại graph chỉ gọi LLM cho điều luật có nội dung mới/thay đổi.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = {}
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self._data = json.load(f)
+
+    def get(self, key):
+        return self._data.get(key)
+
+    def put(self, key, topic):
+        with self._lock:
+            self._data[key] = topic
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with self._lock, open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+def get_ai_summary(llm, text, limiter=None, gate=None, max_retries=5):
+    """
+    Dùng LLM để tóm tắt nội dung điều luật.
+    Chờ rate limiter trước mỗi lần gọi; lỗi 429 được retry_with_backoff xử lý.
+    """
+    prompt = SUMMARY_PROMPT.format(text=text[:800])
+
+    def call():
+        if limiter is not None:
+            # Ước lượng token: ~4 ký tự/token cho prompt + ~30 token trả lời
+            limiter.acquire(len(prompt) // 4 + 30)
+        return llm.invoke(prompt)
+
+    response = retry_with_backoff(call, max_retries=max_retries, gate=gate)
+    return response.content.strip().replace('"', '').replace("Tóm tắt:", "").strip()
 
+def summarize_all(texts, llm, cache, cfg):
+    """
+    Tóm tắt song song các văn bản chưa có trong cache (đã khử trùng lặp theo hash).
+    texts: dict hash -> nội dung. Trả về dict hash -> topic.
+    """
+    topics = {h: cache.get(h) for h in texts if cache.get(h)}
+    pending = [h for h in texts if h not in topics]
+    print(f"🧠 Tóm tắt: {len(topics)} lấy từ cache, {len(pending)} cần gọi LLM")
+    if not pending:
+        return topics
+
+    limiter = RateLimiter(cfg.get("requests_per_minute"), cfg.get("tokens_per_minute"))
+    gate = CooldownGate()
+    with ThreadPoolExecutor(max_workers=max(1, int(cfg.get("workers", 4)))) as pool:
+        futures = {
+            pool.submit(get_ai_summary, llm, texts[h], limiter, gate, cfg.get("max_retries", 5)): h
+            for h in pending
+        }
+        for i, fut in enumerate(tqdm(as_completed(futures), total=len(futures))):
+            h = futures[fut]
+            try:
+                topics[h] = fut.result()
+                cache.put(h, topics[h])
+            except Exception as e:
+                print(f"❌ Lỗi LLM khi tóm tắt: {e}")
+                # Không cache fallback để lần build sau thử lại
+                topics[h] = fallback_topic(texts[h])
+            if (i + 1) % 50 == 0:
+                cache.save()
+    cache.save()
+    return topics
+
+def load_reusable_topics(changed_sources):
+    """
+    Chế độ incremental: lấy lại topic đã tóm tắt từ graph cũ cho các node
+    không dính tới văn bản nào bị thêm/sửa/xóa -> không phải gọi lại LLM.
+    """
+    if not os.path.exists(OUTPUT_FILE):
+        return {}
+    with open(OUTPUT_FILE, 'r', encoding='utf-8') as f:
+        old_graph = json.load(f)
+
+    changed = set(changed_sources)
+    reusable = {}
+    for node in old_graph.get("nodes", []):
+        topic = node.get("topic", "")
+        sources = node.get("sources", [])
+        if topic and topic != "Đang cập nhật" and sources and not (set(sources) & changed):
+            reusable[node["id"]] = topic
+    return reusable
+
+class GraphBuilder:
+    """
+    Bảng node được intern: (văn bản, điều) -> ID số nguyên, cạnh lưu thành bộ (from, relation, to) số nguyên
+    trong set -> kiểm tra trùng O(1) thay vì quét cả danh sách cạnh.
+    """
+
+    def __init__(self):
+        self.node_index = {}   # (source, article) -> int
+        self.nodes = []        # int -> dict thuộc tính node
+        self.relations = []
+        self.rel_index = {}
+        self.edge_set = set()
+        self.edges = []        # (src, rel, dst) theo thứ tự thêm vào
+
+    def node(self, source, article, placeholder=False):
+        key = (source.strip(), article)
+        idx = self.node_index.get(key)
+        if idx is None:
+            idx = self.node_index[key] = len(self.nodes)
+            self.nodes.append({
+                "id": make_node_id(source, article),
+                "article": article,
+                "source": key[0],
+                "topic": "Đang cập nhật" if placeholder else "",
+                "type": "Article",
+                "sources": [] if placeholder else [source]
+            })
+        elif not placeholder and not self.nodes[idx]["sources"]:
+            # Node trước đó chỉ là đích dẫn chiếu, nay đã gặp tiêu đề của chính nó
+            self.nodes[idx]["sources"] = [source]
+            self.nodes[idx]["topic"] = ""
+        return idx
+
+    def add_edge(self, src, relation, dst):
+        rel = self.rel_index.get(relation)
+        if rel is None:
+            rel = self.rel_index[relation] = len(self.relations)
+            self.relations.append(relation)
+        edge = (src, rel, dst)
+        if edge not in self.edge_set:
+            self.edge_set.add(edge)
+            self.edges.append(edge)
+
+    def to_index(self):
+        edges = np.asarray(self.edges, dtype=np.int64).reshape(-1, 3)
+        return GraphIndex(
+            [n["id"] for n in self.nodes], edges[:, 0], edges[:, 2], edges[:, 1], self.relations, self.nodes
+        )
+
+    def to_json(self):
+        return {
+            "nodes": self.nodes,
+            "edges": [
+                {"from": self.nodes[s]["id"], "to": self.nodes[d]["id"], "relation": self.relations[r]}
+                for s, r, d in self.edges
+            ],
+        }
+
+def build_graph(llm, cfg, reusable_topics=None):
+    graph = GraphBuilder()
+    reusable_topics = reusable_topics or {}
+    topic_texts = {}  # node int -> nội dung dùng để tóm tắt (chunk đầu tiên mang tiêu đề điều đó)
+
+    files = sorted(glob(os.path.join(CHUNKS_DIR, "*.json")))
+    print(f"🏗️  Đang xây dựng Knowledge Graph từ {len(files)} file...")
+
+    # Bước 1: dựng node/cạnh, chưa gọi LLM
     for filepath in tqdm(files):
         with open(filepath, 'r', encoding='utf-8') as f:
             chunks = json.load(f)
@@ -97,67 +256,65 @@ def build_graph():
                 content = str(chunk)
                 source = os.path.basename(filepath)
 
-            # 2. Xác định ID Node (Điều luật)
-            node_id = extract_article_id(content)
-            if not node_id:
+            # 2. Xác định Điều luật; node = (văn bản, điều) để "Điều 5" của các văn bản khác nhau không gộp làm một
+            article = extract_article_id(content)
+            if not article:
                 continue
+            node = graph.node(source, article)
 
-            # 3. Tạo Node hoặc Cập nhật Node
-            should_update_topic = False
-
-            if node_id not in nodes:
-                nodes[node_id] = {
-                    "id": node_id,
-                    "topic": "",
-                    "type": "Article",
-                    "sources": [source]
-                }
-                should_update_topic = True
-            else:
-                if nodes[node_id].get("topic") == "Đang cập nhật":
-                    should_update_topic = True
-                if source not in nodes[node_id]["sources"]:
-                    nodes[node_id]["sources"].append(source)
-
-            # 4. Gọi AI Update Topic (Nếu cần)
-            if should_update_topic:
-                topic = get_ai_summary(content)
-                nodes[node_id]["topic"] = topic
-
-                # Rate Limit thủ công
-                request_count += 1
-                if request_count % 10 == 0:
-                    time.sleep(2)
-
-            # 5. Tạo Edges
-            refs = re.findall(r"Điều (\d+[a-z]*)", content, re.IGNORECASE)
-            for r in refs:
-                target_id = f"Điều {r}"
-                if target_id.lower() != node_id.lower():
-                    edge = {
-                        "from": node_id,
-                        "to": target_id,
-                        "relation": "dẫn chiếu đến"
-                    }
-                    if edge not in edges:
-                        edges.append(edge)
-
-                    if target_id not in nodes:
-                        nodes[target_id] = {
-                            "id": target_id,
-                            "topic": "Đang cập nhật",
-                            "type": "Article",
-                            "sources": []
-                        }
-
-    # Lưu kết quả
-    graph_data = {"nodes": list(nodes.values()), "edges": edges}
+            # 3. Ghi nhận văn bản cần tóm tắt (chunk đầu tiên của điều đó)
+            if node not in topic_texts:
+                topic_texts[node] = content
+
+            # 4. Tạo Edges - dẫn chiếu "Điều N" được hiểu trong cùng văn bản
+            # Cùng bộ regex có ranh giới từ với GraphRAGService (ArticleMatcher)
+            for target in extract_article_refs(content):
+                if target.lower() != article.lower():
+                    graph.add_edge(node, "dẫn chiếu đến", graph.node(source, target, placeholder=True))
+
+    # Bước 2: tóm tắt song song (cache theo hash nội dung + dùng lại topic từ graph cũ)
+    texts = {}
+    node_hash = {}
+    for node, content in topic_texts.items():
+        node_id = graph.nodes[node]["id"]
+        if node_id in reusable_topics:
+            graph.nodes[node]["topic"] = reusable_topics[node_id]
+            continue
+        h = chunk_hash(content[:800])
+        node_hash[node] = h
+        texts[h] = content
+
+    topics = summarize_all(texts, llm, SummaryCache(cfg.get("summary_cache")), cfg)
+
+    # Bước 3: gán topic
+    for node, h in node_hash.items():
+        graph.nodes[node]["topic"] = topics[h]
+
+    # Lưu kết quả: JSON (tương thích, dễ đọc) + adjacency nhị phân cho GraphRAGService mmap
     with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(graph_data, f, ensure_ascii=False, indent=2)
+        json.dump(graph.to_json(), f, ensure_ascii=False, indent=2)
+    graph.to_index().save(GRAPH_INDEX_DIR)
 
-    print(f"\n✅ Hoàn tất! Đã lưu tại {OUTPUT_FILE}")
-    print(f"   - Nodes: {len(nodes)}")
-    print(f"   - Edges: {len(edges)}")
+    print(f"\n✅ Hoàn tất! Đã lưu tại {OUTPUT_FILE} và {GRAPH_INDEX_DIR}")
+    print(f"   - Nodes: {len(graph.nodes)}")
+    print(f"   - Edges: {len(graph.edges)}")
 
 if __name__ == "__main__":
-    build_graph()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--incremental", action="store_true", help="Giữ topic cũ cho node không thuộc văn bản thay đổi")
+    parser.add_argument("--changed", nargs="*", default=[], help="Tên file PDF đã thêm/sửa/xóa")
+    parser.add_argument("--llm", choices=["groq", "stub"], default="groq", help="stub = LLM giả lập offline để test")
+    parser.add_argument("--workers", type=int, default=None, help="Số request LLM song song")
+    args = parser.parse_args()
+
+    build_cfg = load_build_config()
+    if args.workers:
+        build_cfg["workers"] = args.workers
+    llm = create_llm(args.llm, build_cfg["model"])
+    print(f"⚡ Trích xuất Topic bằng {args.llm} ({build_cfg['model'] if args.llm == 'groq' else 'offline'}), "
+          f"{build_cfg['workers']} luồng, {build_cfg['requests_per_minute']} req/phút")
+
+    reusable = load_reusable_topics(args.changed) if args.incremental else {}
+    if args.incremental:
+        print(f"♻️  Incremental: dùng lại {len(reusable)} topic, chỉ tóm tắt node thuộc {len(args.changed)} văn bản thay đổi")
+    build_graph(llm, build_cfg, reusable)
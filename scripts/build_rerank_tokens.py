@@ -0,0 +1,40 @@
+# File: scripts/build_rerank_tokens.py
+# Tokenize trước toàn bộ chunk cho cross-encoder reranker (chạy sau create_vector_index.py)
+import os
+import sys
+import json
+import yaml
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+from src.core.artifact_store import PackedCorpus
+from src.core.token_cache import build_token_cache
+
+ARTIFACTS_DIR = os.path.join(BASE_DIR, "data", "artifacts")
+
+def main():
+    with open(os.path.join(BASE_DIR, "config", "config.yaml"), "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f)
+    rerank_cfg = cfg.get("reranker", {})
+    model_name = rerank_cfg.get("model_name", "BAAI/bge-reranker-v2-m3")
+    max_length = rerank_cfg.get("max_length", 512)
+    out_dir = os.path.join(BASE_DIR, rerank_cfg.get("token_cache_dir", "data/artifacts/rerank_tokens"))
+
+    # Cùng thứ tự hàng với HybridSearcher (corpus packed, fallback docs.json)
+    corpus_dir = os.path.join(ARTIFACTS_DIR, "corpus")
+    if PackedCorpus.exists(corpus_dir):
+        docs = PackedCorpus(corpus_dir).docs
+    else:
+        with open(os.path.join(ARTIFACTS_DIR, "docs.json"), "r", encoding="utf-8") as f:
+            docs = json.load(f)
+
+    from transformers import AutoTokenizer
+
+    print(f"🔤 Tokenize {len(docs)} chunk bằng tokenizer của {model_name} (max_length={max_length})...")
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    build_token_cache(docs, tokenizer, out_dir, model_name, max_length=max_length)
+    print(f"✅ Đã lưu token cache tại {out_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -19,6 +19,8 @@ except ImportError:
 
 load_dotenv()
 
+SEARCH_BATCH_SIZE = 32
+
 def load_config():
     with open("config/config.yaml", "r", encoding="utf-8") as f:
         return yaml.safe_load(f)
@@ -56,6 +58,19 @@ def run_comparison():
 
     results = []
 
+    # Tìm kiếm cả bộ câu hỏi theo lô: embed 1 lần/lô, BM25 nhân ma trận, dùng chung giữa 3 mode
+    print(f"\n🔎 Đang tìm kiếm theo lô ({SEARCH_BATCH_SIZE} câu/lô)...")
+    modes = ("bm25_only", "vector_only", "hybrid")
+    search_results = {m: [] for m in modes}
+    for start in tqdm(range(0, len(test_cases), SEARCH_BATCH_SIZE)):
+        batch = [case["question"] for case in test_cases[start:start + SEARCH_BATCH_SIZE]]
+        try:
+            out = searcher.search_batch(batch, k=1, modes=modes)
+        except Exception as e:
+            out = {m: [f"Lỗi: {e}"] * len(batch) for m in modes}
+        for m in modes:
+            search_results[m].extend(out[m])
+
     print(f"\n⚡ Đang xử lý {len(test_cases)} câu hỏi...")
 
     for idx, case in tqdm(enumerate(test_cases), total=len(test_cases)):
@@ -86,26 +101,10 @@ def run_comparison():
 
             return f"[{src}]\n{content[:300]}..."
 
-        # --- 1: BM25 (Keyword) ---
-        try:
-            docs = searcher.search(q, k=1, mode="bm25_only")
-            row["BM25 Result"] = get_result_safe(docs)
-        except Exception as e:
-            row["BM25 Result"] = f"Lỗi: {e}"
-
-        # --- 2: VECTOR (Semantic) ---
-        try:
-            docs = searcher.search(q, k=1, mode="vector_only")
-            row["Vector Result"] = get_result_safe(docs)
-        except Exception as e:
-            row["Vector Result"] = f"Lỗi: {e}"
-
-        # --- 3: HYBRID (Kết hợp) ---
-        try:
-            docs = searcher.search(q, k=1, mode="hybrid")
-            row["Hybrid Result"] = get_result_safe(docs)
-        except Exception as e:
-            row["Hybrid Result"] = f"Lỗi: {e}"
+        # --- 1-3: BM25 (Keyword) / VECTOR (Semantic) / HYBRID (Kết hợp) - đã tìm theo lô ở trên ---
+        for mode, col in (("bm25_only", "BM25 Result"), ("vector_only", "Vector Result"), ("hybrid", "Hybrid Result")):
+            docs = search_results[mode][idx]
+            row[col] = docs if isinstance(docs, str) else get_result_safe(docs)
 
         # --- 4: GRAPH RAG ---
         if graph_service:
@@ -1,18 +1,28 @@
 # File: scripts/create_vector_index.py
 import os
+import sys
 import json
-import pickle
-import numpy as np
+import shutil
+import tempfile
+import yaml
 from tqdm import tqdm
 from dotenv import load_dotenv
 
 # Import các thư viện AI
 from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from rank_bm25 import BM25Okapi
 
 # Cấu hình đường dẫn
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+from src.core.bm25_index import SparseBM25
+from src.core.filters import MetadataFilterIndex
+from src.core.artifact_store import pack_corpus
+from src.core.embeddings import build_embedder, as_langchain_embeddings
+from src.core.vector_checkpoint import VectorCheckpoint, embed_corpus
+from src.core.faiss_index import DEFAULT_SPEC, build_index, set_search_params, evaluate_index, sample_queries
+from src.utils.text_utils import tokenize_vn, chunk_hash
+
 CHUNK_DIR = os.path.join(BASE_DIR, "data", "chunks")
 ARTIFACTS_DIR = os.path.join(BASE_DIR, "data", "artifacts")
 
@@ -20,23 +30,31 @@ ARTIFACTS_DIR = os.path.join(BASE_DIR, "data", "artifacts")
 os.makedirs(ARTIFACTS_DIR, exist_ok=True)
 
 load_dotenv()
-google_api_key = os.getenv("GOOGLE_API_KEY")
+with open(os.path.join(BASE_DIR, "config", "config.yaml"), "r", encoding="utf-8") as f:
+    CFG = yaml.safe_load(f)
 
-if not google_api_key:
+if CFG["index"].get("embedding_backend", "google") == "google" and not os.getenv("GOOGLE_API_KEY"):
     print("❌ Lỗi: Chưa có GOOGLE_API_KEY trong file .env")
     exit(1)
 
-def tokenize_vn(text):
+def save_vector_db(vector_db, out_dir, index_name="faiss"):
     """
-    Hàm tách từ đơn giản cho tiếng Việt để chạy BM25.
-    (Tách theo khoảng trắng và lowercase)
+    Ghi <index_name>.faiss/.pkl ra thư mục tạm cạnh out_dir rồi os.replace vào chỗ cũ.
+    Không ghi đè tại chỗ: process đang mmap file cũ (API, Streamlit với index.faiss_mmap) vẫn đọc inode cũ
+    tới khi load lại, thay vì bị SIGBUS / đọc dữ liệu ghi dở.
     """
-    return text.lower().split()
+    tmp_dir = tempfile.mkdtemp(prefix=f".{index_name}_tmp_", dir=out_dir)
+    try:
+        vector_db.save_local(tmp_dir, index_name=index_name)
+        for ext in (".pkl", ".faiss"):
+            os.replace(os.path.join(tmp_dir, index_name + ext), os.path.join(out_dir, index_name + ext))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
 
 def main():
     print("🚀 Bắt đầu tạo Index cho Hybrid Search (Vector + BM25)...")
-    print(f"   - Embeddings: Google (text-embedding-004)")
-    print(f"   - Keyword: BM25Okapi")
+    print(f"   - Embeddings: {CFG['index'].get('embedding_backend', 'google')}")
+    print(f"   - Keyword: BM25 (CSR sparse matrix)")
 
     # 1. Đọc dữ liệu từ Chunks
     docs = []   # Lưu nội dung text
@@ -71,6 +89,7 @@ def main():
                     meta = {"source": filename.replace("_chunks.json", ".pdf")}
 
                 if text.strip(): # Chỉ lấy đoạn có nội dung
+                    meta["chunk_id"] = chunk_hash(text)
                     docs.append(text)
                     metas.append(meta)
         except Exception as e:
@@ -81,11 +100,9 @@ def main():
     # 2. Tạo & Lưu BM25 (Cho Keyword Search)
     print("🔠 Đang tạo chỉ mục BM25...")
     tokenized_docs = [tokenize_vn(doc) for doc in tqdm(docs, desc="Tokenizing")]
-    bm25 = BM25Okapi(tokenized_docs)
-
-    with open(os.path.join(ARTIFACTS_DIR, "bm25.pkl"), "wb") as f:
-        pickle.dump(bm25, f)
-    print("   -> Đã lưu data/artifacts/bm25.pkl")
+    bm25 = SparseBM25.build(tokenized_docs)
+    bm25.save(os.path.join(ARTIFACTS_DIR, "bm25"))
+    print(f"   -> Đã lưu data/artifacts/bm25/ ({len(bm25.vocab)} từ, {bm25.weights.nnz} postings)")
 
     # 3. Lưu Docs & Metas (Quan trọng cho HybridSearcher)
     print("💾 Đang lưu docs.json và metas.json...")
@@ -95,18 +112,65 @@ def main():
     with open(os.path.join(ARTIFACTS_DIR, "metas.json"), "w", encoding="utf-8") as f:
         json.dump(metas, f, ensure_ascii=False)
 
+    # Bản packed (offsets + blob UTF-8 + metadata dạng cột) để HybridSearcher mmap khi khởi động
+    pack_corpus(docs, metas, os.path.join(ARTIFACTS_DIR, "corpus"))
+    print("   -> Đã lưu data/artifacts/corpus/ (packed, memory-mapped)")
+
+    # Bitmap lọc metadata (văn bản / loại / năm / số điều) cho search(filters=...)
+    MetadataFilterIndex.build(docs, metas).save(os.path.join(ARTIFACTS_DIR, "filters"))
+    print("   -> Đã lưu data/artifacts/filters/ (bitmap lọc metadata)")
+
     # 4. Tạo & Lưu FAISS (Cho Semantic Search)
     print("🧠 Đang tạo Vector Index (FAISS)...")
-    embeddings = GoogleGenerativeAIEmbeddings(
-        model="models/text-embedding-004",
-        google_api_key=google_api_key
-    )
-
-    # Tạo vector store
-    vector_db = FAISS.from_texts(docs, embeddings, metadatas=metas)
+    embeddings = build_embedder(CFG, use_cache=False)
+
+    # Embed theo lô, song song, có checkpoint theo hash nội dung chunk
+    # -> chạy lại chỉ embed chunk mới/đã sửa; bị ngắt giữa chừng thì chạy lại sẽ tiếp tục
+    index_cfg = CFG["index"]
+    safe_name = "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in embeddings.name)
+    checkpoint = VectorCheckpoint(os.path.join(BASE_DIR, index_cfg.get("vector_cache_dir", "data/cache/vectors"), safe_name))
+    hashes = [m["chunk_id"] for m in metas]
+    todo = len(checkpoint.missing(hashes))
+    print(f"   - Đã có sẵn {len(set(hashes)) - todo} vector, cần embed {todo} chunk")
+    with tqdm(total=todo, desc="Embedding") as bar:
+        embed_corpus(
+            docs, hashes, embeddings, checkpoint,
+            batch_size=index_cfg.get("embedding_batch_size", 64),
+            max_workers=index_cfg.get("embedding_workers", 4),
+            progress=bar,
+        )
+
+    # Dọn shard khi vector của chunk đã xóa/sửa chiếm quá nửa
+    if checkpoint.dead_rows(hashes) > len(hashes):
+        checkpoint.compact(hashes)
+
+    # Tạo vector store từ vector đã tính
+    vectors = checkpoint.get_matrix(hashes)
+    vector_db = FAISS.from_embeddings(list(zip(docs, vectors.tolist())), as_langchain_embeddings(embeddings), metadatas=metas)
+
+    # Thay index Flat mặc định của LangChain bằng loại index theo config (IVF / PQ / OPQ / HNSW), train trên corpus.
+    # Vector được add đúng thứ tự nên id FAISS vẫn khớp index_to_docstore_id và docs.json
+    spec = index_cfg.get("faiss_index", DEFAULT_SPEC)
+    if spec != DEFAULT_SPEC:
+        print(f"🏋️ Đang train index FAISS '{spec}'...")
+        vector_db.index, factory = build_index(
+            vectors, spec, nlist=index_cfg.get("faiss_nlist", 100), train_size=index_cfg.get("faiss_train_size")
+        )
+        set_search_params(vector_db.index, index_cfg.get("faiss_nprobe", 10), index_cfg.get("faiss_ef_search", 64))
+
+        # Báo cáo recall@k so với tìm kiếm chính xác + bộ nhớ + độ trễ
+        report = {"spec": factory, "n_vectors": len(vectors), "dim": int(vectors.shape[1])}
+        report.update(evaluate_index(vector_db.index, vectors, sample_queries(vectors), k=10))
+        with open(os.path.join(ARTIFACTS_DIR, "faiss_report.json"), "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"   - recall@{report['k']}: {report['recall_at_k']:.3f} | p50 {report['latency_ms_p50']:.2f} ms | "
+              f"{report['bytes_per_vector']:.1f} byte/vector")
 
     # Lưu index FAISS vào artifacts
-    vector_db.save_local(ARTIFACTS_DIR, index_name="faiss")
+    save_vector_db(vector_db, ARTIFACTS_DIR, index_name="faiss")
+    # Ghi lại model đã dùng để HybridSearcher cảnh báo khi query bằng model khác
+    with open(os.path.join(ARTIFACTS_DIR, "embedding.json"), "w", encoding="utf-8") as f:
+        json.dump({"name": embeddings.name, "dim": vector_db.index.d}, f, ensure_ascii=False)
     print(f"   -> Đã lưu FAISS index vào {ARTIFACTS_DIR}")
 
     print("\n🎉 HOÀN TẤT! Dữ liệu đã sẵn sàng cho Hybrid Search.")
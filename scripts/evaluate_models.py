@@ -1,48 +1,109 @@
 # File: scripts/evaluate_models.py
+# Đánh giá GraphRAG trên bộ trắc nghiệm + tự luận:
+# - Trả lời & chấm song song (worker pool + rate limit chung cho Groq), retry khi 429
+# - Mỗi câu xong được ghi ngay vào checkpoint JSONL -> chạy lại tự bỏ qua câu đã có (resume sau khi crash)
+# - Điểm của giám khảo LLM được cache theo hash (câu hỏi, đáp án chuẩn, câu trả lời)
+# - Trắc nghiệm chấm bằng cách đọc chữ cái được chọn (không gọi LLM), chỉ nhờ LLM khi không đọc được
 import sys
 import os
-import time
 import json
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import pandas as pd
 import yaml
 from dotenv import load_dotenv
-from langchain_groq import ChatGroq
+from tqdm import tqdm
 
 # Setup đường dẫn
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-# Import Service
-from src.core.search_engine import HybridSearcher
-try:
-    from src.services.graph_rag_service import GraphRAGService
-except ImportError:
-    GraphRAGService = None
+from src.utils.rate_limit import RateLimiter, CooldownGate, retry_with_backoff
+from src.utils.text_utils import parse_mcq_choice, parse_mcq_options
 
 load_dotenv()
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
-# Khởi tạo AI Judge
-judge_llm = ChatGroq(
-    api_key=GROQ_API_KEY,
-    model_name="llama-3.1-8b-instant",
-    temperature=0 # Nhiệt độ 0 để chấm điểm nhất quán
-)
+DEFAULT_EVAL_CFG = {
+    "judge_model": "llama-3.1-8b-instant",
+    "workers": 4,
+    "requests_per_minute": 30,   # dùng chung cho LLM trả lời + LLM chấm (cùng tài khoản Groq)
+    "tokens_per_minute": 6000,
+    "max_retries": 5,
+    "checkpoint_dir": "data/eval",
+    "judge_cache": "data/cache/judge.json",
+}
+
+MCQ_HINT = "\n(Chỉ chọn 1 đáp án đúng nhất A, B, C hoặc D và giải thích ngắn gọn)"
 
 def load_config():
     with open("config/config.yaml", "r", encoding="utf-8") as f:
         return yaml.safe_load(f)
 
-# --- HÀM CHẤM ĐIỂM ---
-def ai_grade(question, ground_truth, model_answer, mode="essay"):
+def create_judge(backend, model_name):
+    """groq: giám khảo LLM | offline: chỉ dùng điểm đã cache + chấm trắc nghiệm cục bộ"""
+    if backend == "offline":
+        return None
+    if not GROQ_API_KEY:
+        print("❌ LỖI: Chưa có GROQ_API_KEY trong file .env (dùng --judge offline để chấm không cần mạng)")
+        sys.exit(1)
+    from langchain_groq import ChatGroq
+    # Nhiệt độ 0 để chấm điểm nhất quán; retry do retry_with_backoff đảm nhiệm
+    return ChatGroq(api_key=GROQ_API_KEY, model_name=model_name, temperature=0, max_retries=0)
+
+class JudgeCache:
     """
-    Hàm chấm điểm đa năng.
+    Điểm đã chấm lưu trên đĩa (JSON), khóa = sha1(mode, câu hỏi, đáp án chuẩn, câu trả lời).
+    Chạy lại đánh giá với cùng câu trả lời (vd answer cache, LLM nhiệt độ thấp) không phải gọi giám khảo.
     """
-    if not model_answer:
-        return 0, "Không trả lời"
 
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = {}
+        if path and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self._data = json.load(f)
+
+    @staticmethod
+    def key(mode, question, ground_truth, answer):
+        payload = json.dumps([mode, question, ground_truth, answer], ensure_ascii=False)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key)
+
+    def put(self, key, score, reason):
+        with self._lock:
+            self._data[key] = {"score": score, "reason": reason}
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with self._lock, open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+# --- HÀM CHẤM ĐIỂM ---
+def grade_mcq_local(question, ground_truth, model_answer):
+    """Chấm trắc nghiệm không cần LLM: đọc chữ cái được chọn. Không đọc được -> None (nhờ giám khảo LLM)"""
+    choice = parse_mcq_choice(model_answer, parse_mcq_options(question))
+    if choice is None:
+        return None
+    expected = ground_truth.strip().lower()[:1]
+    if choice == expected:
+        return 1, f"Chọn đúng {choice.upper()}"
+    return 0, f"Chọn {choice.upper()}, đáp án đúng {expected.upper()}"
+
+def build_judge_prompt(question, ground_truth, model_answer, mode):
     if mode == "mcq":
         # Prompt chấm Trắc nghiệm
-        prompt = f"""
+        return f"""
         Bạn là máy chấm thi trắc nghiệm.
         [CÂU HỎI]: {question}
         [ĐÁP ÁN ĐÚNG]: {ground_truth}
@@ -54,9 +115,8 @@ def ai_grade(question, ground_truth, model_answer, mode="essay"):
 
         OUTPUT JSON: {{"score": 1, "reason": "Chọn đúng B"}}
         """
-    else:
-        # Prompt chấm Tự luận
-        prompt = f"""
+    # Prompt chấm Tự luận
+    return f"""
         Bạn là Giám khảo Luật.
         [CÂU HỎI]: {question}
         [ĐÁP ÁN CHUẨN]: {ground_truth}
@@ -69,19 +129,113 @@ def ai_grade(question, ground_truth, model_answer, mode="essay"):
         OUTPUT JSON: {{"score": 8.5, "reason": "Đủ ý nhưng thiếu trích dẫn"}}
         """
 
+def ai_grade(question, ground_truth, model_answer, mode="essay", judge=None, cache=None,
+             limiter=None, gate=None, max_retries=5):
+    """
+    Chấm 1 câu -> (điểm, lý do, đã chấm xong?).
+    Thứ tự: chấm trắc nghiệm cục bộ -> cache -> giám khảo LLM. Chưa chấm được (lỗi / offline) -> đã chấm xong = False.
+    """
+    if not model_answer:
+        return 0, "Không trả lời", True
+
+    if mode == "mcq":
+        local = grade_mcq_local(question, ground_truth, model_answer)
+        if local is not None:
+            return local[0], local[1], True
+
+    key = JudgeCache.key(mode, question, ground_truth, model_answer)
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None:
+        return cached["score"], cached["reason"], True
+    if judge is None:
+        return 0, "Chưa chấm (offline, không có trong cache)", False
+
+    prompt = build_judge_prompt(question, ground_truth, model_answer, mode)
+
+    def call():
+        if limiter is not None:
+            limiter.acquire(len(prompt) // 4 + 60)
+        return judge.invoke(prompt)
+
     try:
-        res = judge_llm.invoke(prompt)
-        content = res.content.strip()
+        content = retry_with_backoff(call, max_retries=max_retries, gate=gate).content.strip()
         # Parse JSON
         start = content.find('{')
         end = content.rfind('}') + 1
         result = json.loads(content[start:end])
-        return result.get("score", 0), result.get("reason", "")
-    except:
-        return 0, "Lỗi chấm điểm"
+        score, reason = result.get("score", 0), result.get("reason", "")
+    except Exception:
+        return 0, "Lỗi chấm điểm", False
+    if cache is not None:
+        cache.put(key, score, reason)
+    return score, reason, True
+
+def answer_question(graph_service, query_input, limiter=None, gate=None, max_retries=5):
+    """Gọi GraphRAG; lỗi LLM (GraphRAGService trả về trong meta["error"]) được ném lại để retry/backoff"""
+    def call():
+        if limiter is not None:
+            limiter.acquire(len(query_input) // 4 + 1500)  # prompt có kèm ngữ cảnh truy xuất
+        ans, meta, latency = graph_service.query(query_input)
+        if meta.get("error"):
+            raise RuntimeError(meta["error"])
+        return ans, meta, latency
+
+    return retry_with_backoff(call, max_retries=max_retries, gate=gate)
+
+def case_id(case):
+    return hashlib.sha1(f"{case['question']}\n{case['ground_truth']}".encode("utf-8")).hexdigest()[:16]
+
+def evaluate_case(idx, case, mode, graph_service, judge, cache, limiter, gate, max_retries):
+    q = case["question"]
+    gt = case["ground_truth"]
+
+    # Query Graph RAG
+    ans, sources, latency, error = "N/A", 0, 0, None
+    if graph_service:
+        try:
+            # Nếu là trắc nghiệm, nhắc AI chọn A,B,C,D
+            query_input = q + MCQ_HINT if mode == "mcq" else q
+            ans, meta, latency = answer_question(graph_service, query_input, limiter, gate, max_retries)
+            sources = len(meta.get("vector_sources", [])) + meta.get("graph_edges_used", 0)
+        except Exception as e:
+            ans, error = f"Error: {e}", str(e)
+
+    # Chấm điểm (câu trả lời lỗi không gửi cho giám khảo)
+    if error is None:
+        score, reason, graded = ai_grade(q, gt, ans, mode, judge, cache, limiter, gate, max_retries)
+    else:
+        score, reason, graded = 0, "Lỗi khi trả lời", False
+    return {
+        "id": case_id(case),
+        "idx": idx,
+        "Câu hỏi": q,
+        "Đáp án chuẩn": gt,
+        "AI Trả lời": ans,
+        "Điểm": score,
+        "Lý do": reason,
+        "Nguồn tìm thấy": sources,
+        "Thời gian (s)": round(latency, 2),
+        "Đã chấm": error is None and graded,
+        # Chỉ câu trả lời + chấm thành công mới được ghi checkpoint; câu lỗi được làm lại ở lần chạy sau
+        "_complete": error is None and graded,
+    }
+
+def load_checkpoint(path):
+    done = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                    done[row["id"]] = row
+                except (json.JSONDecodeError, KeyError):
+                    # Dòng cuối bị cắt ngang khi crash -> bỏ qua, câu đó sẽ được làm lại
+                    continue
+    return done
 
 # --- HÀM CHẠY ĐÁNH GIÁ (Dùng chung) ---
-def run_evaluation(test_file, output_file, mode, graph_service):
+def run_evaluation(test_file, output_file, mode, graph_service, judge=None, eval_cfg=None, resume=True, limit=None):
+    eval_cfg = eval_cfg or DEFAULT_EVAL_CFG
     if not os.path.exists(test_file):
         print(f"⚠️ Không tìm thấy file: {test_file}. Bỏ qua.")
         return
@@ -90,88 +244,133 @@ def run_evaluation(test_file, output_file, mode, graph_service):
 
     with open(test_file, "r", encoding="utf-8") as f:
         test_cases = json.load(f)
-
-    results = []
-    total_score = 0
-
+    if limit:
+        test_cases = test_cases[:limit]
+
+    checkpoint = os.path.join(eval_cfg["checkpoint_dir"], f"{mode}.jsonl")
+    os.makedirs(eval_cfg["checkpoint_dir"], exist_ok=True)
+    if not resume and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    done = load_checkpoint(checkpoint)
+    rows = {}
     for idx, case in enumerate(test_cases):
-        q = case["question"]
-        gt = case["ground_truth"]
-
-        print(f"   🔹 Câu {idx+1}: {q[:50]}...")
-
-        # Query Graph RAG
-        ans = "N/A"
-        sources = 0
-        latency = 0
-
-        if graph_service:
-            try:
-                # Nếu là trắc nghiệm, nhắc AI chọn A,B,C,D
-                query_input = q
-                if mode == "mcq":
-                    query_input += "\n(Chỉ chọn 1 đáp án đúng nhất A, B, C hoặc D và giải thích ngắn gọn)"
-
-                ans, meta, latency = graph_service.query(query_input)
-                sources = len(meta.get("vector_sources", [])) + meta.get("graph_edges_used", 0)
-            except Exception as e:
-                ans = f"Error: {e}"
-
-        # Chấm điểm
-        score, reason = ai_grade(q, gt, ans, mode)
-        total_score += score
-
-        # Lưu kết quả
-        results.append({
-            "Câu hỏi": q,
-            "Đáp án chuẩn": gt,
-            "AI Trả lời": ans,
-            "Điểm": score,
-            "Lý do": reason,
-            "Nguồn tìm thấy": sources,
-            "Thời gian (s)": round(latency, 2)
-        })
-
-    # Xuất Excel
+        row = done.get(case_id(case))
+        if row is not None:
+            rows[idx] = dict(row, idx=idx)
+    pending = [idx for idx in range(len(test_cases)) if idx not in rows]
+    print(f"   🔁 {len(rows)} câu đã có trong checkpoint, {len(pending)} câu cần chạy")
+
+    cache = JudgeCache(eval_cfg.get("judge_cache"))
+    limiter = RateLimiter(eval_cfg.get("requests_per_minute"), eval_cfg.get("tokens_per_minute"))
+    gate = CooldownGate()
+    failed = 0
+    if pending:
+        with ThreadPoolExecutor(max_workers=max(1, int(eval_cfg.get("workers", 4)))) as pool, \
+                open(checkpoint, "a", encoding="utf-8") as ckpt:
+            futures = [
+                pool.submit(evaluate_case, idx, test_cases[idx], mode, graph_service, judge, cache,
+                            limiter, gate, eval_cfg.get("max_retries", 5))
+                for idx in pending
+            ]
+            for i, fut in enumerate(tqdm(as_completed(futures), total=len(futures))):
+                row = fut.result()
+                complete = row.pop("_complete")
+                rows[row["idx"]] = row
+                if complete:
+                    # Ghi ngay từng câu (main thread) -> crash giữa chừng không mất kết quả
+                    ckpt.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    ckpt.flush()
+                else:
+                    failed += 1
+                if (i + 1) % 20 == 0:
+                    cache.save()
+        cache.save()
+
+    # Xuất Excel (theo thứ tự câu hỏi)
+    results = [{k: v for k, v in rows[idx].items() if k not in ("id", "idx")} for idx in sorted(rows)]
     df = pd.DataFrame(results)
     df.to_excel(output_file, index=False)
 
-    # In báo cáo nhanh
-    print(f"   ✅ Đã xong! Kết quả lưu tại: {output_file}")
+    # In báo cáo nhanh: chỉ tính trên câu đã chấm (câu lỗi / chưa chấm không tính là 0 điểm)
+    # Dòng checkpoint cũ không có cột "Đã chấm" -> chỉ câu chấm xong mới được ghi checkpoint
+    graded = [r for r in results if r.get("Đã chấm", True)]
+    ungraded = len(results) - len(graded)
+    total_score = sum(r["Điểm"] for r in graded)
+    print(f"   ✅ Đã xong! Kết quả lưu tại: {output_file} (checkpoint: {checkpoint})")
+    if failed:
+        print(f"   ⚠️ {failed} câu lỗi / chưa chấm -> chạy lại lệnh để làm tiếp")
+    if not graded:
+        print(f"   📊 Chưa chấm được câu nào ({ungraded}/{len(results)} câu chưa chấm)")
+        return
+    ungraded_note = f", {ungraded} câu chưa chấm không tính" if ungraded else ""
     if mode == "mcq":
         # Trắc nghiệm tính theo % đúng
-        accuracy = (total_score / len(test_cases)) * 100
-        print(f"   📊 Độ chính xác (Accuracy): {accuracy:.2f}% ({int(total_score)}/{len(test_cases)} câu đúng)")
+        accuracy = (total_score / len(graded)) * 100
+        print(f"   📊 Độ chính xác (Accuracy): {accuracy:.2f}% ({int(total_score)}/{len(graded)} câu đúng{ungraded_note})")
     else:
         # Tự luận tính điểm trung bình
-        avg_score = total_score / len(test_cases)
-        print(f"   📊 Điểm chất lượng TB: {avg_score:.2f}/10")
+        avg_score = total_score / len(graded)
+        print(f"   📊 Điểm chất lượng TB: {avg_score:.2f}/10 (trên {len(graded)} câu{ungraded_note})")
+
+def create_graph_service(llm_backend):
+    from src.services.graph_rag_service import GraphRAGService
+
+    if llm_backend == "stub":
+        # LLM giả lập (offline): đo pipeline truy xuất + chấm mà không gọi Groq
+        from src.utils.stub_llm import StubLLM
+        from src.utils.timing import LazyLoader
+        os.environ.setdefault("GROQ_API_KEY", "offline-stub")
+        service = GraphRAGService()
+        service._llm = LazyLoader(StubLLM, "LLM (stub)", service.timer)
+        return service
+    return GraphRAGService()
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--only", choices=["mcq", "essay"], default=None, help="Chỉ chạy 1 bộ câu hỏi")
+    parser.add_argument("--workers", type=int, default=None, help="Số câu xử lý song song")
+    parser.add_argument("--fresh", action="store_true", help="Bỏ checkpoint cũ, chạy lại từ đầu")
+    parser.add_argument("--limit", type=int, default=None, help="Chỉ lấy N câu đầu mỗi bộ")
+    parser.add_argument("--llm", choices=["groq", "stub"], default="groq", help="LLM trả lời")
+    parser.add_argument("--judge", choices=["groq", "offline"], default="groq",
+                        help="offline: chỉ dùng cache điểm + chấm trắc nghiệm cục bộ")
+    args = parser.parse_args()
+
     print("🚀 BẮT ĐẦU QUÁ TRÌNH ĐÁNH GIÁ TÁCH BIỆT")
+    eval_cfg = {**DEFAULT_EVAL_CFG, **(load_config().get("evaluation") or {})}
+    if args.workers:
+        eval_cfg["workers"] = args.workers
 
     # Init Graph Service
-    graph_service = GraphRAGService() if GraphRAGService else None
-
-    if not graph_service:
-        print("❌ Lỗi: Không khởi tạo được GraphRAGService.")
+    try:
+        graph_service = create_graph_service(args.llm)
+    except Exception as e:
+        print(f"❌ Lỗi: Không khởi tạo được GraphRAGService: {e}")
         return
+    judge = create_judge(args.judge, eval_cfg["judge_model"])
 
-    # 1. Đánh giá Trắc nghiệm (MCQ)
-    run_evaluation(
-        test_file="data/test_set_mcq.json",
-        output_file="ket_qua_trac_nghiem.xlsx",
-        mode="mcq",
-        graph_service=graph_service
-    )
-
-    # 2. Đánh giá Tự luận (Essay)
-    run_evaluation(
-        test_file="data/test_set_essay.json",
-        output_file="ket_qua_tu_luan.xlsx",
-        mode="essay",
-        graph_service=graph_service
-    )
+    try:
+        # 1. Đánh giá Trắc nghiệm (MCQ)
+        if args.only in (None, "mcq"):
+            run_evaluation(
+                test_file="data/test_set_mcq.json",
+                output_file="ket_qua_trac_nghiem.xlsx",
+                mode="mcq",
+                graph_service=graph_service,
+                judge=judge, eval_cfg=eval_cfg, resume=not args.fresh, limit=args.limit
+            )
+
+        # 2. Đánh giá Tự luận (Essay)
+        if args.only in (None, "essay"):
+            run_evaluation(
+                test_file="data/test_set_essay.json",
+                output_file="ket_qua_tu_luan.xlsx",
+                mode="essay",
+                graph_service=graph_service,
+                judge=judge, eval_cfg=eval_cfg, resume=not args.fresh, limit=args.limit
+            )
+    finally:
+        graph_service.close()
 
     print("\n🎉 HOÀN TẤT TOÀN BỘ!")
 
@@ -1,7 +1,10 @@
 # File: scripts/extract_pdf.py
 import os
 import re
+import time
+import argparse
 import unicodedata
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 import pdfplumber  # <--- Thay thế PyPDF2 để đọc tiếng Việt chuẩn hơn
 
@@ -9,37 +12,47 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 RAW_DIR = os.path.join(BASE_DIR, "data", "raw")
 CLEAN_DIR = os.path.join(BASE_DIR, "data", "cleaned")
 
-def extract_text_from_pdf(pdf_path):
+# File lớn hơn ngưỡng này được chia thành nhiều khoảng trang để chạy song song
+PAGES_PER_TASK = 50
+
+def extract_page_range(pdf_path, start, end, part_path):
     """
-    Dùng pdfplumber để trích xuất văn bản, giữ bố cục tốt hơn.
+    Worker: trích xuất các trang [start, end) và ghi thẳng ra file tạm (không gom chuỗi lớn trong RAM).
+    Trả về (số trang đã đọc, thời gian).
     """
-    text = ""
+    t0 = time.perf_counter()
+    n_pages = 0
+    with open(part_path, "w", encoding="utf-8", newline="") as out:
+        try:
+            with pdfplumber.open(pdf_path) as pdf:
+                for page in pdf.pages[start:end]:
+                    out.write((page.extract_text() or "") + "\n")
+                    page.close()  # Giải phóng cache của trang
+                    n_pages += 1
+        except Exception as e:
+            print(f"⚠️ Lỗi đọc file PDF {os.path.basename(pdf_path)} (trang {start}-{end}): {e}")
+    return n_pages, time.perf_counter() - t0
+
+def count_pages(pdf_path):
     try:
         with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                # extract_text() của pdfplumber thông minh hơn PyPDF2
-                page_text = page.extract_text() or ""
-                text += page_text + "\n"
+            return len(pdf.pages)
     except Exception as e:
         print(f"⚠️ Lỗi đọc file PDF {os.path.basename(pdf_path)}: {e}")
-    return text
+        return 0
 
-def clean_text(text):
+def iter_clean_lines(lines):
     """
-    Làm sạch văn bản luật chuyên sâu.
+    Làm sạch văn bản luật theo từng dòng (streaming): chuẩn hóa Unicode, bỏ số trang, gộp dòng trống.
     """
-    if not text: return ""
-
-    # 1. Chuẩn hóa Unicode (Rất quan trọng với tiếng Việt)
-    # Chuyển các ký tự tổ hợp về dựng sẵn (NFC)
-    text = unicodedata.normalize('NFC', text)
-
-    # 2. Xóa các dòng tiêu đề/footer rác thường gặp trong văn bản luật
-    lines = text.split('\n')
-    cleaned_lines = []
+    started = False
+    pending_blank = False
     for line in lines:
-        line = line.strip()
+        # 1. Chuẩn hóa Unicode (Rất quan trọng với tiếng Việt)
+        # Chuyển các ký tự tổ hợp về dựng sẵn (NFC)
+        line = unicodedata.normalize('NFC', line).strip()
 
+        # 2. Xóa các dòng tiêu đề/footer rác thường gặp trong văn bản luật
         # Bỏ qua dòng số trang (Ví dụ: "Trang 1", "Page 5/10")
         if re.match(r'^(Trang|Page)\s*\d+(\/\d+)?$', line, re.IGNORECASE):
             continue
@@ -47,36 +60,90 @@ def clean_text(text):
         if re.match(r'^\d+$', line):
             continue
 
-        cleaned_lines.append(line)
-
-    text = "\n".join(cleaned_lines)
-
-    # 3. Gộp các dòng bị ngắt quãng vô lý (tùy chọn, nhưng tốt cho RAG)
-    # Xử lý: "Cộng hòa xã \n hội chủ nghĩa" -> "Cộng hòa xã hội chủ nghĩa"
-    # (Phần này regex phức tạp, tạm thời để đơn giản là xóa dòng thừa)
-    text = re.sub(r'\n{3,}', '\n\n', text) # Tối đa 2 dòng trống liên tiếp
-
-    return text.strip()
+        # 3. Tối đa 1 dòng trống liên tiếp, bỏ dòng trống ở đầu/cuối văn bản
+        if not line:
+            pending_blank = started
+            continue
+        if pending_blank:
+            yield ""
+            pending_blank = False
+        started = True
+        yield line
+
+def write_clean_output(part_paths, txt_path):
+    """Ghép các file tạm theo thứ tự trang, làm sạch từng dòng và ghi dần ra _clean.txt"""
+    def raw_lines():
+        for part in part_paths:
+            with open(part, "r", encoding="utf-8", newline="\n") as f:
+                for line in f:
+                    yield line.rstrip("\n")
+
+    with open(txt_path, "w", encoding="utf-8") as out:
+        for i, line in enumerate(iter_clean_lines(raw_lines())):
+            out.write(line if i == 0 else "\n" + line)
+
+    for part in part_paths:
+        os.remove(part)
+
+def main():
+    parser = argparse.ArgumentParser()
+    # Có thể truyền danh sách file cụ thể (chế độ incremental của run_pipeline.py)
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--pages-per-task", type=int, default=PAGES_PER_TASK)
+    args = parser.parse_args()
 
-if __name__ == "__main__":
     os.makedirs(CLEAN_DIR, exist_ok=True)
 
-    files = [f for f in os.listdir(RAW_DIR) if f.endswith(".pdf")]
+    files = args.files or [f for f in os.listdir(RAW_DIR) if f.endswith(".pdf")]
 
     if not files:
         print("⚠️ Không tìm thấy file PDF nào trong data/raw/")
-    else:
-        print(f"🚀 Đang xử lý {len(files)} file PDF với pdfplumber...")
+        return
 
-        for filename in tqdm(files):
-            pdf_path = os.path.join(RAW_DIR, filename)
-            txt_name = filename.replace(".pdf", "_clean.txt")
-            txt_path = os.path.join(CLEAN_DIR, txt_name)
+    print(f"🚀 Đang xử lý {len(files)} file PDF với pdfplumber ({args.workers} process)...")
+    t_start = time.perf_counter()
 
-            raw_text = extract_text_from_pdf(pdf_path)
-            clean = clean_text(raw_text)
+    # 1. Chia việc: mỗi file -> một hoặc nhiều khoảng trang
+    tasks = {}    # filename -> danh sách file tạm theo thứ tự trang
+    pending = {}  # filename -> số task chưa xong
+    stats = {}    # filename -> [số trang, tổng thời gian CPU, thời điểm bắt đầu]
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        page_counts = dict(zip(files, pool.map(count_pages, [os.path.join(RAW_DIR, f) for f in files])))
 
-            with open(txt_path, "w", encoding="utf-8") as f:
-                f.write(clean)
+        futures = {}
+        for filename in files:
+            pdf_path = os.path.join(RAW_DIR, filename)
+            txt_path = os.path.join(CLEAN_DIR, filename.replace(".pdf", "_clean.txt"))
+            n_pages = page_counts[filename]
+            ranges = [(s, min(s + args.pages_per_task, n_pages)) for s in range(0, n_pages, args.pages_per_task)] or [(0, 0)]
+
+            tasks[filename] = [f"{txt_path}.part{i:04d}" for i in range(len(ranges))]
+            pending[filename] = len(ranges)
+            stats[filename] = [0, 0.0, time.perf_counter()]
+            for (start, end), part in zip(ranges, tasks[filename]):
+                futures[pool.submit(extract_page_range, pdf_path, start, end, part)] = filename
+
+        # 2. File nào xong hết các khoảng trang thì ghép + làm sạch ngay
+        with tqdm(total=len(files)) as bar:
+            for fut in as_completed(futures):
+                filename = futures[fut]
+                n_pages, elapsed = fut.result()
+                stats[filename][0] += n_pages
+                stats[filename][1] += elapsed
+                pending[filename] -= 1
+                if pending[filename] == 0:
+                    txt_path = os.path.join(CLEAN_DIR, filename.replace(".pdf", "_clean.txt"))
+                    write_clean_output(tasks[filename], txt_path)
+                    stats[filename][2] = time.perf_counter() - stats[filename][2]
+                    bar.update(1)
+
+    # 3. Báo cáo thời gian từng file
+    print(f"\n{'File':<50} {'Trang':>6} {'Xử lý (s)':>10} {'Xong lúc (s)':>13}")
+    for filename in sorted(files, key=lambda f: -stats[f][1]):
+        n_pages, cpu, wall = stats[filename]
+        print(f"{filename[:50]:<50} {n_pages:>6} {cpu:>10.2f} {wall:>13.2f}")
+    print(f"✅ Đã xử lý xong tất cả file PDF! ({time.perf_counter() - t_start:.2f}s)")
 
-        print("✅ Đã xử lý xong tất cả file PDF!")
+if __name__ == "__main__":
+    main()
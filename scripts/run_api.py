@@ -0,0 +1,315 @@
+# File: scripts/run_api.py
+"""
+HTTP API (aiohttp) cho truy xuất / hỏi đáp:
+  POST /search    {"query", "k"?, "mode"?: hybrid|bm25_only|vector_only, "filters"?, "timeout_ms"?}
+  POST /retrieve  {"query", "filters"?, "timeout_ms"?}
+  POST /answer    {"query", "k"?, "stream"?: bool, "timeout_ms"?}   (stream -> NDJSON từng token)
+  GET  /health, GET /metrics (Prometheus)
+/search và /retrieve đi qua MicroBatcher: các request tới trong vài ms được gộp thành 1 lần
+search_batch / retrieve_batch (embed, FAISS, BM25, rerank theo lô). Hàng đợi đầy -> 503, quá hạn -> 504.
+Chạy: python scripts/run_api.py [--host 0.0.0.0] [--port 8000] [--workers 4]
+--workers > 1: pre-fork - process cha load / mmap artifact chỉ đọc (FAISS, BM25, corpus, bitmap lọc) 1 lần rồi fork
+các worker dùng chung bộ nhớ đó (copy-on-write), cùng accept trên 1 socket. Embedder (client gRPC) và reranker (torch)
+không an toàn khi fork -> mỗi worker tự tạo trong on_startup. /metrics và /health là số liệu của từng worker.
+"""
+import sys
+import os
+import json
+import asyncio
+import argparse
+from functools import partial
+
+# Thêm root project vào sys.path để import được src
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from aiohttp import web
+
+from src.core.filters import FILTER_FIELDS
+from src.services.batcher import MicroBatcher, QueueFullError, DeadlineExceeded
+from src.services.retrieval_service import LegalRetriever
+from src.utils.prefork import bind_socket, serve_prefork
+
+SEARCH_MODES = ("hybrid", "bm25_only", "vector_only")
+
+DEFAULT_API_CFG = {
+    "host": "0.0.0.0",
+    "port": 8000,
+    "workers": 1,
+    "max_batch_size": 32,
+    "max_wait_ms": 5,
+    "max_queue": 256,
+    "request_timeout_ms": 10000,
+    "answer_concurrency": 4,
+    "answer_max_pending": 32,
+}
+
+_dumps = partial(json.dumps, ensure_ascii=False, default=str)
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _filters_key(filters):
+    return json.dumps(filters or {}, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def _group_by(items, key_fn):
+    """-> {key: [vị trí trong lô]} giữ thứ tự xuất hiện"""
+    groups = {}
+    for pos, item in enumerate(items):
+        groups.setdefault(key_fn(item), []).append(pos)
+    return groups
+
+
+class QueryAPI:
+    """Giữ LegalRetriever, các MicroBatcher và GraphRAGService (tạo ở lần /answer đầu tiên)"""
+
+    def __init__(self, config_path: str = "config/config.yaml"):
+        self.retriever = LegalRetriever(config_path)
+        self.config_path = config_path
+        self.cfg = self.retriever.cfg
+        self.api_cfg = {**DEFAULT_API_CFG, **self.cfg.get("api", {})}
+        self.tracer = self.retriever.tracer
+        self.searcher = self.retriever.searcher
+
+        batch_kwargs = dict(
+            max_batch_size=self.api_cfg["max_batch_size"],
+            max_wait_ms=self.api_cfg["max_wait_ms"],
+            max_queue=self.api_cfg["max_queue"],
+        )
+        self.search_batcher = MicroBatcher(self._process_search, name="search", **batch_kwargs)
+        self.retrieve_batcher = MicroBatcher(self._process_retrieve, name="retrieve", **batch_kwargs)
+
+        self._graph_service = None
+        self._graph_lock = asyncio.Lock()
+        self._answer_sem = asyncio.Semaphore(self.api_cfg["answer_concurrency"])
+        self._answer_pending = 0
+
+    # ---------- Xử lý theo lô (chạy trên thread của MicroBatcher) ----------
+    def _process_search(self, items):
+        """Các request cùng (k, filters) dùng chung 1 lần search_batch; mode khác nhau dùng chung BM25 / FAISS"""
+        results = [None] * len(items)
+        groups = _group_by(items, lambda it: (it["k"], _filters_key(it["filters"])))
+        for positions in groups.values():
+            first = items[positions[0]]
+            modes = tuple(dict.fromkeys(items[p]["mode"] for p in positions))
+            try:
+                out = self.searcher.search_batch([items[p]["query"] for p in positions], k=first["k"],
+                                                 modes=modes, filters=first["filters"])
+            except Exception as e:
+                for p in positions:
+                    results[p] = e
+                continue
+            for i, p in enumerate(positions):
+                results[p] = out[items[p]["mode"]][i]
+        return results
+
+    def _process_retrieve(self, items):
+        results = [None] * len(items)
+        groups = _group_by(items, lambda it: _filters_key(it["filters"]))
+        for positions in groups.values():
+            try:
+                contexts = self.retriever.retrieve_batch([items[p]["query"] for p in positions],
+                                                         filters=items[positions[0]]["filters"])
+            except Exception as e:
+                for p in positions:
+                    results[p] = e
+                continue
+            for i, p in enumerate(positions):
+                results[p] = contexts[i]
+        return results
+
+    # ---------- Vòng đời ----------
+    def preload(self):
+        """Load FAISS / bitmap lọc / embedder / reranker trước khi nhận request (chạy trong từng worker)"""
+        self.searcher.load_artifacts()
+        self.retriever.warmup()
+        print(self.retriever.timer.report())
+
+    async def on_startup(self, app):
+        # Lô đầu tiên không phải gánh thời gian load; pre-fork: FAISS / bitmap đã load ở process cha,
+        # ở đây chỉ tạo embedder + reranker riêng của worker
+        await asyncio.to_thread(self.preload)
+        await self.search_batcher.start()
+        await self.retrieve_batcher.start()
+
+    async def on_cleanup(self, app):
+        await self.search_batcher.stop()
+        await self.retrieve_batcher.stop()
+        if self._graph_service is not None:
+            self._graph_service.close()
+
+    async def graph_service(self):
+        if self._graph_service is None:
+            async with self._graph_lock:
+                if self._graph_service is None:
+                    from src.services.graph_rag_service import GraphRAGService
+                    self._graph_service = await asyncio.to_thread(
+                        GraphRAGService, config_path=self.config_path)
+        return self._graph_service
+
+    # ---------- Helpers ----------
+    def _timeout(self, body):
+        """Deadline của request (giây): timeout_ms do client gửi, không vượt quá cấu hình"""
+        limit = self.api_cfg["request_timeout_ms"]
+        timeout_ms = body.get("timeout_ms", limit)
+        if not isinstance(timeout_ms, (int, float)) or timeout_ms <= 0:
+            raise BadRequest("timeout_ms phải là số dương")
+        return min(timeout_ms, limit) / 1000.0
+
+    @staticmethod
+    async def _read_body(request):
+        try:
+            body = await request.json()
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            raise BadRequest("Body phải là JSON")
+        if not isinstance(body, dict):
+            raise BadRequest("Body phải là JSON object")
+        query = body.get("query")
+        if not isinstance(query, str) or not query.strip():
+            raise BadRequest("Thiếu 'query'")
+        filters = body.get("filters")
+        if filters is not None:
+            if not isinstance(filters, dict):
+                raise BadRequest("'filters' phải là object")
+            unknown = set(filters) - set(FILTER_FIELDS)
+            if unknown:
+                raise BadRequest(f"Bộ lọc không hỗ trợ: {', '.join(sorted(unknown))} (chọn {', '.join(FILTER_FIELDS)})")
+        return body
+
+    @staticmethod
+    def _read_k(body, default):
+        k = body.get("k", default)
+        if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= 100:
+            raise BadRequest("'k' phải là số nguyên 1..100")
+        return k
+
+    # ---------- Endpoints ----------
+    async def search(self, request):
+        body = await self._read_body(request)
+        mode = body.get("mode", "hybrid")
+        if mode not in SEARCH_MODES:
+            raise BadRequest(f"'mode' phải là một trong {', '.join(SEARCH_MODES)}")
+        item = {"query": body["query"], "k": self._read_k(body, self.searcher.final_topk),
+                "mode": mode, "filters": body.get("filters")}
+        results = await self.search_batcher.submit(item, timeout=self._timeout(body))
+        return web.json_response({"query": body["query"], "mode": mode, "results": results}, dumps=_dumps)
+
+    async def retrieve(self, request):
+        body = await self._read_body(request)
+        item = {"query": body["query"], "filters": body.get("filters")}
+        contexts = await self.retrieve_batcher.submit(item, timeout=self._timeout(body))
+        return web.json_response({"query": body["query"], "contexts": contexts}, dumps=_dumps)
+
+    async def answer(self, request):
+        body = await self._read_body(request)
+        timeout = self._timeout(body)
+        k = self._read_k(body, 4)
+        # Câu trả lời bị giới hạn bởi LLM (không gộp lô được): giới hạn số request chờ thay vì xếp hàng vô hạn
+        if self._answer_pending >= self.api_cfg["answer_max_pending"]:
+            raise QueueFullError(f"answer: đã có {self._answer_pending} request đang chờ")
+        self._answer_pending += 1
+        try:
+            service = await asyncio.wait_for(self.graph_service(), timeout)
+            async with self._answer_sem:
+                if body.get("stream"):
+                    # Deadline áp cho tới khi có stream (retrieval + graph); đã gửi token thì không cắt giữa chừng
+                    stream = await asyncio.wait_for(service.astream_query(body["query"], k), timeout)
+                    return await self._stream_answer(request, stream)
+                answer, meta, _ = await asyncio.wait_for(service.aquery(body["query"], k), timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"answer: quá hạn {timeout * 1000:.0f} ms")
+        finally:
+            self._answer_pending -= 1
+        return web.json_response({"query": body["query"], "answer": answer, "meta": meta}, dumps=_dumps)
+
+    @staticmethod
+    async def _stream_answer(request, stream):
+        """NDJSON: mỗi dòng {"token": ...}, dòng cuối {"meta": ...}"""
+        resp = web.StreamResponse(headers={"Content-Type": "application/x-ndjson; charset=utf-8"})
+        await resp.prepare(request)
+        async for token in stream:
+            await resp.write((_dumps({"token": token}) + "\n").encode("utf-8"))
+        await resp.write((_dumps({"meta": stream.meta}) + "\n").encode("utf-8"))
+        await resp.write_eof()
+        return resp
+
+    async def health(self, request):
+        return web.json_response({"status": "ok", "batchers": {
+            "search": self.search_batcher.stats(), "retrieve": self.retrieve_batcher.stats()}})
+
+    async def metrics(self, request):
+        lines = [self.tracer.prometheus().rstrip("\n")]
+        for batcher in (self.search_batcher, self.retrieve_batcher):
+            for key, value in batcher.stats().items():
+                lines.append(f'rag_batcher_{key}{{batcher="{batcher.name}"}} {value}')
+        lines.append(f"rag_answer_pending {self._answer_pending}")
+        return web.Response(text="\n".join(lines) + "\n", content_type="text/plain")
+
+
+@web.middleware
+async def error_middleware(request, handler):
+    """Ánh xạ lỗi -> mã HTTP: 400 input sai, 503 quá tải (client thử lại sau), 504 quá hạn"""
+    try:
+        return await handler(request)
+    except BadRequest as e:
+        return web.json_response({"error": str(e)}, status=400, dumps=_dumps)
+    except QueueFullError as e:
+        return web.json_response({"error": str(e)}, status=503, headers={"Retry-After": "1"}, dumps=_dumps)
+    except DeadlineExceeded as e:
+        return web.json_response({"error": str(e)}, status=504, dumps=_dumps)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400, dumps=_dumps)
+    except web.HTTPException:
+        raise
+    except Exception as e:
+        print(f"❌ Lỗi xử lý {request.path}: {e}")
+        return web.json_response({"error": str(e)}, status=500, dumps=_dumps)
+
+
+def create_app(config_path: str = "config/config.yaml") -> web.Application:
+    api = QueryAPI(config_path)
+    app = web.Application(middlewares=[error_middleware])
+    app["api"] = api
+    app.on_startup.append(api.on_startup)
+    app.on_cleanup.append(api.on_cleanup)
+    app.router.add_post("/search", api.search)
+    app.router.add_post("/retrieve", api.retrieve)
+    app.router.add_post("/answer", api.answer)
+    app.router.add_get("/health", api.health)
+    app.router.add_get("/metrics", api.metrics)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP API truy xuất / hỏi đáp pháp luật (micro-batching)")
+    parser.add_argument("--config", default="config/config.yaml")
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None, help="Số process phục vụ (>1 = pre-fork)")
+    args = parser.parse_args()
+
+    app = create_app(args.config)
+    api = app["api"]
+    api_cfg = api.api_cfg
+    host = args.host or api_cfg["host"]
+    port = args.port or api_cfg["port"]
+    workers = args.workers or api_cfg["workers"]
+    print(f"🚀 API lắng nghe tại http://{host}:{port} ({workers} worker, batch ≤ {api_cfg['max_batch_size']}, "
+          f"chờ gom ≤ {api_cfg['max_wait_ms']} ms, hàng đợi ≤ {api_cfg['max_queue']})")
+    if workers <= 1:
+        web.run_app(app, host=host, port=port, print=None)
+        return
+
+    # Pre-fork: chỉ load artifact chỉ đọc ở process cha, các worker kế thừa (FAISS / BM25 / corpus mmap, bitmap lọc)
+    api.searcher.load_artifacts()
+    if isinstance(api.searcher.docs, list):
+        print("⚠️ docs/metas đang đọc từ JSON (object Python, mỗi worker sẽ dần copy riêng) - "
+              "chạy create_vector_index.py để tạo data/artifacts/corpus/ (mmap, dùng chung)")
+    sock = bind_socket(host, port)
+    serve_prefork(lambda worker_id: web.run_app(app, sock=sock, print=None), workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -23,10 +23,14 @@ st.caption("Hỏi đáp pháp luật dựa trên Văn bản pháp quy & Knowledg
 @st.cache_resource
 def load_chatbot():
     # Sử dụng đúng đường dẫn như trong file CLI cũ
-    return GraphRAGService(
+    bot = GraphRAGService(
         vector_db_path="data/artifacts",
         graph_path="data/knowledge_graph.json"
     )
+    # Vector DB / LLM load ở thread nền -> trang hiển thị ngay
+    bot.warmup(background=True)
+    print(bot.timer.report())
+    return bot
 
 try:
     with st.spinner("Đang khởi tạo hệ thống (Loading Vector DB & Graph)..."):
@@ -60,11 +64,12 @@ if prompt := st.chat_input("Nhập câu hỏi pháp luật của bạn..."):
         message_placeholder = st.empty()
 
         try:
-            # Gọi hàm query từ service của bạn
-            # Hàm trả về: answer, meta, latency (theo file run_cli_chat.py)
-            answer, meta, latency = bot.query(prompt)
-
-            message_placeholder.markdown(answer)
+            # Stream câu trả lời: hiển thị từng đoạn token ngay khi LLM sinh ra
+            stream = bot.stream_query(prompt)
+            message_placeholder.write_stream(stream)
+            answer, meta = stream.answer, stream.meta
+            latency = meta.get('latency', 0.0)
+            ttft = meta.get('ttft', latency)
 
             # Xử lý hiển thị Metadata (Nguồn trích dẫn)
             n_graph = meta.get('graph_edges_used', 0)
@@ -72,7 +77,7 @@ if prompt := st.chat_input("Nhập câu hỏi pháp luật của bạn..."):
             n_vector = len(vector_sources)
 
             # Tạo chuỗi thông tin phụ
-            meta_info = f"⏱️ Thời gian: {latency:.2f}s | 📊 Graph edges: {n_graph} | 📄 Vector docs: {n_vector}"
+            meta_info = f"⚡ Token đầu: {ttft:.2f}s | ⏱️ Tổng: {latency:.2f}s | 📊 Graph edges: {n_graph} | 📄 Vector docs: {n_vector}"
             if n_vector > 0:
                 # Lấy tên các nguồn (loại bỏ trùng lặp)
                 sources_list = list(set(vector_sources))
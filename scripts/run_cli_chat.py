@@ -19,6 +19,10 @@ def main():
         print(f"❌ Lỗi khởi tạo: {e}")
         return
 
+    # Load Vector DB / LLM ở thread nền trong lúc người dùng gõ câu hỏi
+    bot.warmup(background=True)
+    print(bot.timer.report())
+
     print("✅ Sẵn sàng! Nhập 'exit' để thoát.")
     while True:
         try:
@@ -28,12 +32,17 @@ def main():
             if not query:
                 continue
 
-            # Gọi hàm query
-            answer, meta, latency = bot.query(query)
-
+            # Stream câu trả lời: in từng đoạn token ngay khi LLM sinh ra
+            stream = bot.stream_query(query)
             print("\n=== TRẢ LỜI ===")
-            print(answer)
-            print(f"\n⏱️ Thời gian: {latency:.2f}s")
+            for token in stream:
+                print(token, end="", flush=True)
+            print()
+            meta = stream.meta
+            print(f"\n⚡ Token đầu tiên: {meta.get('ttft', 0.0):.2f}s | ⏱️ Tổng thời gian: {meta.get('latency', 0.0):.2f}s")
+            if meta.get("trace"):
+                stages = sorted(((k, v) for k, v in meta["trace"].items() if k != "total"), key=lambda kv: -kv[1])
+                print("🔬 Thời gian từng bước: " + " | ".join(f"{k} {v:.0f}ms" for k, v in stages[:6]))
 
             # --- FIX LỖI Ở ĐÂY ---
             # Code cũ: len(meta['graph_edges']) -> Gây lỗi vì key này không còn
@@ -55,6 +64,9 @@ def main():
             print(f"❌ Lỗi xử lý: {e}")
 
     bot.close()
+    print("\n" + bot.timer.report())
+    if bot.tracer.traces:
+        print(f"🔬 Trace: {bot.tracer.export_json('data/artifacts/traces.json')} (mở bằng chrome://tracing)")
     print("\nTạm biệt!")
 
 if __name__ == "__main__":
@@ -3,6 +3,21 @@ import shutil
 import subprocess
 import time
 import sys
+import argparse
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.utils.manifest import (
+    load_manifest, save_manifest, diff_sources, build_manifest, cleaned_name, chunks_name
+)
+
+RAW_DIR = "data/raw"
+CLEANED_DIR = "data/cleaned"
+CHUNKS_DIR = "data/chunks"
+ARTIFACTS_DIR = "data/artifacts"
+GRAPH_PATH = "data/knowledge_graph.json"
+MANIFEST_PATH = "data/manifest.json"
+CONFIG_PATH = "config/config.yaml"
 
 # Định nghĩa các thư mục dữ liệu cần dọn dẹp
 # Lưu ý: Không xóa 'data/raw' vì chứa file gốc
@@ -43,7 +58,7 @@ def clean_data():
             except Exception as e:
                 print(f"   ⚠️ Không thể xóa {file_path}: {e}")
 
-def run_step(script_name, description):
+def run_step(script_name, description, args=None):
     """Chạy một script python con"""
     print(f"\n🚀 BƯỚC: {description} ({script_name})...")
     start_time = time.time()
@@ -55,7 +70,7 @@ def run_step(script_name, description):
 
     try:
         # Gọi subprocess để chạy lệnh: python scripts/ten_file.py
-        result = subprocess.run([sys.executable, script_path], check=True)
+        result = subprocess.run([sys.executable, script_path] + list(args or []), check=True)
 
         elapsed = time.time() - start_time
         print(f"✅ Hoàn thành trong {elapsed:.2f} giây.")
@@ -67,11 +82,83 @@ def run_step(script_name, description):
         print(f"❌ Lỗi không mong muốn: {e}")
         sys.exit(1)
 
+def rerank_enabled():
+    """Token ID cho reranker chỉ cần khi reranker.apply = true (bỏ qua bước import transformers + tokenize corpus)"""
+    if not os.path.exists(CONFIG_PATH):
+        return False
+    import yaml
+    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+        return bool(((yaml.safe_load(f) or {}).get("reranker") or {}).get("apply", False))
+
+def run_rerank_tokens_step():
+    if rerank_enabled():
+        run_step("build_rerank_tokens.py", "Tokenize trước chunk cho Reranker")
+    else:
+        print("\n⏭️ Bỏ qua build_rerank_tokens.py (reranker.apply = false)")
+
+def write_manifest(hashes=None):
+    manifest = build_manifest(RAW_DIR, CLEANED_DIR, CHUNKS_DIR, ARTIFACTS_DIR, GRAPH_PATH, hashes)
+    save_manifest(manifest, MANIFEST_PATH)
+    print(f"\n🧾 Đã cập nhật manifest: {MANIFEST_PATH} ({len(manifest['documents'])} văn bản)")
+
+def run_incremental():
+    """
+    Chỉ xử lý lại văn bản được thêm / sửa / xóa so với manifest:
+    - PDF -> text -> chunks: chỉ chạy cho văn bản mới/sửa, xóa file trung gian của văn bản đã bỏ
+    - Index: docs.json/metas.json/BM25 dựng lại từ chunks (không gọi API);
+      vector lấy từ checkpoint theo hash nên chỉ embed chunk mới
+    - Graph: giữ topic cũ, chỉ gọi LLM tóm tắt điều luật thuộc văn bản thay đổi
+    """
+    manifest = load_manifest(MANIFEST_PATH)
+    if not manifest.get("documents"):
+        print("⚠️ Chưa có manifest -> chạy toàn bộ pipeline.")
+        return False
+
+    diff = diff_sources(manifest, RAW_DIR)
+    to_process = diff["added"] + diff["changed"]
+    print(f"\n🔍 Thêm: {len(diff['added'])} | Sửa: {len(diff['changed'])} | "
+          f"Xóa: {len(diff['removed'])} | Giữ nguyên: {len(diff['unchanged'])}")
+    if not to_process and not diff["removed"]:
+        print("✅ Không có văn bản nào thay đổi. Bỏ qua.")
+        return True
+
+    # 1. Xóa file trung gian của văn bản đã bị bỏ khỏi data/raw
+    for pdf in diff["removed"]:
+        for path in (os.path.join(CLEANED_DIR, cleaned_name(pdf)), os.path.join(CHUNKS_DIR, chunks_name(pdf))):
+            if os.path.exists(path):
+                os.remove(path)
+                print(f"   - Đã xóa: {path}")
+
+    # 2. Chỉ trích xuất & chia nhỏ văn bản mới/sửa
+    if to_process:
+        run_step("extract_pdf.py", "Trích xuất văn bản từ PDF (incremental)", to_process)
+        run_step("split_text.py", "Chia nhỏ văn bản theo Điều luật (incremental)", [cleaned_name(p) for p in to_process])
+
+    # 3. Index: chỉ embed chunk chưa có trong checkpoint vector
+    run_step("create_vector_index.py", "Cập nhật Vector Index & BM25")
+    run_rerank_tokens_step()
+
+    # 4. Graph: chỉ tóm tắt lại node của văn bản thay đổi
+    run_step("build_knowledge_graph.py", "Cập nhật Knowledge Graph",
+             ["--incremental", "--changed"] + to_process + diff["removed"])
+
+    write_manifest(diff["hashes"])
+    return True
+
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--incremental", action="store_true",
+                        help="Chỉ xử lý văn bản thêm/sửa/xóa so với data/manifest.json")
+    args = parser.parse_args()
+
     print("="*60)
     print("🤖  AUTO PIPELINE: RAW DATA -> KNOWLEDGE GRAPH")
     print("="*60)
 
+    if args.incremental and run_incremental():
+        print("\n🎉  CẬP NHẬT INCREMENTAL HOÀN TẤT!")
+        return
+
     # 1. Dọn dẹp dữ liệu cũ
     clean_data()
 
@@ -87,9 +174,14 @@ def main():
     # B4: Chunks -> Vector DB & BM25
     run_step("create_vector_index.py", "Tạo Vector Index & BM25")
 
+    # B4b: Chunks -> Token ID cho Reranker (bỏ tokenizer khỏi đường truy vấn)
+    run_rerank_tokens_step()
+
     # B5: Chunks -> Knowledge Graph (Cần Groq API)
     run_step("build_knowledge_graph.py", "Xây dựng Knowledge Graph (có AI tóm tắt)")
 
+    write_manifest()
+
     print("\n" + "="*60)
     print("🎉  XỬ LÝ HOÀN TẤT! HỆ THỐNG ĐÃ SẴN SÀNG.")
     print("👉  Bạn có thể chạy thử chatbot: python scripts/run_cli_chat.py")
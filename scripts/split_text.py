@@ -1,5 +1,6 @@
 # File: scripts/split_text.py
 import os
+import sys
 import json
 import re
 from tqdm import tqdm
@@ -38,10 +39,10 @@ def split_by_article(text):
 
     return valid_chunks
 
-def main():
+def main(files=None):
     print("✂️  Đang chia nhỏ văn bản (Refactored)...")
 
-    files = [f for f in os.listdir(CLEAN_DIR) if f.endswith(".txt")]
+    files = files or [f for f in os.listdir(CLEAN_DIR) if f.endswith(".txt")]
 
     if not files:
         print("⚠️ Không tìm thấy file .txt nào trong data/cleaned/. Hãy chạy extract_pdf.py trước.")
@@ -90,4 +91,5 @@ def main():
     print(f"✅ Đã xử lý xong {len(files)} file văn bản.")
 
 if __name__ == "__main__":
-    main()
+    # Có thể truyền danh sách file _clean.txt cụ thể (chế độ incremental của run_pipeline.py)
+    main(sys.argv[1:] or None)
@@ -0,0 +1,145 @@
+import os, json, mmap
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+
+
+class LazyTexts(Sequence):
+    """Danh sách văn bản đọc lười từ blob UTF-8 memory-mapped (chỉ decode khi truy cập)"""
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        start, end = int(self._offsets[idx]), int(self._offsets[idx + 1])
+        return self._blob[start:end].decode("utf-8")
+
+
+class LazyMetas(Sequence):
+    """
+    Metadata dạng cột: mỗi khóa là một mảng mã int32 (memory-mapped) + bảng giá trị (dictionary encoding).
+    Mã -1 = văn bản không có khóa đó. Dict của từng văn bản chỉ được dựng khi truy cập.
+    Cột gần như duy nhất theo từng văn bản (vd. chunk_id) thì bảng giá trị là LazyTexts để khỏi parse lúc khởi động.
+    """
+
+    def __init__(self, codes, values, n_docs):
+        self._codes = codes    # key -> np.ndarray[int32]
+        self._values = values  # key -> list giá trị / LazyTexts
+        self._n = n_docs
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += self._n
+        if not 0 <= idx < self._n:
+            raise IndexError(idx)
+        meta = {}
+        for key, codes in self._codes.items():
+            code = int(codes[idx])
+            if code >= 0:
+                meta[key] = self._values[key][code]
+        return meta
+
+    def column(self, key):
+        """Trả về (codes, values) của một cột để lọc/thống kê mà không dựng dict"""
+        return self._codes.get(key), self._values.get(key, [])
+
+
+def _write_blob(texts, blob_path, offsets_path):
+    offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+    with open(blob_path, "wb") as f:
+        for i, text in enumerate(texts):
+            data = text.encode("utf-8")
+            f.write(data)
+            offsets[i + 1] = offsets[i] + len(data)
+    np.save(offsets_path, offsets)
+
+
+def _open_blob(blob_path, offsets_path, handles):
+    offsets = np.load(offsets_path, mmap_mode="r")
+    if os.path.getsize(blob_path) == 0:
+        return LazyTexts(b"", offsets)
+    with open(blob_path, "rb") as f:
+        handle = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    handles.append(handle)
+    return LazyTexts(handle, offsets)
+
+
+def pack_corpus(docs, metas, out_dir):
+    """
+    Ghi corpus dạng packed:
+    - texts.bin: nội dung các chunk nối liền (UTF-8)
+    - text_offsets.npy: int64 (N+1), chunk i = texts.bin[offsets[i]:offsets[i+1]]
+    - meta_<col>.npy: mã int32 theo cột + meta_values.json: bảng giá trị từng cột
+      (cột chuỗi có nhiều giá trị khác nhau -> bảng giá trị ghi ra meta_<col>.bin + offsets)
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    _write_blob(docs, out_dir / "texts.bin", out_dir / "text_offsets.npy")
+
+    keys = []
+    for meta in metas:
+        for key in meta:
+            if key not in keys:
+                keys.append(key)
+
+    values, blob_columns = {}, []
+    for col, key in enumerate(keys):
+        lookup, table = {}, []
+        codes = np.full(len(metas), -1, dtype=np.int32)
+        for i, meta in enumerate(metas):
+            if key not in meta:
+                continue
+            value = meta[key]
+            marker = json.dumps(value, ensure_ascii=False, sort_keys=True)
+            if marker not in lookup:
+                lookup[marker] = len(table)
+                table.append(value)
+            codes[i] = lookup[marker]
+        np.save(out_dir / f"meta_{col}.npy", codes)
+        if len(table) > 64 and len(table) * 2 > len(metas) and all(isinstance(v, str) for v in table):
+            _write_blob(table, out_dir / f"meta_{col}.bin", out_dir / f"meta_{col}_offsets.npy")
+            blob_columns.append(key)
+        else:
+            values[key] = table
+
+    with open(out_dir / "meta_values.json", "w", encoding="utf-8") as f:
+        json.dump({"n_docs": len(docs), "keys": keys, "values": values, "blob_columns": blob_columns},
+                  f, ensure_ascii=False)
+
+
+class PackedCorpus:
+    """Mở corpus packed bằng mmap: khởi động gần như tức thì, nhiều process dùng chung page cache của OS"""
+
+    def __init__(self, in_dir):
+        in_dir = Path(in_dir)
+        self._handles = []
+        self.docs = _open_blob(in_dir / "texts.bin", in_dir / "text_offsets.npy", self._handles)
+
+        with open(in_dir / "meta_values.json", "r", encoding="utf-8") as f:
+            info = json.load(f)
+        codes, values = {}, dict(info["values"])
+        for col, key in enumerate(info["keys"]):
+            codes[key] = np.load(in_dir / f"meta_{col}.npy", mmap_mode="r")
+            if key in info.get("blob_columns", []):
+                values[key] = _open_blob(in_dir / f"meta_{col}.bin", in_dir / f"meta_{col}_offsets.npy", self._handles)
+        self.metas = LazyMetas(codes, values, info["n_docs"])
+
+    @staticmethod
+    def exists(in_dir):
+        return (Path(in_dir) / "text_offsets.npy").exists()
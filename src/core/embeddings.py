@@ -0,0 +1,244 @@
+import os, hashlib, zlib
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+try:
+    from src.utils.text_utils import preprocess_text, tokenize_vn
+except ImportError:
+    from text_utils import preprocess_text, tokenize_vn
+
+class EmbeddingProvider:
+    """
+    Giao diện chung cho các backend embedding (cùng chữ ký với LangChain Embeddings).
+    Lớp con chỉ cần cài đặt embed_documents(); embed_query() mặc định gọi lại embed_documents().
+    Không phụ thuộc LangChain lúc import; cần dùng với FAISS của LangChain thì bọc qua as_langchain_embeddings().
+    """
+    name = "base"
+
+    def embed_documents(self, texts):
+        raise NotImplementedError
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def embed_queries(self, texts):
+        """Embed nhiều câu hỏi trong 1 lần gọi (backend không hỗ trợ batch thì gọi lần lượt)"""
+        return [self.embed_query(t) for t in texts]
+
+
+class GoogleEmbeddingProvider(EmbeddingProvider):
+    """Google Generative AI Embeddings (cần mạng + GOOGLE_API_KEY)."""
+
+    def __init__(self, model="models/text-embedding-004", api_key=None):
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+        api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            print("⚠️ Cảnh báo: Không tìm thấy GOOGLE_API_KEY. Vector Search sẽ lỗi.")
+        self.name = f"google:{model}"
+        self.client = GoogleGenerativeAIEmbeddings(model=model, google_api_key=api_key)
+
+    def embed_documents(self, texts):
+        return self.client.embed_documents(list(texts))
+
+    def embed_query(self, text):
+        return self.client.embed_query(text)
+
+    def embed_queries(self, texts):
+        # 1 request batch, cùng task type với embed_query
+        return self.client.embed_documents(list(texts), task_type="RETRIEVAL_QUERY")
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """
+    Embedding chạy offline trên CPU bằng sentence-transformers.
+    runtime="onnx" dùng ONNX Runtime (sentence-transformers >= 3.2) để nhanh hơn trên CPU.
+    """
+
+    def __init__(self, model="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+                 runtime="torch", device="cpu", normalize=True):
+        from sentence_transformers import SentenceTransformer
+
+        kwargs = {"backend": runtime} if runtime != "torch" else {}
+        self.name = f"local:{model}:{runtime}"
+        self.model = SentenceTransformer(model, device=device, **kwargs)
+        self.normalize = normalize
+
+    def embed_documents(self, texts):
+        vecs = self.model.encode(list(texts), normalize_embeddings=self.normalize,
+                                 convert_to_numpy=True, show_progress_bar=False)
+        return vecs.astype(np.float32).tolist()
+
+    def embed_queries(self, texts):
+        return self.embed_documents(texts)
+
+
+class HashEmbeddingProvider(EmbeddingProvider):
+    """
+    Embedding giả lập offline (không mạng, không model): feature hashing từ đơn + cặp từ liền nhau
+    vào `dim` chiều có dấu, chuẩn hóa L2. Văn bản chung nhiều từ -> cosine cao; dùng cho test/benchmark.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.name = f"stub:hash-{dim}"
+
+    def _embed(self, text):
+        tokens = tokenize_vn(text)
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for feature in tokens + [a + " " + b for a, b in zip(tokens, tokens[1:])]:
+            h = zlib.crc32(feature.encode("utf-8"))
+            vec[h % self.dim] += 1.0 if (h >> 31) & 1 else -1.0
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm > 0 else vec
+
+    def embed_documents(self, texts):
+        return [self._embed(t).tolist() for t in texts]
+
+    def embed_queries(self, texts):
+        return self.embed_documents(texts)
+
+
+class CachedEmbeddingProvider(EmbeddingProvider):
+    """
+    Bọc một provider với cache 2 tầng, khóa = hash của văn bản đã chuẩn hóa (preprocess_text):
+    - LRU trong RAM (OrderedDict)
+    - Cache trên đĩa: <cache_dir>/<provider>/<kind>/<hash[:2]>/<hash>.npy
+    Query và document được cache riêng vì một số backend (Google) embed khác nhau cho 2 loại.
+    """
+
+    def __init__(self, provider, cache_dir="data/cache/embeddings", max_size=1024):
+        self.provider = provider
+        self.name = provider.name
+        self.max_size = max_size
+        self.lru = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        safe_name = "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in provider.name)
+        self.cache_dir = Path(cache_dir) / safe_name if cache_dir else None
+
+    @staticmethod
+    def cache_key(text):
+        return hashlib.sha1(preprocess_text(text).encode("utf-8")).hexdigest()
+
+    def _disk_path(self, kind, key):
+        return self.cache_dir / kind / key[:2] / f"{key}.npy"
+
+    def _get(self, kind, key):
+        lru_key = (kind, key)
+        if lru_key in self.lru:
+            self.lru.move_to_end(lru_key)
+            return self.lru[lru_key]
+        if self.cache_dir:
+            path = self._disk_path(kind, key)
+            if path.exists():
+                try:
+                    vec = np.load(path).tolist()
+                    self._remember(lru_key, vec)
+                    return vec
+                except Exception:
+                    pass
+        return None
+
+    def _remember(self, lru_key, vec):
+        self.lru[lru_key] = vec
+        self.lru.move_to_end(lru_key)
+        while len(self.lru) > self.max_size:
+            self.lru.popitem(last=False)
+
+    def _put(self, kind, key, vec):
+        self._remember((kind, key), vec)
+        if self.cache_dir:
+            path = self._disk_path(kind, key)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npy")
+            np.save(tmp, np.asarray(vec, dtype=np.float32))
+            os.replace(tmp, path)
+
+    def embed_query(self, text):
+        key = self.cache_key(text)
+        vec = self._get("query", key)
+        if vec is not None:
+            self.hits += 1
+            return vec
+        self.misses += 1
+        vec = self.provider.embed_query(text)
+        self._put("query", key, vec)
+        return vec
+
+    def embed_queries(self, texts):
+        return self._embed_cached(texts, "query", self.provider.embed_queries)
+
+    def embed_documents(self, texts):
+        return self._embed_cached(texts, "doc", self.provider.embed_documents)
+
+    def _embed_cached(self, texts, kind, embed_fn):
+        texts = list(texts)
+        keys = [self.cache_key(t) for t in texts]
+        out = [self._get(kind, k) for k in keys]
+        missing = [i for i, v in enumerate(out) if v is None]
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            # Văn bản trùng nhau trong cùng một lô chỉ embed một lần
+            first_by_key = {}
+            for i in missing:
+                first_by_key.setdefault(keys[i], i)
+            uniq = list(first_by_key.values())
+            vecs = embed_fn([texts[i] for i in uniq])
+            vec_by_key = {}
+            for i, vec in zip(uniq, vecs):
+                self._put(kind, keys[i], vec)
+                vec_by_key[keys[i]] = vec
+            for i in missing:
+                out[i] = vec_by_key[keys[i]]
+        return out
+
+
+def as_langchain_embeddings(provider):
+    """Bọc provider thành langchain_core Embeddings (import lười) để dùng với FAISS.load_local / from_embeddings"""
+    from langchain_core.embeddings import Embeddings
+
+    class _LangChainEmbeddings(Embeddings):
+        name = provider.name
+
+        def embed_documents(self, texts):
+            return provider.embed_documents(texts)
+
+        def embed_query(self, text):
+            return provider.embed_query(text)
+
+    return _LangChainEmbeddings()
+
+
+def build_embedder(cfg, use_cache=True):
+    """
+    Tạo embedding provider theo mục `index` trong config.yaml:
+      embedding_backend: "google" | "local" | "stub" (hash, offline - chỉ để test/benchmark)
+      embedding_model / local_embedding_model / local_embedding_runtime
+      embedding_cache_dir / embedding_cache_size
+    """
+    index_cfg = cfg.get("index", {})
+    backend = index_cfg.get("embedding_backend", "google")
+
+    if backend == "local":
+        provider = LocalEmbeddingProvider(
+            model=index_cfg.get("local_embedding_model", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"),
+            runtime=index_cfg.get("local_embedding_runtime", "torch"),
+        )
+    elif backend == "google":
+        provider = GoogleEmbeddingProvider(model=index_cfg.get("embedding_model", "models/text-embedding-004"))
+    elif backend == "stub":
+        provider = HashEmbeddingProvider(dim=index_cfg.get("stub_embedding_dim", 256))
+    else:
+        raise ValueError(f"embedding_backend không hợp lệ: {backend}")
+
+    if not use_cache:
+        return provider
+    return CachedEmbeddingProvider(
+        provider,
+        cache_dir=index_cfg.get("embedding_cache_dir", "data/cache/embeddings"),
+        max_size=index_cfg.get("embedding_cache_size", 1024),
+    )
@@ -0,0 +1,163 @@
+import time
+
+import numpy as np
+
+# Ví dụ spec (cú pháp faiss.index_factory, {nlist} được thay bằng faiss_nlist):
+#   "Flat"                     - tìm chính xác (mặc định)
+#   "IVF{nlist},Flat"          - chia cụm, chỉ quét nprobe cụm
+#   "IVF{nlist},PQ16"          - chia cụm + nén Product Quantization (16 byte/vector)
+#   "OPQ16,IVF{nlist},PQ16"    - thêm phép xoay OPQ trước PQ để giảm sai số nén
+#   "HNSW32,Flat"              - đồ thị HNSW (không cần train)
+DEFAULT_SPEC = "Flat"
+
+# faiss khuyến nghị >= 39 điểm train cho mỗi cụm IVF / mỗi centroid PQ (256 centroid)
+MIN_POINTS_PER_CENTROID = 39
+
+
+def resolve_spec(spec, n_vectors, nlist=100):
+    """Thay {nlist}; corpus nhỏ thì giảm nlist để mỗi cụm đủ điểm train"""
+    max_nlist = max(1, n_vectors // MIN_POINTS_PER_CENTROID)
+    if "{nlist}" in spec and nlist > max_nlist:
+        print(f"⚠️ Corpus {n_vectors} vector chỉ đủ train {max_nlist} cụm -> nlist {nlist} -> {max_nlist}")
+        nlist = max_nlist
+    return spec.replace("{nlist}", str(nlist))
+
+
+def build_index(vectors, spec=DEFAULT_SPEC, nlist=100, train_size=None, seed=0):
+    """
+    Tạo index theo spec, train (IVF/PQ/OPQ) trên corpus (hoặc mẫu train_size vector) rồi add toàn bộ.
+    Thứ tự vector giữ nguyên -> id FAISS i ứng với chunk thứ i (khớp docs.json / index_to_docstore_id).
+    """
+    import faiss
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    factory = resolve_spec(spec, len(vectors), nlist)
+    index = faiss.index_factory(vectors.shape[1], factory)
+    if not index.is_trained:
+        train = vectors
+        if train_size and train_size < len(vectors):
+            rng = np.random.default_rng(seed)
+            train = vectors[np.sort(rng.choice(len(vectors), train_size, replace=False))]
+        index.train(train)
+    index.add(vectors)
+    return index, factory
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Đặt tham số truy vấn cho đúng loại index (nprobe chỉ có nghĩa với IVF, efSearch với HNSW)"""
+    import faiss
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and nprobe:
+        ivf.nprobe = min(nprobe, ivf.nlist)
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if hnsw is not None and ef_search:
+        hnsw.efSearch = ef_search
+
+
+def filter_search_params(index, ids, bitmap=None):
+    """
+    SearchParameters giới hạn FAISS trong tập id của bộ lọc metadata.
+    ids liên tục -> IDSelectorRange (chỉ so sánh 2 số); ngược lại IDSelectorBitmap trên bitmap packed.
+    IVF / HNSW chỉ lọc bên trong các cụm được probe / các node đồ thị được duyệt: bộ lọc chọn lọc (vd 5 / 300 chunk)
+    với nprobe / efSearch gốc trả thiếu kết quả. Vì vậy nprobe / efSearch được nhân với ntotal / len(ids)
+    (số vector được phép đã duyệt ~ số vector một truy vấn không lọc duyệt), tối đa nlist / ntotal = quét hết.
+    Bộ lọc càng hẹp thì truy vấn càng gần quét toàn bộ (vector ngoài bộ lọc chỉ tốn 1 phép kiểm tra selector).
+    Trả về (params, keep_alive): keep_alive giữ bitmap numpy sống trong lúc search.
+    """
+    import faiss
+
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(ids) and ids[-1] - ids[0] + 1 == len(ids):
+        sel, keep_alive = faiss.IDSelectorRange(int(ids[0]), int(ids[-1]) + 1), None
+    else:
+        if bitmap is None:
+            mask = np.zeros(index.ntotal, dtype=bool)
+            mask[ids] = True
+            bitmap = np.packbits(mask, bitorder="little")
+        keep_alive = np.ascontiguousarray(bitmap, dtype=np.uint8)
+        sel = faiss.IDSelectorBitmap(index.ntotal, faiss.swig_ptr(keep_alive))
+
+    # Nghịch đảo độ chọn lọc của bộ lọc
+    scale = index.ntotal / max(len(ids), 1)
+    ivf = faiss.try_extract_index_ivf(index)
+    hnsw = getattr(faiss.downcast_index(index), "hnsw", None)
+    if ivf is not None:
+        nprobe = max(ivf.nprobe, min(ivf.nlist, int(np.ceil(ivf.nprobe * scale))))
+        params = faiss.SearchParametersIVF(sel=sel, nprobe=nprobe)
+    elif hnsw is not None:
+        ef_search = max(hnsw.efSearch, min(index.ntotal, int(np.ceil(hnsw.efSearch * scale))))
+        params = faiss.SearchParametersHNSW(sel=sel, efSearch=ef_search)
+    else:
+        params = faiss.SearchParameters(sel=sel)
+    return params, (sel, keep_alive)
+
+
+def read_index(path, mmap=False):
+    """
+    Đọc index FAISS. mmap=True: vector / inverted list được map thẳng từ file (chỉ đọc) thay vì copy vào RAM
+    -> nhiều process (worker pre-fork, nhiều phiên Streamlit) dùng chung page cache của OS.
+    IO_FLAG_MMAP_IFC (faiss >= 1.8) map được Flat / IVF / HNSW; bản cũ hơn dùng IO_FLAG_MMAP (chỉ IVF).
+    Không ghi đè file index tại chỗ khi còn process đang map nó: ghi file mới rồi os.replace
+    (create_vector_index.save_vector_db).
+    """
+    import faiss
+
+    path = str(path)
+    if not mmap:
+        return faiss.read_index(path)
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    try:
+        return faiss.read_index(path, flags)
+    except RuntimeError:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+
+
+def index_memory_bytes(index):
+    import faiss
+
+    return int(faiss.serialize_index(index).size)
+
+
+def evaluate_index(index, vectors, queries, k=10, exact=None):
+    """
+    So sánh index với tìm kiếm chính xác (IndexFlat cùng metric):
+    recall@k = tỉ lệ k hàng xóm đúng có trong k kết quả trả về; latency tính theo từng query.
+    """
+    import faiss
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    k = min(k, len(vectors))
+    if exact is None:
+        flat = faiss.IndexFlat(vectors.shape[1], index.metric_type)
+        flat.add(vectors)
+        _, exact = flat.search(queries, k)
+
+    latencies = []
+    found = np.empty((len(queries), k), dtype=np.int64)
+    for i in range(len(queries)):
+        t0 = time.perf_counter()
+        _, I = index.search(queries[i:i + 1], k)
+        latencies.append(time.perf_counter() - t0)
+        found[i] = I[0]
+
+    hits = sum(len(set(f.tolist()) & set(e.tolist())) for f, e in zip(found, exact))
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "recall_at_k": hits / (len(queries) * k) if len(queries) else 0.0,
+        "k": k,
+        "latency_ms_p50": float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+        "latency_ms_p95": float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+        "memory_bytes": index_memory_bytes(index),
+        "bytes_per_vector": index_memory_bytes(index) / max(index.ntotal, 1),
+    }
+
+
+def sample_queries(vectors, n=200, noise=0.01, seed=0):
+    """Query thử: lấy ngẫu nhiên vector trong corpus + nhiễu nhỏ (không cần gọi API embedding)"""
+    rng = np.random.default_rng(seed)
+    idx = rng.choice(len(vectors), min(n, len(vectors)), replace=False)
+    q = np.asarray(vectors, dtype=np.float32)[idx]
+    scale = noise * float(np.linalg.norm(q, axis=1).mean() or 1.0) / np.sqrt(q.shape[1])
+    return (q + rng.normal(0, scale, q.shape)).astype(np.float32)
@@ -0,0 +1,172 @@
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from src.utils.text_utils import DOC_TYPE_PREFIXES, article_number, parse_source_info
+
+# Bộ lọc hỗ trợ (truyền vào HybridSearcher.search / LegalRetriever.retrieve qua `filters`):
+#   {"source": "VanBanGoc_52.2014.QH13.pdf" | [...],   # tên văn bản (bỏ khoảng trắng, đuôi .pdf không bắt buộc)
+#    "doc_type": "QH" | "Nghị định" | [...],            # mã loại văn bản hoặc tên tiếng Việt
+#    "year": 2014 | [2013, 2014],                       # năm ban hành
+#    "article": 5 | [10, 20]}                           # số điều hoặc khoảng [từ, đến] (None = không giới hạn)
+# Các field AND với nhau, các giá trị trong cùng field OR với nhau.
+BITMAP_FIELDS = ("source", "doc_type", "year")
+FILTER_FIELDS = BITMAP_FIELDS + ("article",)
+
+
+def _norm_source(source):
+    name = str(source).strip()
+    return (name[:-4] if name.lower().endswith(".pdf") else name).lower()
+
+
+def _norm_doc_type(value):
+    value = str(value).strip()
+    return DOC_TYPE_PREFIXES.get(value.lower(), value.upper())
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+
+def pack_mask(mask):
+    """Bool (N,) -> bitmap uint8 ceil(N/8); bit i nằm ở byte i >> 3, bit i & 7 (cùng layout faiss.IDSelectorBitmap)"""
+    return np.packbits(np.asarray(mask, dtype=bool), bitorder="little")
+
+
+class MetadataFilterIndex:
+    """
+    Bitmap dựng sẵn theo từng giá trị metadata của chunk (cùng thứ tự docs.json / id FAISS):
+    - bitmaps_<field>.npy: (số giá trị, ceil(N/8)) uint8, hàng v = các chunk có field == values[field][v]
+    - article.npy: int32 số điều của chunk (-1 nếu chunk không bắt đầu bằng "Điều N")
+    - values.json: danh sách giá trị của từng field + n_docs
+    Lọc = OR các hàng bitmap trong field, AND giữa các field trên mảng byte (N/8), không duyệt metas.
+    """
+
+    def __init__(self, values, bitmaps, article, n_docs, cache_size=256):
+        self.values = values
+        self.bitmaps = bitmaps
+        self.article = article
+        self.n_docs = n_docs
+        # Khóa đã chuẩn hóa của từng giá trị -> hàng bitmap
+        self._rows = {
+            "source": {_norm_source(v): i for i, v in enumerate(values["source"])},
+            "doc_type": {v: i for i, v in enumerate(values["doc_type"])},
+            "year": {int(v): i for i, v in enumerate(values["year"])},
+        }
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def build(cls, docs, metas):
+        n = len(metas)
+        columns = {field: [None] * n for field in BITMAP_FIELDS}
+        article = np.full(n, -1, dtype=np.int32)
+        info_of = {}
+        for i, meta in enumerate(metas):
+            source = str(meta.get("source", "")).strip()
+            if source not in info_of:
+                info_of[source] = parse_source_info(source)
+            info = info_of[source]
+            columns["source"][i] = source
+            columns["doc_type"][i] = meta.get("doc_type") or info["doc_type"]
+            columns["year"][i] = meta.get("year") or info["year"]
+            number = meta.get("article")
+            if number is None:
+                number = article_number(docs[i])
+            if number is not None:
+                article[i] = int(number)
+
+        values, bitmaps = {}, {}
+        for field in BITMAP_FIELDS:
+            col = columns[field]
+            uniq = sorted({v for v in col if v is not None}, key=str)
+            row_of = {v: r for r, v in enumerate(uniq)}
+            codes = np.array([row_of.get(v, -1) for v in col], dtype=np.int64)
+            dense = np.zeros((len(uniq), n), dtype=bool)
+            known = codes >= 0
+            dense[codes[known], np.flatnonzero(known)] = True
+            values[field] = uniq
+            bitmaps[field] = np.packbits(dense, axis=1, bitorder="little")
+        return cls(values, bitmaps, article, n)
+
+    def save(self, out_dir):
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        for field in BITMAP_FIELDS:
+            np.save(out_dir / f"bitmaps_{field}.npy", self.bitmaps[field])
+        np.save(out_dir / "article.npy", self.article)
+        with open(out_dir / "values.json", "w", encoding="utf-8") as f:
+            json.dump({"n_docs": self.n_docs, "values": self.values}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, in_dir, mmap=True):
+        in_dir = Path(in_dir)
+        mode = "r" if mmap else None
+        with open(in_dir / "values.json", "r", encoding="utf-8") as f:
+            info = json.load(f)
+        bitmaps = {field: np.load(in_dir / f"bitmaps_{field}.npy", mmap_mode=mode) for field in BITMAP_FIELDS}
+        return cls(info["values"], bitmaps, np.load(in_dir / "article.npy", mmap_mode=mode), info["n_docs"])
+
+    @staticmethod
+    def exists(in_dir):
+        return (Path(in_dir) / "values.json").exists()
+
+    def _field_bitmap(self, field, wanted):
+        if field == "article":
+            if isinstance(wanted, (list, tuple)) and len(wanted) == 2:
+                lo, hi = wanted
+            else:
+                lo = hi = int(wanted)
+            art = np.asarray(self.article)
+            mask = art >= 0
+            if lo is not None:
+                mask &= art >= int(lo)
+            if hi is not None:
+                mask &= art <= int(hi)
+            return pack_mask(mask)
+
+        norm = {"source": _norm_source, "doc_type": _norm_doc_type, "year": int}[field]
+        rows = sorted({self._rows[field][k] for k in map(norm, _as_list(wanted)) if k in self._rows[field]})
+        if not rows:
+            return np.zeros(self.bitmaps[field].shape[1], dtype=np.uint8)
+        return np.bitwise_or.reduce(self.bitmaps[field][rows], axis=0)
+
+    def bitmap(self, filters):
+        """Bitmap (packed) các chunk thỏa bộ lọc; None nếu không có điều kiện nào"""
+        active = {f: v for f, v in (filters or {}).items() if v is not None}
+        unknown = set(active) - set(FILTER_FIELDS)
+        if unknown:
+            raise ValueError(f"Bộ lọc không hỗ trợ: {', '.join(sorted(unknown))} (chọn {', '.join(FILTER_FIELDS)})")
+        if not active:
+            return None
+        result = None
+        for field in FILTER_FIELDS:
+            if field in active:
+                bits = self._field_bitmap(field, active[field])
+                result = bits if result is None else result & bits
+        return result
+
+    def select(self, filters):
+        """
+        -> (bitmap, ids) của bộ lọc (cache LRU theo bộ lọc), hoặc None nếu không lọc.
+        ids: np.int64 đã sắp; các chunk cùng văn bản nằm liền nhau nên thường là một khoảng liên tục.
+        """
+        key = json.dumps(filters or {}, sort_keys=True, ensure_ascii=False, default=str)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        bits = self.bitmap(filters)
+        selected = None
+        if bits is not None:
+            ids = np.flatnonzero(np.unpackbits(bits, count=self.n_docs, bitorder="little")).astype(np.int64)
+            selected = (bits, ids)
+        with self._lock:
+            self._cache[key] = selected
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return selected
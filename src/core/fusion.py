@@ -0,0 +1,66 @@
+import numpy as np
+
+FUSION_METHODS = ("rrf", "combsum", "combmnz")
+
+
+def _minmax(scores):
+    lo, hi = scores.min(), scores.max()
+    return (scores - lo) / (hi - lo) if hi > lo else np.ones_like(scores)
+
+
+def fuse(ranked_lists, scores=None, method="rrf", weights=None, K=60, topk=10):
+    """
+    Gộp N danh sách kết quả bằng phép toán mảng (không dict/sort toàn bộ ứng viên).
+    - ranked_lists: list mảng doc id đã sắp theo thứ hạng (id -1 của FAISS bị bỏ qua)
+    - scores: list mảng điểm tương ứng (điểm càng cao càng tốt), cần cho combsum/combmnz;
+      thiếu thì dùng điểm theo thứ hạng 1 - rank/len
+    - method: "rrf" = sum w / (K + rank) | "combsum" = sum w * điểm chuẩn hóa min-max |
+      "combmnz" = combsum * số danh sách chứa văn bản
+    Trả về (ids, fused_scores, hits): hits[j, i] = danh sách j có chứa ids[i].
+    Điểm bằng nhau giữ thứ tự xuất hiện đầu tiên (giống bản dict trước đây).
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f"fusion không hợp lệ: {method} (chọn {', '.join(FUSION_METHODS)})")
+    n_lists = len(ranked_lists)
+    if weights is None:
+        weights = [1.0] * n_lists
+
+    all_ids, contrib, owner = [], [], []
+    for j, ids in enumerate(ranked_lists):
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        keep = ids != -1
+        if method == "rrf":
+            part = 1.0 / (K + np.arange(1, len(ids) + 1, dtype=np.float64))
+        elif scores is not None and scores[j] is not None and len(scores[j]) == len(ids):
+            raw = np.asarray(scores[j], dtype=np.float64).ravel()
+            part = np.zeros(len(ids))
+            if keep.any():
+                part[keep] = _minmax(raw[keep])
+        else:
+            part = 1.0 - np.arange(len(ids), dtype=np.float64) / max(len(ids), 1)
+        all_ids.append(ids[keep])
+        contrib.append(weights[j] * part[keep])
+        owner.append(np.full(keep.sum(), j, dtype=np.int64))
+
+    if not all_ids or sum(len(a) for a in all_ids) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64), np.zeros((n_lists, 0), dtype=bool)
+
+    all_ids = np.concatenate(all_ids)
+    contrib = np.concatenate(contrib)
+    owner = np.concatenate(owner)
+
+    uniq, first, inverse = np.unique(all_ids, return_index=True, return_inverse=True)
+    fused = np.bincount(inverse, weights=contrib, minlength=len(uniq))
+    hits = np.zeros((n_lists, len(uniq)), dtype=bool)
+    hits[owner, inverse] = True
+    if method == "combmnz":
+        fused = fused * hits.sum(axis=0)
+
+    # Top-k bằng argpartition, rồi sắp (điểm giảm dần, vị trí xuất hiện đầu tiên tăng dần)
+    k = min(topk, len(uniq))
+    cand = np.argpartition(-fused, k - 1)[:k] if k < len(uniq) else np.arange(len(uniq))
+    # Các ứng viên bằng điểm ngưỡng nằm ngoài phần partition cũng phải được xét để tie-break đúng
+    if k < len(uniq):
+        cand = np.union1d(cand, np.flatnonzero(fused >= fused[cand].min()))
+    order = cand[np.lexsort((first[cand], -fused[cand]))][:k]
+    return uniq[order], fused[order], hits[:, order]
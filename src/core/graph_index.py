@@ -0,0 +1,193 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+from src.core.artifact_store import pack_corpus, PackedCorpus
+
+CSR_ARRAYS = ("out_indptr", "out_indices", "out_rel", "in_indptr", "in_indices", "in_rel")
+
+
+class GraphIndex:
+    """
+    Chỉ mục kề (adjacency) của Knowledge Graph dạng CSR với ID số nguyên:
+    - node_ids[i] <-> id_of[node_id]; relations[r] <-> rel_of[relation]
+    - out_*: cạnh đi (node -> các node được dẫn chiếu), in_*: cạnh đến (ngược lại)
+    Lấy hàng xóm của 1 node = cắt 1 đoạn mảng, không phải duyệt toàn bộ danh sách cạnh.
+    - nodes[i]: thuộc tính của node i (topic, source, ...) - list dict hoặc LazyMetas khi load từ đĩa
+    """
+
+    def __init__(self, node_ids, src, dst, rel, relations, nodes=None):
+        self.node_ids = list(node_ids)
+        self.nodes = nodes if nodes is not None else [{"id": n} for n in self.node_ids]
+        self._id_of = None
+        self.relations = list(relations)
+        self.rel_of = {r: i for i, r in enumerate(self.relations)}
+        n = len(self.node_ids)
+        self.out_indptr, self.out_indices, self.out_rel = self._csr(n, src, dst, rel)
+        self.in_indptr, self.in_indices, self.in_rel = self._csr(n, dst, src, rel)
+
+    @property
+    def id_of(self):
+        # Dựng ở lần tra cứu đầu tiên (bản load từ đĩa giữ node_ids dạng mmap)
+        if self._id_of is None:
+            self._id_of = {n: i for i, n in enumerate(self.node_ids)}
+        return self._id_of
+
+    @staticmethod
+    def _csr(n_nodes, rows, cols, rel):
+        order = np.argsort(rows, kind="stable")
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=n_nodes), out=indptr[1:])
+        return indptr, cols[order].astype(np.int32), rel[order].astype(np.int32)
+
+    @classmethod
+    def from_graph(cls, nodes, edges):
+        """nodes: list dict có "id"; edges: list dict {"from", "to", "relation"} (định dạng knowledge_graph.json)"""
+        node_ids = [node["id"] for node in nodes]
+        attrs = list(nodes)
+        id_of = {n: i for i, n in enumerate(node_ids)}
+        relations, rel_of = [], {}
+        src, dst, rel = [], [], []
+        for edge in edges:
+            # Node chỉ xuất hiện trong cạnh cũng được đánh ID để không mất cạnh
+            for key in ("from", "to"):
+                if edge[key] not in id_of:
+                    id_of[edge[key]] = len(node_ids)
+                    node_ids.append(edge[key])
+                    attrs.append({"id": edge[key]})
+            if edge["relation"] not in rel_of:
+                rel_of[edge["relation"]] = len(relations)
+                relations.append(edge["relation"])
+            src.append(id_of[edge["from"]])
+            dst.append(id_of[edge["to"]])
+            rel.append(rel_of[edge["relation"]])
+        return cls(
+            node_ids,
+            np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64), np.asarray(rel, dtype=np.int64),
+            relations, attrs,
+        )
+
+    def save(self, out_dir):
+        """
+        Ghi graph dạng nhị phân để load bằng mmap:
+        - out_*/in_*.npy: mảng CSR xuôi/ngược
+        - nodes/: bảng node ID + thuộc tính (định dạng packed của artifact_store)
+        - graph.json: danh sách relation + số node/cạnh
+        """
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        for name in CSR_ARRAYS:
+            np.save(out_dir / f"{name}.npy", getattr(self, name))
+        attrs = [{k: v for k, v in self.node(i).items() if k != "id"} for i in range(len(self.node_ids))]
+        pack_corpus(self.node_ids, attrs, out_dir / "nodes")
+        with open(out_dir / "graph.json", "w", encoding="utf-8") as f:
+            json.dump({"relations": self.relations, "n_nodes": len(self.node_ids), "n_edges": self.n_edges},
+                      f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, in_dir, mmap=True):
+        """Mở graph đã save(); mmap=True: mảng CSR và bảng node đọc trực tiếp từ page cache"""
+        in_dir = Path(in_dir)
+        with open(in_dir / "graph.json", "r", encoding="utf-8") as f:
+            info = json.load(f)
+        index = cls.__new__(cls)
+        for name in CSR_ARRAYS:
+            setattr(index, name, np.load(in_dir / f"{name}.npy", mmap_mode="r" if mmap else None))
+        corpus = PackedCorpus(in_dir / "nodes")
+        index._corpus = corpus  # giữ handle mmap
+        index.node_ids = corpus.docs
+        index.nodes = corpus.metas
+        index._id_of = None
+        index.relations = list(info["relations"])
+        index.rel_of = {r: i for i, r in enumerate(index.relations)}
+        return index
+
+    @staticmethod
+    def exists(in_dir):
+        return (Path(in_dir) / "graph.json").exists()
+
+    @property
+    def n_edges(self):
+        return len(self.out_indices)
+
+    def node(self, idx):
+        """Thuộc tính của node thứ idx (luôn có "id")"""
+        info = dict(self.nodes[idx])
+        info["id"] = self.node_ids[idx]
+        return info
+
+    def get_node(self, node_id):
+        idx = self.id_of.get(node_id)
+        return self.node(idx) if idx is not None else None
+
+    def neighbors(self, node, direction="out", relations=None, limit=None):
+        """Hàng xóm của một node -> list (node_id hàng xóm, relation)"""
+        if node not in self.id_of:
+            return []
+        rel_codes = self._rel_codes(relations)
+        return [(self.node_ids[v], self.relations[r])
+                for v, r, _ in self._neighbors(self.id_of[node], direction, rel_codes, limit)]
+
+    def _rel_codes(self, relations):
+        if not relations:
+            return None
+        return np.array([self.rel_of[r] for r in relations if r in self.rel_of], dtype=np.int32)
+
+    def _neighbors(self, u, direction, rel_codes, limit):
+        """Sinh (hàng xóm, relation code, is_reverse), đã lọc theo relation và giới hạn fan-out"""
+        count = 0
+        for reverse, (indptr, indices, rel) in (
+            (False, (self.out_indptr, self.out_indices, self.out_rel)),
+            (True, (self.in_indptr, self.in_indices, self.in_rel)),
+        ):
+            if (direction == "out" and reverse) or (direction == "in" and not reverse):
+                continue
+            start, end = indptr[u], indptr[u + 1]
+            nbrs, rels = indices[start:end], rel[start:end]
+            if rel_codes is not None:
+                mask = np.isin(rels, rel_codes)
+                nbrs, rels = nbrs[mask], rels[mask]
+            for v, r in zip(nbrs.tolist(), rels.tolist()):
+                if limit is not None and count >= limit:
+                    return
+                count += 1
+                yield v, r, reverse
+
+    def expand(self, seeds, max_hops=1, fanout=10, relations=None, direction="out", limit=None):
+        """
+        Mở rộng k bước (BFS) từ các node gốc.
+        - fanout: số hàng xóm tối đa mỗi node ở mỗi bước (int, hoặc list theo từng bước)
+        - relations: chỉ đi theo các quan hệ này (None = tất cả)
+        - direction: "out" | "in" | "both"
+        Trả về list (hop, from, relation, to) theo đúng chiều của cạnh, nhóm theo node gốc (thứ tự seeds)
+        rồi theo thứ tự kề; mỗi node bị cắt ở fanout hàng xóm. Khác cách quét cạnh cũ (thứ tự trong file,
+        không giới hạn mỗi node) nên thứ tự và các dòng bị cắt bởi max_context_edges có thể khác.
+        """
+        rel_codes = self._rel_codes(relations)
+        if rel_codes is not None and len(rel_codes) == 0:
+            return []
+
+        frontier = [self.id_of[s] for s in dict.fromkeys(seeds) if s in self.id_of]
+        visited = set(frontier)
+        seen_edges = set()
+        results = []
+        for hop in range(1, max_hops + 1):
+            hop_fanout = fanout[min(hop, len(fanout)) - 1] if isinstance(fanout, (list, tuple)) else fanout
+            next_frontier = []
+            for u in frontier:
+                for v, r, reverse in self._neighbors(u, direction, rel_codes, hop_fanout):
+                    edge = (v, r, u) if reverse else (u, r, v)
+                    if edge in seen_edges:
+                        continue
+                    seen_edges.add(edge)
+                    results.append((hop, self.node_ids[edge[0]], self.relations[r], self.node_ids[edge[2]]))
+                    if limit is not None and len(results) >= limit:
+                        return results
+                    if v not in visited:
+                        visited.add(v)
+                        next_frontier.append(v)
+            if not next_frontier:
+                break
+            frontier = next_frontier
+        return results
@@ -1,105 +1,224 @@
-import json, faiss, numpy as np, pickle
+import json, numpy as np
 import sys, os
 from pathlib import Path
-from collections import defaultdict
 from dotenv import load_dotenv
 
-# --- Thay đổi quan trọng: Dùng thư viện của Google thay vì SentenceTransformer ---
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-
 try:
     from src.utils.text_utils import tokenize_vn, preprocess_text
+    from src.core.bm25_index import SparseBM25
+    from src.core.artifact_store import PackedCorpus
+    from src.core.fusion import fuse
+    from src.core.faiss_index import read_index, set_search_params, filter_search_params
+    from src.core.filters import MetadataFilterIndex
+    from src.core.embeddings import build_embedder
+    from src.utils.timing import StartupTimer, LazyLoader
+    from src.utils.tracing import get_tracer
 except ImportError:
     sys.path.append(os.path.dirname(os.path.abspath(__file__)))
     from text_utils import tokenize_vn, preprocess_text
+    from bm25_index import SparseBM25
+    from artifact_store import PackedCorpus
+    from fusion import fuse
+    from faiss_index import read_index, set_search_params, filter_search_params
+    from filters import MetadataFilterIndex
+    from embeddings import build_embedder
+    from timing import StartupTimer, LazyLoader
+    from tracing import get_tracer
 
 def rrf_fuse(ranked_lists, weights=None, K=60, topk=10):
-    if weights is None:
-        weights = [1.0] * len(ranked_lists)
-
-    scores = defaultdict(float)
-    for lst, w in zip(ranked_lists, weights):
-        for rank, idx in enumerate(lst, start=1):
-            scores[idx] += w * (1.0 / (K + rank))
-
-    sorted_indices = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-    return [i for i, _ in sorted_indices][:topk]
+    ids, _, _ = fuse(ranked_lists, method="rrf", weights=weights, K=K, topk=topk)
+    return ids.tolist()
 
 class HybridSearcher:
-    def __init__(self, cfg):
+    _EMPTY = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+
+    def __init__(self, cfg, timer=None, tracer=None):
         self.cfg = cfg
+        self.timer = timer or StartupTimer("HybridSearcher")
+        # Đo thời gian từng stage (bm25 / embed / faiss / fusion) - xem src/utils/tracing.py
+        self.tracer = tracer or get_tracer(cfg)
         load_dotenv() # Load biến môi trường để lấy API Key
 
-        arts = Path(cfg["paths"]["artifacts_dir"])
+        self.arts = arts = Path(cfg["paths"]["artifacts_dir"])
         print("Loading artifacts...")
 
-        # Load metadata
-        self.docs = json.load(open(arts/"docs.json","r",encoding="utf-8"))
-        self.metas = json.load(open(arts/"metas.json","r",encoding="utf-8"))
-        self.bm25 = pickle.load(open(arts/"bm25.pkl","rb"))
-
-        # Load FAISS
-        # Đổi thành:
-        self.faiss = faiss.read_index(str(arts/"faiss.faiss"))
-        self.faiss.nprobe = cfg["index"].get("faiss_nprobe", 10)
-
-        # --- FIX LỖI Ở ĐÂY ---
-        # Thay vì dùng SentenceTransformer, ta khởi tạo Google Embeddings
-        # để khớp với file create_vector_index.py
-        api_key = os.getenv("GOOGLE_API_KEY")
-        if not api_key:
-            print("⚠️ Cảnh báo: Không tìm thấy GOOGLE_API_KEY. Vector Search sẽ lỗi.")
-
-        self.emb = GoogleGenerativeAIEmbeddings(
-            model="models/text-embedding-004", # Model bạn dùng để tạo index
-            google_api_key=api_key
-        )
-        print("✅ Đã load Google Embeddings (text-embedding-004)")
+        # Load metadata: ưu tiên corpus packed (mmap, đọc lười từng văn bản), fallback docs.json / metas.json
+        with self.timer.phase("corpus (docs/metas)"):
+            if PackedCorpus.exists(arts/"corpus"):
+                corpus = PackedCorpus(arts/"corpus")
+                self.docs, self.metas = corpus.docs, corpus.metas
+            else:
+                self.docs = json.load(open(arts/"docs.json","r",encoding="utf-8"))
+                self.metas = json.load(open(arts/"metas.json","r",encoding="utf-8"))
+
+        # Load BM25 (ma trận thưa CSR do create_vector_index.py tạo, memory-mapped)
+        with self.timer.phase("BM25"):
+            if (arts/"bm25").exists():
+                self.bm25 = SparseBM25.load(arts/"bm25", mmap=True)
+            else:
+                print("⚠️ Không tìm thấy data/artifacts/bm25/, đang tạo BM25 từ docs.json...")
+                self.bm25 = SparseBM25.build([tokenize_vn(d) for d in self.docs])
+
+        # FAISS và Embedding provider chỉ load ở lần search dense đầu tiên
+        # (mode bm25_only không bao giờ phải import faiss / model embedding)
+        self._faiss = LazyLoader(self._load_faiss, "FAISS index", self.timer)
+        self._emb = LazyLoader(self._load_embedder, "Embedding provider", self.timer)
+        # Bitmap lọc metadata: chỉ load ở truy vấn có `filters` đầu tiên
+        self._filters = LazyLoader(self._load_filters, "Metadata filters", self.timer)
 
         self.bm25_topk = cfg["retrieval"]["bm25_topk"]
+        # "sparse": nhân ma trận thưa trên toàn bộ posting | "wand": WAND thử nghiệm (thuần Python, chậm hơn "sparse", xem SparseBM25.topk_wand)
+        self.bm25_backend = cfg["retrieval"].get("bm25_backend", "sparse")
         self.dense_topk = cfg["retrieval"]["dense_topk"]
         self.rrf_K = cfg["retrieval"]["rrf_K"]
+        self.fusion = cfg["retrieval"].get("fusion", "rrf")
         self.final_topk = cfg["retrieval"]["final_topk"]
 
-    def search(self, query, k=None, mode="hybrid"):
+    def _load_faiss(self):
+        import faiss
+        # faiss_mmap: map file index thay vì đọc vào RAM (worker pre-fork / nhiều process dùng chung 1 bản)
+        index = read_index(self.arts/"faiss.faiss", mmap=self.cfg["index"].get("faiss_mmap", True))
+        # nprobe chỉ có tác dụng với IVF, efSearch với HNSW (index Flat bỏ qua cả hai)
+        set_search_params(index, self.cfg["index"].get("faiss_nprobe", 10), self.cfg["index"].get("faiss_ef_search", 64))
+        self._dense_higher_better = index.metric_type == faiss.METRIC_INNER_PRODUCT
+        return index
+
+    def _load_embedder(self):
+        # Embedding provider (google / local) + cache LRU & đĩa theo config `index`
+        # Phải cùng backend/model với lúc chạy create_vector_index.py
+        emb = build_embedder(self.cfg)
+        built_with = self.arts/"embedding.json"
+        if built_with.exists():
+            built_name = json.load(open(built_with, "r", encoding="utf-8")).get("name")
+            if built_name and built_name != emb.name:
+                print(f"⚠️ Cảnh báo: FAISS index được tạo bằng '{built_name}' nhưng đang dùng '{emb.name}'.")
+        print(f"✅ Đã load Embeddings ({emb.name})")
+        return emb
+
+    def _load_filters(self):
+        if MetadataFilterIndex.exists(self.arts/"filters"):
+            return MetadataFilterIndex.load(self.arts/"filters", mmap=True)
+        print("⚠️ Không tìm thấy data/artifacts/filters/, đang dựng bitmap lọc từ metas...")
+        return MetadataFilterIndex.build(self.docs, self.metas)
+
+    @property
+    def filter_index(self):
+        return self._filters.get()
+
+    @property
+    def faiss(self):
+        return self._faiss.get()
+
+    @property
+    def emb(self):
+        return self._emb.get()
+
+    def warmup(self):
+        """Load trước FAISS + embedding provider (gọi từ thread nền nếu muốn)"""
+        self._faiss.get()
+        self._emb.get()
+
+    def load_artifacts(self):
+        """
+        Load phần chỉ đọc từ file (FAISS, bitmap lọc; corpus + BM25 đã load trong __init__), không tạo embedder.
+        Pre-fork: gọi ở process cha để worker dùng chung; client mạng (gRPC) / model torch không an toàn
+        khi fork nên mỗi worker tự tạo bằng warmup() sau khi fork.
+        """
+        self._faiss.get()
+        self._filters.get()
+
+    def search(self, query, k=None, mode="hybrid", filters=None):
         """
         mode: 'hybrid', 'vector_only', 'bm25_only'
+        filters: {"source", "doc_type", "year", "article"} - xem src/core/filters.py
+        """
+        return self.search_batch([query], k=k, modes=(mode,), filters=filters)[mode][0]
+
+    def _bm25_batch(self, queries, selected=None):
+        """-> list (ids, scores) theo từng câu hỏi"""
+        with self.tracer.span("search.tokenize"):
+            tokenized = [tokenize_vn(q) for q in queries]
+        with self.tracer.span("search.bm25", n_queries=len(queries), filtered=selected is not None):
+            return self._bm25_topk(tokenized, selected)
+
+    def _bm25_topk(self, tokenized, selected):
+        if selected is not None:
+            # Có bộ lọc: chỉ chấm điểm các cột (văn bản) được phép, cho cả 2 backend
+            return self.bm25.topk_batch(tokenized, self.bm25_topk, doc_ids=selected[1])
+        if self.bm25_backend == "wand":
+            return [self.bm25.topk_wand(t, self.bm25_topk) for t in tokenized]
+        # 1 phép nhân ma trận thưa cho cả lô truy vấn
+        return self.bm25.topk_batch(tokenized, self.bm25_topk)
+
+    def _dense_batch(self, queries, selected=None):
+        try:
+            # Embed cả lô trong 1 request rồi 1 lần faiss.search (n_q, dim)
+            with self.tracer.span("search.embed", n_queries=len(queries)):
+                qv = np.asarray(self.emb.embed_queries(queries), dtype=np.float32).reshape(len(queries), -1)
+            index = self.faiss
+            with self.tracer.span("search.faiss", n_queries=len(queries), filtered=selected is not None):
+                if selected is not None:
+                    # Bộ lọc metadata -> ID selector: FAISS bỏ qua vector ngoài tập được phép
+                    params, _keep = filter_search_params(index, selected[1], selected[0])
+                    D, I = index.search(qv, self.dense_topk, params=params)
+                else:
+                    D, I = index.search(qv, self.dense_topk)
+            # Index L2: khoảng cách càng nhỏ càng tốt -> đổi dấu để mọi retriever đều "điểm cao = tốt"
+            sims = D if self._dense_higher_better else -D
+            return list(zip(I, sims))
+        except Exception as e:
+            print(f"❌ Lỗi Vector Search: {e}")
+            return [self._EMPTY for _ in queries]
+
+    def search_batch(self, queries, k=None, modes=("hybrid",), filters=None):
+        """
+        Tìm kiếm cho nhiều câu hỏi và nhiều mode cùng lúc -> {mode: [kết quả của từng câu hỏi]}.
+        BM25 / dense chỉ chạy 1 lần cho cả lô và dùng chung giữa các mode (hybrid dùng lại kết quả bm25_only, vector_only).
+        filters: áp dụng chung cho cả lô; chỉ văn bản thỏa bộ lọc được chấm điểm (BM25) / duyệt (FAISS).
         """
-        query = preprocess_text(query)
+        # Trace riêng nếu gọi trực tiếp; nằm trong trace của LegalRetriever / API thì là 1 span lồng bên trong
+        with self.tracer.trace("search"):
+            return self._search_batch(queries, k, modes, filters)
+
+    def _search_batch(self, queries, k, modes, filters):
+        queries = [preprocess_text(q) for q in queries]
         current_topk = k if k is not None else self.final_topk
+        selected = None
+        if filters:
+            with self.tracer.span("search.filter"):
+                selected = self.filter_index.select(filters)
+        if selected is not None and len(selected[1]) == 0:
+            return {mode: [[] for _ in queries] for mode in modes}
+        need_bm25 = any(m in ("hybrid", "bm25_only") for m in modes)
+        need_dense = any(m in ("hybrid", "vector_only") for m in modes)
 
         # 1. BM25 Search
-        bm25_rank = []
-        if mode in ["hybrid", "bm25_only"]:
-            tokenized_q = tokenize_vn(query)
-            bm25_scores = self.bm25.get_scores(tokenized_q)
-            bm25_rank = np.argsort(-bm25_scores)[:self.bm25_topk].tolist()
-
-            if mode == "bm25_only":
-                return self._format_results(bm25_rank, current_topk)
+        bm25_runs = self._bm25_batch(queries, selected) if need_bm25 and queries else [self._EMPTY for _ in queries]
 
         # 2. Dense Search (FAISS)
-        dense_rank = []
-        if mode in ["hybrid", "vector_only"]:
-            try:
-                # --- SỬA LẠI CÁCH GỌI EMBEDDING ---
-                # Google trả về list float, cần convert sang numpy array (1, 768)
-                vector_embedding = self.emb.embed_query(query)
-                qv = np.array([vector_embedding], dtype=np.float32)
-
-                D, I = self.faiss.search(qv, self.dense_topk)
-                dense_rank = I[0].tolist()
-            except Exception as e:
-                print(f"❌ Lỗi Vector Search: {e}")
-                dense_rank = []
-
-            if mode == "vector_only":
-                return self._format_results(dense_rank, current_topk)
-
-        # 3. Fusion (Hybrid)
-        weights = self.cfg["retrieval"].get("rrf_weights", [1.0, 1.0])
-        fused_indices = rrf_fuse(
-            [bm25_rank, dense_rank],
+        dense_runs = self._dense_batch(queries, selected) if need_dense and queries else [self._EMPTY for _ in queries]
+
+        out = {}
+        for mode in modes:
+            if mode == "bm25_only":
+                out[mode] = [self._format_results(ids.tolist(), current_topk) for ids, _ in bm25_runs]
+            elif mode == "vector_only":
+                out[mode] = [self._format_results(ids.tolist(), current_topk) for ids, _ in dense_runs]
+            else:
+                with self.tracer.span("search.fusion", method=self.fusion):
+                    out[mode] = [self._fuse([b, d], current_topk) for b, d in zip(bm25_runs, dense_runs)]
+        return out
+
+    def _fuse(self, runs, current_topk, names=("bm25", "dense")):
+        """
+        3. Fusion (Hybrid): gộp N retriever bằng phép toán mảng (retrieval.fusion: rrf | combsum | combmnz).
+        runs: list (ids, scores); cờ <name>_hit lấy từ ma trận hits, không phải `idx in list`.
+        """
+        weights = self.cfg["retrieval"].get("rrf_weights", [1.0] * len(runs))
+        ids, _, hits = fuse(
+            [r[0] for r in runs],
+            scores=[r[1] for r in runs],
+            method=self.fusion,
             weights=weights,
             K=self.rrf_K,
             topk=current_topk
@@ -107,15 +226,17 @@ class HybridSearcher:
 
         # Format kết quả trả về
         results = []
-        for rank, idx in enumerate(fused_indices):
-            if idx < len(self.docs) and idx != -1:
-                results.append({
+        for rank, idx in enumerate(ids.tolist()):
+            if idx < len(self.docs):
+                item = {
                     "rank": rank + 1,
+                    "id": idx,
                     "doc": self.docs[idx],
                     "meta": self.metas[idx],
-                    "bm25_hit": idx in bm25_rank,
-                    "dense_hit": idx in dense_rank
-                })
+                }
+                for j, name in enumerate(names):
+                    item[f"{name}_hit"] = bool(hits[j, rank])
+                results.append(item)
         return results
 
     def _format_results(self, indices, k):
@@ -124,6 +245,7 @@ class HybridSearcher:
             if idx < len(self.docs) and idx != -1:
                 results.append({
                     "rank": rank + 1,
+                    "id": idx,
                     "doc": self.docs[idx],
                     "meta": self.metas[idx]
                 })
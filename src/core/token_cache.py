@@ -0,0 +1,64 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+from src.utils.text_utils import chunk_hash
+
+
+def build_token_cache(docs, tokenizer, out_dir, model_name, max_length=512, batch_size=256):
+    """
+    Tokenize trước toàn bộ chunk cho reranker (không thêm token đặc biệt, cắt ở max_length):
+    - ids.npy: int32 token ID nối liền; offsets.npy: int64 (N+1), chunk i = ids[offsets[i]:offsets[i+1]]
+    - hashes.npy: sha1 (N, 20) của từng chunk -> phát hiện hàng lệch khi corpus đã đổi
+    - info.json: model + max_length đã dùng
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    offsets = np.zeros(len(docs) + 1, dtype=np.int64)
+    hashes = np.zeros((len(docs), 20), dtype=np.uint8)
+    parts = []
+    for start in range(0, len(docs), batch_size):
+        batch = [docs[i] for i in range(start, min(start + batch_size, len(docs)))]
+        enc = tokenizer(batch, add_special_tokens=False, truncation=True, max_length=max_length)["input_ids"]
+        for j, (text, ids) in enumerate(zip(batch, enc)):
+            i = start + j
+            parts.append(np.asarray(ids, dtype=np.int32))
+            offsets[i + 1] = offsets[i] + len(ids)
+            hashes[i] = np.frombuffer(bytes.fromhex(chunk_hash(text)), dtype=np.uint8)
+
+    np.save(out_dir / "ids.npy", np.concatenate(parts) if parts else np.zeros(0, dtype=np.int32))
+    np.save(out_dir / "offsets.npy", offsets)
+    np.save(out_dir / "hashes.npy", hashes)
+    with open(out_dir / "info.json", "w", encoding="utf-8") as f:
+        json.dump({"model_name": model_name, "max_length": max_length, "n_docs": len(docs)}, f, ensure_ascii=False)
+
+
+class TokenCache:
+    """Token ID của từng chunk, đọc bằng mmap; tra theo "id" (số thứ tự hàng) của kết quả tìm kiếm"""
+
+    def __init__(self, in_dir):
+        in_dir = Path(in_dir)
+        with open(in_dir / "info.json", "r", encoding="utf-8") as f:
+            self.info = json.load(f)
+        self.ids = np.load(in_dir / "ids.npy", mmap_mode="r")
+        self.offsets = np.load(in_dir / "offsets.npy", mmap_mode="r")
+        self.hashes = np.load(in_dir / "hashes.npy", mmap_mode="r")
+
+    @staticmethod
+    def exists(in_dir):
+        return (Path(in_dir) / "info.json").exists()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lookup(self, candidate):
+        """Token ID của chunk ứng viên, None nếu không có/hàng không khớp nội dung (corpus đã build lại)"""
+        idx = candidate.get("id")
+        if idx is None or not 0 <= idx < len(self):
+            return None
+        # chunk_id (create_vector_index.py) chính là chunk_hash của nội dung
+        key = candidate.get("meta", {}).get("chunk_id") or chunk_hash(candidate["doc"])
+        if self.hashes[idx].tobytes().hex() != key:
+            return None
+        return self.ids[self.offsets[idx]:self.offsets[idx + 1]]
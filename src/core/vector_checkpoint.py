@@ -0,0 +1,139 @@
+import os, json
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+try:
+    from src.utils.rate_limit import CooldownGate, retry_with_backoff
+except ImportError:
+    from rate_limit import CooldownGate, retry_with_backoff
+
+
+class VectorCheckpoint:
+    """
+    Kho vector embedding theo hash nội dung chunk, lưu dạng shard .npy (memory-mapped).
+    - shard_XXXX.npy: ma trận (n, dim) float32, mỗi lần chạy build tạo 1 shard mới
+    - index.jsonl: mỗi dòng {"hash", "shard", "row"}, chỉ được ghi sau khi vector đã flush xuống đĩa
+      -> build bị dừng giữa chừng vẫn giữ được các lô đã xong, lần sau chỉ embed phần còn thiếu.
+    """
+
+    def __init__(self, cache_dir):
+        self.dir = Path(cache_dir)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = self.dir / "index.jsonl"
+        self.locations = {}  # hash -> (shard, row)
+        self._shards = {}
+        if self.index_path.exists():
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # dòng cuối có thể bị cắt nếu process bị kill
+                    self.locations[entry["hash"]] = (entry["shard"], entry["row"])
+
+    def __contains__(self, key):
+        return key in self.locations
+
+    def missing(self, hashes):
+        seen, out = set(), []
+        for h in hashes:
+            if h not in self.locations and h not in seen:
+                seen.add(h)
+                out.append(h)
+        return out
+
+    def _shard(self, name):
+        if name not in self._shards:
+            self._shards[name] = np.load(self.dir / name, mmap_mode="r")
+        return self._shards[name]
+
+    def new_shard(self, n_rows, dim):
+        existing = sorted(self.dir.glob("shard_*.npy"))
+        next_id = int(existing[-1].stem.split("_")[1]) + 1 if existing else 0
+        name = f"shard_{next_id:04d}.npy"
+        return name, open_memmap(self.dir / name, mode="w+", dtype=np.float32, shape=(n_rows, dim))
+
+    def commit(self, shard_name, shard, start_row, hashes, vectors):
+        """Ghi một lô vector vào shard, flush rồi mới ghi index (đảm bảo resume an toàn)"""
+        end_row = start_row + len(hashes)
+        shard[start_row:end_row] = np.asarray(vectors, dtype=np.float32)
+        shard.flush()
+        with open(self.index_path, "a", encoding="utf-8") as f:
+            for i, h in enumerate(hashes):
+                f.write(json.dumps({"hash": h, "shard": shard_name, "row": start_row + i}) + "\n")
+                self.locations[h] = (shard_name, start_row + i)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def get_matrix(self, hashes):
+        rows = []
+        for h in hashes:
+            shard_name, row = self.locations[h]
+            rows.append(self._shard(shard_name)[row])
+        return np.vstack(rows).astype(np.float32) if rows else np.zeros((0, 0), dtype=np.float32)
+
+    def compact(self, keep_hashes):
+        """Gom các vector còn dùng vào 1 shard mới, xóa shard cũ (khi có nhiều vector của chunk đã bị xóa/sửa)"""
+        keep = [h for h in dict.fromkeys(keep_hashes) if h in self.locations]
+        matrix = self.get_matrix(keep)
+        old_shards = sorted(self.dir.glob("shard_*.npy"))
+        self._shards.clear()
+
+        name, shard = self.new_shard(len(keep), matrix.shape[1] if len(keep) else 0)
+        if len(keep):
+            shard[:] = matrix
+            shard.flush()
+        del shard
+        tmp_index = self.index_path.with_suffix(".jsonl.tmp")
+        with open(tmp_index, "w", encoding="utf-8") as f:
+            for row, h in enumerate(keep):
+                f.write(json.dumps({"hash": h, "shard": name, "row": row}) + "\n")
+        os.replace(tmp_index, self.index_path)
+        self.locations = {h: (name, row) for row, h in enumerate(keep)}
+        for path in old_shards:
+            path.unlink()
+
+    def dead_rows(self, live_hashes):
+        live = set(live_hashes)
+        return sum(1 for h in self.locations if h not in live)
+
+
+def embed_corpus(texts, hashes, embedder, checkpoint, batch_size=64, max_workers=4, max_retries=5, progress=None):
+    """
+    Embed các chunk chưa có trong checkpoint theo lô, chạy song song bằng thread pool.
+    - Lô lỗi được thử lại với exponential backoff; lỗi 429 làm cả pool tạm nghỉ (CooldownGate)
+    - Lô nào xong được ghi ngay vào shard memory-mapped -> có thể resume nếu bị dừng
+    Trả về số chunk đã embed mới.
+    """
+    text_by_hash = dict(zip(hashes, texts))
+    todo = checkpoint.missing(hashes)
+    if not todo:
+        return 0
+
+    batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+    gate = CooldownGate()
+
+    def run_batch(batch):
+        return retry_with_backoff(
+            embedder.embed_documents, [text_by_hash[h] for h in batch],
+            max_retries=max_retries, gate=gate,
+        )
+
+    shard_name, shard = None, None
+    next_row = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(run_batch, b): b for b in batches}
+        for fut in as_completed(futures):
+            batch = futures[fut]
+            vectors = fut.result()
+            if shard is None:
+                # Biết dim sau lô đầu tiên -> tạo shard đủ chỗ cho toàn bộ phần cần embed
+                shard_name, shard = checkpoint.new_shard(len(todo), len(vectors[0]))
+            checkpoint.commit(shard_name, shard, next_row, batch, vectors)
+            next_row += len(batch)
+            if progress is not None:
+                progress.update(len(batch))
+    return len(todo)
@@ -0,0 +1,147 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from src.utils.text_utils import preprocess_text, extract_article_refs
+
+# Mặc định chỉ khớp chính xác: câu hỏi pháp luật gần giống nhau (tuổi kết hôn nam / nữ, Điều 8 / Điều 9)
+# thường cần câu trả lời khác nhau
+EXACT_ONLY = 1.01
+
+
+def normalize_query(text: str) -> str:
+    """Chuẩn hóa câu hỏi để so khớp chính xác: chữ thường, gộp khoảng trắng, bỏ dấu câu ở 2 đầu"""
+    return re.sub(r"^[\W_]+|[\W_]+$", "", preprocess_text(text))
+
+
+def artifact_version(paths) -> str:
+    """
+    Phiên bản của dữ liệu trả lời (FAISS index, graph...) = hash của (đường dẫn, mtime, kích thước).
+    Chỉ cần os.stat -> đủ rẻ để kiểm tra ở mỗi lần tra cache.
+    """
+    h = hashlib.sha1()
+    for path in paths:
+        try:
+            st = os.stat(path)
+            h.update(f"{path}:{st.st_mtime_ns}:{st.st_size};".encode("utf-8"))
+        except OSError:
+            h.update(f"{path}:missing;".encode("utf-8"))
+    return h.hexdigest()
+
+
+class AnswerCache:
+    """
+    Cache câu trả lời đặt trước GraphRAGService:
+    1. Khớp chính xác theo câu hỏi đã chuẩn hóa
+    2. Không có -> tìm câu hỏi đã cache gần nhất theo embedding (cosine >= similarity_threshold, mặc định tắt)
+       và phải nhắc tới đúng cùng các điều luật (extract_article_refs) với câu hỏi hiện tại
+    Giới hạn max_size (LRU) + ttl_seconds; toàn bộ cache bị xóa khi phiên bản artifact/graph đổi.
+    """
+
+    def __init__(self, max_size: int = 512, ttl_seconds: float = 86400, similarity_threshold: float = EXACT_ONLY,
+                 version_paths=()):
+        self.max_size = max_size
+        self.ttl = ttl_seconds
+        self.threshold = similarity_threshold
+        self.version_paths = list(version_paths)
+        self.version = artifact_version(self.version_paths)
+        self._entries = OrderedDict()  # câu hỏi chuẩn hóa -> entry
+        self._matrix = None            # vector đã chuẩn hóa của các entry (dựng lại khi cache đổi)
+        self._matrix_keys = []
+        self._lock = threading.Lock()
+        self.hits_exact = 0
+        self.hits_semantic = 0
+        self.misses = 0
+
+    def _check_version(self):
+        version = artifact_version(self.version_paths)
+        if version != self.version:
+            print("♻️ Dữ liệu (index/graph) đã thay đổi -> xóa answer cache")
+            self.version = version
+            self._entries.clear()
+            self._matrix = None
+
+    def _expired(self, entry, now):
+        return self.ttl and now - entry["created"] > self.ttl
+
+    def _nearest(self, query_vector, refs, now):
+        if self._matrix is None:
+            keys = [k for k, e in self._entries.items() if e["vector"] is not None]
+            self._matrix_keys = keys
+            self._matrix = np.vstack([self._entries[k]["vector"] for k in keys]) if keys else None
+        if self._matrix is None:
+            return None, 0.0
+
+        q = np.asarray(query_vector, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        sims = self._matrix @ q
+        for idx in np.argsort(-sims):
+            if sims[idx] < self.threshold:
+                break
+            entry = self._entries.get(self._matrix_keys[idx])
+            # "Điều 8" và "Điều 9" có embedding rất gần nhau nhưng là 2 câu hỏi khác nhau
+            if entry is not None and entry["refs"] == refs and not self._expired(entry, now):
+                return self._matrix_keys[idx], float(sims[idx])
+        return None, 0.0
+
+    def get(self, query_text: str, query_vector=None):
+        """
+        Trả về (answer, meta, kind, similarity); kind = "exact" | "semantic" | None (miss).
+        query_vector có thể là hàm không tham số: chỉ được gọi (embed câu hỏi) khi không khớp chính xác.
+        """
+        key = normalize_query(query_text)
+        now = time.time()
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry, now):
+                del self._entries[key]
+                self._matrix = None
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits_exact += 1
+                return entry["answer"], dict(entry["meta"]), "exact", 1.0
+
+        # Embed ngoài lock (có thể là một lần gọi API)
+        if callable(query_vector) and self.threshold <= 1.0:
+            query_vector = query_vector()
+        with self._lock:
+            if query_vector is not None and not callable(query_vector) and self.threshold <= 1.0:
+                key, similarity = self._nearest(query_vector, frozenset(extract_article_refs(query_text)), now)
+                if key is not None:
+                    self._entries.move_to_end(key)
+                    self.hits_semantic += 1
+                    entry = self._entries[key]
+                    return entry["answer"], dict(entry["meta"]), "semantic", similarity
+            self.misses += 1
+            return None, None, None, 0.0
+
+    def put(self, query_text: str, answer: str, meta: dict, query_vector=None):
+        vector = None
+        if query_vector is not None:
+            vector = np.asarray(query_vector, dtype=np.float32)
+            vector = vector / (np.linalg.norm(vector) or 1.0)
+        with self._lock:
+            key = normalize_query(query_text)
+            self._entries[key] = {"answer": answer, "meta": dict(meta), "vector": vector,
+                                  "refs": frozenset(extract_article_refs(query_text)), "created": time.time()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def stats(self) -> dict:
+        total = self.hits_exact + self.hits_semantic + self.misses
+        return {
+            "size": len(self._entries),
+            "hits_exact": self.hits_exact,
+            "hits_semantic": self.hits_semantic,
+            "misses": self.misses,
+            "hit_rate": (self.hits_exact + self.hits_semantic) / total if total else 0.0,
+        }
@@ -0,0 +1,144 @@
+import asyncio
+import time
+
+
+class QueueFullError(Exception):
+    """Hàng đợi đã đầy -> từ chối ngay (backpressure) thay vì để độ trễ tăng vô hạn"""
+
+
+class DeadlineExceeded(Exception):
+    """Request quá hạn trước khi có kết quả"""
+
+
+class MicroBatcher:
+    """
+    Gom các request đồng thời thành lô: request đầu tiên mở một "cửa sổ" max_wait_ms, mọi request tới trong
+    cửa sổ (tối đa max_batch_size) được xử lý bằng 1 lần gọi process_batch(items) -> list kết quả cùng thứ tự
+    (phần tử là Exception -> chỉ request đó nhận lỗi, các request khác trong lô vẫn có kết quả).
+    - process_batch là hàm đồng bộ (embed / FAISS / rerank), chạy trên thread để không chặn event loop
+    - Hàng đợi có giới hạn max_queue: đầy thì submit() ném QueueFullError
+    - Mỗi request có deadline (timeout giây): quá hạn khi còn trong hàng đợi thì bị bỏ khỏi lô,
+      người gọi nhận DeadlineExceeded
+    Phải gọi start() bên trong event loop đang chạy (vd on_startup của aiohttp).
+    """
+
+    def __init__(self, process_batch, max_batch_size=32, max_wait_ms=5.0, max_queue=256, name="batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_queue = max_queue
+        self.name = name
+        self._queue = None
+        self._task = None
+        self.submitted = 0
+        self.rejected = 0
+        self.expired = 0
+        self.batches = 0
+        self.items = 0
+        self.busy_seconds = 0.0
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.create_task(self._run(), name=f"{self.name}-worker")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Request còn trong hàng đợi nhận lỗi thay vì treo mãi
+        while self._queue is not None and not self._queue.empty():
+            _, fut, _ = self._queue.get_nowait()
+            if not fut.done():
+                fut.set_exception(RuntimeError(f"{self.name} đã dừng"))
+
+    async def submit(self, item, timeout=None):
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        deadline = loop.time() + timeout if timeout else None
+        try:
+            self._queue.put_nowait((item, fut, deadline))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError(f"{self.name}: hàng đợi đầy ({self.max_queue} request)")
+        self.submitted += 1
+        if timeout is None:
+            return await fut
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            self.expired += 1
+            raise DeadlineExceeded(f"{self.name}: quá hạn {timeout * 1000:.0f} ms")
+
+    async def _collect(self):
+        """Lấy 1 lô: chờ request đầu tiên, rồi gom thêm trong tối đa max_wait giây"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        close_at = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Lấy ngay các request đã nằm sẵn trong hàng đợi, chỉ chờ khi hàng đợi trống
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = close_at - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            now = loop.time()
+            live = []
+            for item, fut, deadline in batch:
+                if fut.done():
+                    # Người gọi đã hết hạn chờ / hủy request
+                    continue
+                if deadline is not None and now >= deadline:
+                    # submit() chỉ đếm timeout của wait_for -> request hết hạn trong hàng đợi đếm ở đây
+                    self.expired += 1
+                    fut.set_exception(DeadlineExceeded(f"{self.name}: quá hạn khi còn trong hàng đợi"))
+                    continue
+                live.append((item, fut))
+            if not live:
+                continue
+
+            t0 = time.perf_counter()
+            try:
+                results = await asyncio.to_thread(self.process_batch, [item for item, _ in live])
+            except Exception as e:
+                for _, fut in live:
+                    if not fut.done():
+                        fut.set_exception(e)
+            else:
+                for (_, fut), result in zip(live, results):
+                    if fut.done():
+                        continue
+                    if isinstance(result, Exception):
+                        fut.set_exception(result)
+                    else:
+                        fut.set_result(result)
+            self.busy_seconds += time.perf_counter() - t0
+            self.batches += 1
+            self.items += len(live)
+
+    def stats(self) -> dict:
+        return {
+            "queue_size": self._queue.qsize() if self._queue is not None else 0,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "busy_seconds": self.busy_seconds,
+        }
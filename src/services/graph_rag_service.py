@@ -2,16 +2,34 @@
 import os
 import json
 import time
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple, List, Dict
 
-from langchain_groq import ChatGroq
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
+import yaml
 from dotenv import load_dotenv
 
+from src.core.embeddings import build_embedder, as_langchain_embeddings
+from src.core.faiss_index import read_index, set_search_params
+from src.core.graph_index import GraphIndex
+from src.services.answer_cache import AnswerCache, EXACT_ONLY
+from src.utils.text_utils import ArticleMatcher, split_node_id
+from src.utils.timing import StartupTimer, LazyLoader
+from src.utils.tracing import get_tracer
+
 class GraphRAGService:
-    def __init__(self, vector_db_path: str = "data/artifacts", graph_path: str = "data/knowledge_graph.json"):
+    def __init__(self, vector_db_path: str = "data/artifacts", graph_path: str = "data/knowledge_graph.json",
+                 config_path: str = "config/config.yaml"):
+        self.timer = StartupTimer("GraphRAGService")
         load_dotenv()
+        self.vector_db_path = vector_db_path
+
+        self.cfg = {}
+        if os.path.exists(config_path):
+            with open(config_path, "r", encoding="utf-8") as f:
+                self.cfg = yaml.safe_load(f) or {}
 
         self.google_api_key = os.getenv("GOOGLE_API_KEY")
         self.groq_api_key = os.getenv("GROQ_API_KEY")
@@ -19,99 +37,216 @@ class GraphRAGService:
         if not self.groq_api_key:
             raise ValueError("❌ Thiếu GROQ_API_KEY trong file .env")
 
-        # 1. KHỞI TẠO LLM
+        # 1 + 2. LLM, Embeddings và Vector DB được khởi tạo ở lần dùng đầu tiên
+        # (import langchain_groq / langchain_community / model embedding tốn vài giây)
+        self._llm = LazyLoader(self._load_llm, "LLM (Groq)", self.timer)
+        self._embeddings = LazyLoader(lambda: build_embedder(self.cfg), "Embedding provider", self.timer)
+        self._vector_db = LazyLoader(self._load_vector_db, "Vector DB (FAISS)", self.timer)
+        # Đo thời gian từng stage (embed, vector search, graph, LLM...) -> meta["trace"] + metrics Prometheus
+        self.tracer = get_tracer(self.cfg)
+        # Thread pool chạy mở rộng graph song song với vector search
+        self._pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="graphrag")
+
+        # 3. LOAD KNOWLEDGE GRAPH
+        # Ưu tiên adjacency nhị phân (mmap, node theo văn bản) do build_knowledge_graph.py ghi ra; không có thì đọc JSON.
+        # Bản nhị phân cũ hơn graph_path (vd truyền graph JSON khác / JSON mới build lại) thì đọc JSON
+        print("🕸️ Loading Knowledge Graph...")
+        graph_dir = os.path.join(vector_db_path, "graph")
+        with self.timer.phase("Knowledge Graph"):
+            if GraphIndex.exists(graph_dir) and not self._binary_graph_stale(graph_dir, graph_path):
+                self.graph_index = GraphIndex.load(graph_dir, mmap=True)
+            else:
+                nodes, edges = [], []
+                try:
+                    with open(graph_path, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                        nodes = data.get("nodes", [])
+                        edges = data.get("edges", [])
+                except Exception as e:
+                    print(f"⚠️ Không load được Graph JSON: {e}")
+                # Chỉ mục kề CSR (xuôi + ngược) -> mở rộng graph không phải duyệt toàn bộ cạnh
+                self.graph_index = GraphIndex.from_graph(nodes, edges)
+            print(f"✅ Graph loaded: {len(self.graph_index.node_ids)} nodes, {self.graph_index.n_edges} edges.")
+            self.article_matcher = ArticleMatcher(self.graph_index.node_ids)
+
+        # 4. ANSWER CACHE (khớp chính xác + câu hỏi tương tự), tự xóa khi index/graph được build lại
+        cache_cfg = self.cfg.get("answer_cache", {})
+        self.answer_cache = None
+        if cache_cfg.get("enabled", True):
+            self.answer_cache = AnswerCache(
+                max_size=cache_cfg.get("max_size", 512),
+                ttl_seconds=cache_cfg.get("ttl_seconds", 86400),
+                similarity_threshold=cache_cfg.get("similarity_threshold", EXACT_ONLY),
+                version_paths=[os.path.join(vector_db_path, "faiss.faiss"), graph_path, os.path.join(graph_dir, "graph.json")],
+            )
+
+    @staticmethod
+    def _binary_graph_stale(graph_dir: str, graph_path: str) -> bool:
+        """Graph nhị phân được ghi sau JSON khi build -> cũ hơn graph_path nghĩa là không cùng bản graph"""
+        if not os.path.exists(graph_path):
+            return False
+        stale = os.path.getmtime(os.path.join(graph_dir, "graph.json")) < os.path.getmtime(graph_path)
+        if stale:
+            print(f"⚠️ {graph_dir} cũ hơn {graph_path} -> đọc graph JSON")
+        return stale
+
+    def _load_llm(self):
+        from langchain_groq import ChatGroq
+
         print("⚡ Đang kết nối tới Groq (Llama-3.1-8b-instant)...")
-        self.llm = ChatGroq(
+        return ChatGroq(
             temperature=0.1,
             model_name="llama-3.1-8b-instant",
             api_key=self.groq_api_key,
             max_retries=2
         )
 
-        # 2. LOAD VECTOR DB (Sửa lỗi quan trọng ở đây)
-        print(f"📦 Loading Vector Database từ: {vector_db_path}")
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/text-embedding-004",
-            google_api_key=self.google_api_key
-        )
+    def _load_vector_db(self):
+        from langchain_community.vectorstores import FAISS
+
+        print(f"📦 Loading Vector Database từ: {self.vector_db_path}")
         try:
             # LƯU Ý: Thêm index_name="faiss" để khớp với file faiss.faiss đã tạo
-            self.vector_db = FAISS.load_local(
-                vector_db_path,
-                self.embeddings,
+            vector_db = FAISS.load_local(
+                self.vector_db_path,
+                as_langchain_embeddings(self.embeddings),
                 allow_dangerous_deserialization=True,
                 index_name="faiss"  # <--- QUAN TRỌNG: Phải khớp với lúc save
             )
+            index_cfg = self.cfg.get("index", {})
+            # faiss_mmap: thay index vừa đọc bằng bản map từ file -> nhiều phiên Streamlit / worker dùng chung page cache
+            if index_cfg.get("faiss_mmap", True):
+                vector_db.index = read_index(os.path.join(self.vector_db_path, "faiss.faiss"), mmap=True)
+            # Tham số truy vấn theo config `index` (IVF: nprobe, HNSW: efSearch)
+            set_search_params(vector_db.index, index_cfg.get("faiss_nprobe", 10), index_cfg.get("faiss_ef_search", 64))
             print("✅ Vector DB loaded thành công.")
+            return vector_db
         except Exception as e:
             print(f"⚠️ Không load được Vector DB: {e}")
             print("👉 Gợi ý: Hãy chạy 'python scripts/run_pipeline.py' để tạo dữ liệu trước.")
-            self.vector_db = None
+            return None
 
-        # 3. LOAD KNOWLEDGE GRAPH
-        print("🕸️ Loading Knowledge Graph...")
-        self.graph_nodes = {}
-        self.graph_edges = []
-        try:
-            with open(graph_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                for node in data.get("nodes", []):
-                    self.graph_nodes[node["id"]] = node
-                self.graph_edges = data.get("edges", [])
-            print(f"✅ Graph loaded: {len(self.graph_nodes)} nodes, {len(self.graph_edges)} edges.")
-        except Exception as e:
-            print(f"⚠️ Không load được Graph JSON: {e}")
+    @property
+    def llm(self):
+        return self._llm.get()
+
+    @property
+    def embeddings(self):
+        # Embedding provider dùng chung với HybridSearcher (google / local, có cache)
+        return self._embeddings.get()
+
+    @property
+    def vector_db(self):
+        return self._vector_db.get()
+
+    def warmup(self, background: bool = True):
+        """
+        Load trước LLM client + Vector DB. background=True: chạy ở thread nền để
+        giao diện sẵn sàng ngay, câu hỏi đầu tiên chỉ phải chờ phần còn lại (nếu có).
+        """
+        def _load():
+            self.vector_db
+            self.llm
+
+        if background:
+            threading.Thread(target=_load, daemon=True).start()
+        else:
+            _load()
 
     def _find_related_nodes(self, initial_nodes: List[str]) -> List[Dict]:
-        """Tìm các node liên quan (bước nhảy 1)"""
+        """Tìm các node liên quan (k bước nhảy theo cấu hình `graph`, mặc định 1 bước)"""
+        graph_cfg = self.cfg.get("graph", {})
+        with self.tracer.span("graph.expand", seeds=len(initial_nodes)):
+            return self._expand_related(initial_nodes, graph_cfg)
+
+    def _expand_related(self, initial_nodes: List[str], graph_cfg: dict) -> List[str]:
+        expanded = self.graph_index.expand(
+            initial_nodes,
+            max_hops=graph_cfg.get("max_hops", 1),
+            fanout=graph_cfg.get("hop_fanout", 10),
+            relations=graph_cfg.get("relations") or None,
+            direction=graph_cfg.get("direction", "out"),
+        )
+
         related_info = []
-        for edge in self.graph_edges:
-            source = edge["from"]
-            target = edge["to"]
-            relation = edge["relation"]
-
-            if source in initial_nodes:
-                target_node = self.graph_nodes.get(target)
-                if target_node:
-                    topic = target_node.get("topic", "")
-                    # Lấy thêm nguồn nếu có
-                    src_doc = target_node.get("sources", [])
-                    src_str = f" (Nguồn: {src_doc[0]})" if src_doc else ""
-                    related_info.append(f"- {source} {relation} {target}: {topic}{src_str}")
-
-        return related_info[:10]
+        for _, source, relation, target in expanded:
+            target_node = self.graph_index.get_node(target)
+            if target_node:
+                topic = target_node.get("topic", "")
+                # Lấy thêm nguồn nếu có
+                src_doc = target_node.get("sources", [])
+                src_str = f" (Nguồn: {src_doc[0]})" if src_doc else ""
+                related_info.append(f"- {split_node_id(source)[1]} {relation} {split_node_id(target)[1]}: {topic}{src_str}")
 
-    def query(self, query_text: str, k: int = 4) -> Tuple[str, dict, float]:
-        t0 = time.perf_counter()
+        return related_info[:graph_cfg.get("max_context_edges", 10)]
 
-        # BƯỚC 1: VECTOR SEARCH
+    def _embed_query(self, query_text: str):
+        # Embed qua provider có cache -> câu hỏi lặp lại không phải gọi API
+        if not self.vector_db:
+            return None
+        with self.tracer.span("embed"):
+            return self.embeddings.embed_query(query_text)
+
+    def _vector_search(self, query_text: str, k: int, query_vector=None):
+        """BƯỚC 1: VECTOR SEARCH -> (các đoạn văn bản, nguồn, node điều luật được nhắc tới)"""
         context_parts = []
-        found_articles = set()
+        found_articles = []
         vec_sources = []
 
         if self.vector_db:
-            hits = self.vector_db.similarity_search(query_text, k=k)
+            if query_vector is None:
+                query_vector = self._embed_query(query_text)
+            with self.tracer.span("vector_search", k=k):
+                hits = self.vector_db.similarity_search_by_vector(query_vector, k=k)
             for h in hits:
                 content = h.page_content
                 context_parts.append(content)
                 vec_sources.append(h.metadata.get("source", "Unknown"))
 
-                # Tìm ID điều luật trong nội dung tìm được
-                for node_id in self.graph_nodes:
-                    # Tìm đơn giản: nếu "Điều 5" có trong text
-                    if node_id in content:
-                        found_articles.add(node_id)
+                # Tìm ID điều luật trong nội dung tìm được (1 lượt quét, có ranh giới từ),
+                # chỉ lấy điều luật thuộc cùng văn bản với đoạn này
+                found_articles.extend(self.article_matcher.find(content, h.metadata.get("source")))
+
+        return context_parts, vec_sources, list(dict.fromkeys(found_articles))
 
-        # BƯỚC 2: GRAPH SEARCH
-        graph_context = []
+    def _merge_graph_context(self, query_graph: List[str], found_articles: List[str]) -> List[str]:
+        """Gộp liên kết từ điều luật nêu trong câu hỏi (đã mở rộng song song) với điều luật trong văn bản tìm được"""
+        graph_context = list(query_graph)
         if found_articles:
-            graph_context = self._find_related_nodes(list(found_articles))
+            graph_context.extend(self._find_related_nodes(found_articles))
+        return list(dict.fromkeys(graph_context))[:self.cfg.get("graph", {}).get("max_context_edges", 10)]
+
+    def _gather_context(self, query_text: str, k: int, query_vector=None):
+        """
+        BƯỚC 1 + 2: vector search chạy song song với mở rộng graph từ các điều luật nêu ngay trong câu hỏi;
+        sau đó mở rộng thêm từ các điều luật xuất hiện trong văn bản tìm được.
+        """
+        # Câu hỏi không gắn với văn bản nào -> "Điều N" khớp node của mọi văn bản có điều đó
+        query_articles = self.article_matcher.find(query_text)
+        # copy_context: span của thread pool vẫn ghi vào trace của câu hỏi này
+        graph_future = self._pool.submit(
+            contextvars.copy_context().run, self._find_related_nodes, query_articles
+        ) if query_articles else None
+        context_parts, vec_sources, found_articles = self._vector_search(query_text, k, query_vector)
+        query_graph = graph_future.result() if graph_future else []
+        return context_parts, vec_sources, self._merge_graph_context(query_graph, found_articles)
 
+    async def _agather_context(self, query_text: str, k: int, query_vector=None):
+        """Bản async của _gather_context: vector search và mở rộng graph chạy đồng thời trên thread pool"""
+        query_articles = self.article_matcher.find(query_text)
+        (context_parts, vec_sources, found_articles), query_graph = await asyncio.gather(
+            asyncio.to_thread(self._vector_search, query_text, k, query_vector),
+            asyncio.to_thread(self._find_related_nodes, query_articles) if query_articles else asyncio.sleep(0, []),
+        )
+        graph_context = await asyncio.to_thread(self._merge_graph_context, query_graph, found_articles)
+        return context_parts, vec_sources, graph_context
+
+    def _build_prompt(self, query_text: str, context_parts: List[str], graph_context: List[str]) -> str:
         # BƯỚC 3: TẠO PROMPT
         vector_str = "\n\n".join(context_parts)
         graph_str = "\n".join(graph_context) if graph_context else "Không tìm thấy mối liên hệ mở rộng."
 
-        prompt = f"""
+        return f"""
 Bạn là Trợ lý Luật sư AI. Trả lời câu hỏi dựa trên thông tin sau:
 
 [THÔNG TIN VĂN BẢN - VECTOR]:
@@ -129,20 +264,176 @@ YÊU CẦU:
 
 TRẢ LỜI:
 """
+
+    def _record_llm(self, trace, start: float, first_token, error: bool):
+        # Generator chạy khi người gọi duyệt stream (ngoài khối with của trace) -> ghi span thủ công
+        end = time.perf_counter()
+        self.tracer.record("llm.first_token", start, first_token or end, trace=trace, error=error)
+        self.tracer.record("llm.generate", start, end, trace=trace, error=error)
+
+    def _stream_tokens(self, prompt: str, meta: dict, trace=None):
+        start, first_token, error = time.perf_counter(), None, False
+        try:
+            for chunk in self.llm.stream(prompt):
+                if chunk.content:
+                    first_token = first_token or time.perf_counter()
+                    yield chunk.content
+        except Exception as e:
+            error = True
+            meta["error"] = str(e)
+            yield f"Lỗi AI: {e}"
+        finally:
+            self._record_llm(trace, start, first_token, error)
+
+    async def _astream_tokens(self, prompt: str, meta: dict, trace=None):
+        start, first_token, error = time.perf_counter(), None, False
         try:
-            response = self.llm.invoke(prompt)
-            answer = response.content
+            async for chunk in self.llm.astream(prompt):
+                if chunk.content:
+                    first_token = first_token or time.perf_counter()
+                    yield chunk.content
         except Exception as e:
-            answer = f"Lỗi AI: {e}"
+            error = True
+            meta["error"] = str(e)
+            yield f"Lỗi AI: {e}"
+        finally:
+            self._record_llm(trace, start, first_token, error)
 
-        latency = time.perf_counter() - t0
+    def _cache_lookup(self, query_text: str):
+        """
+        Tra answer cache: khớp chính xác trước, trượt mới embed câu hỏi để tìm câu tương tự.
+        Trả về (câu trả lời, meta, vector câu hỏi) - câu trả lời None nếu trượt; vector dùng lại cho vector search.
+        """
+        if self.answer_cache is None:
+            return None, None, None
+        with self.tracer.span("answer_cache.lookup"):
+            return self._lookup_answer_cache(query_text)
 
+    def _lookup_answer_cache(self, query_text: str):
+        vector = []
+        answer, meta, kind, similarity = self.answer_cache.get(
+            query_text, lambda: vector.append(self._embed_query(query_text)) or vector[0]
+        )
+        query_vector = vector[0] if vector else None
+        if answer is None:
+            return None, None, query_vector
+        meta.update({"cache": kind, "cache_similarity": similarity, "cache_stats": self.answer_cache.stats()})
+        return answer, meta, query_vector
+
+    def _new_meta(self, vec_sources, graph_context, t0) -> dict:
         meta = {
             "vector_sources": vec_sources,
-            "graph_edges_used": len(graph_context)
+            "graph_edges_used": len(graph_context),
+            "retrieval_latency": time.perf_counter() - t0,
         }
+        if self.answer_cache is not None:
+            meta.update({"cache": "miss", "cache_stats": self.answer_cache.stats()})
+        return meta
+
+    def _on_finish(self, trace, query_text: str = None, query_vector=None):
+        """Khi stream kết thúc: đóng trace (meta["trace"] = ms theo stage) rồi lưu answer cache"""
+        def finish(stream: "AnswerStream"):
+            if trace is not None:
+                self.tracer.finish(trace, error="error" in stream.meta)
+                stream.meta["trace"] = trace.breakdown()
+                stream.meta["trace_id"] = trace.trace_id
+            # Không cache câu trả lời lỗi (LLM quá tải...) để lần sau gọi lại; query_text None = câu trả lời lấy từ cache
+            if query_text is not None and self.answer_cache is not None and "error" not in stream.meta:
+                cached_meta = {k: stream.meta[k] for k in ("vector_sources", "graph_edges_used")}
+                self.answer_cache.put(query_text, stream.answer, cached_meta, query_vector)
+        return finish
+
+    def stream_query(self, query_text: str, k: int = 4) -> "AnswerStream":
+        """
+        Trả lời dạng stream: duyệt kết quả để nhận từng đoạn token ngay khi LLM sinh ra.
+        meta["ttft"] (thời gian tới token đầu tiên) là độ trễ người dùng cảm nhận.
+        """
+        t0 = time.perf_counter()
+        trace = self.tracer.start_trace("graphrag.query")
+        with self.tracer.activate(trace):
+            answer, meta, query_vector = self._cache_lookup(query_text)
+            if answer is not None:
+                return AnswerStream(iter([answer]), meta, t0, self._on_finish(trace))
+
+            context_parts, vec_sources, graph_context = self._gather_context(query_text, k, query_vector)
+            meta = self._new_meta(vec_sources, graph_context, t0)
+            with self.tracer.span("prompt.build"):
+                prompt = self._build_prompt(query_text, context_parts, graph_context)
+        return AnswerStream(self._stream_tokens(prompt, meta, trace), meta, t0,
+                            self._on_finish(trace, query_text, query_vector))
+
+    async def astream_query(self, query_text: str, k: int = 4) -> "AnswerStream":
+        """Bản async của stream_query: dùng `async for token in await bot.astream_query(...)`"""
+        t0 = time.perf_counter()
+        trace = self.tracer.start_trace("graphrag.query")
+        with self.tracer.activate(trace):
+            answer, meta, query_vector = await asyncio.to_thread(self._cache_lookup, query_text)
+            if answer is not None:
+                return AnswerStream(_aiter_once(answer), meta, t0, self._on_finish(trace))
+
+            context_parts, vec_sources, graph_context = await self._agather_context(query_text, k, query_vector)
+            meta = self._new_meta(vec_sources, graph_context, t0)
+            with self.tracer.span("prompt.build"):
+                prompt = self._build_prompt(query_text, context_parts, graph_context)
+        return AnswerStream(self._astream_tokens(prompt, meta, trace), meta, t0,
+                            self._on_finish(trace, query_text, query_vector))
+
+    def query(self, query_text: str, k: int = 4) -> Tuple[str, dict, float]:
+        stream = self.stream_query(query_text, k)
+        for _ in stream:
+            pass
+        return stream.answer, stream.meta, stream.meta["latency"]
 
-        return answer, meta, latency
+    async def aquery(self, query_text: str, k: int = 4) -> Tuple[str, dict, float]:
+        stream = await self.astream_query(query_text, k)
+        async for _ in stream:
+            pass
+        return stream.answer, stream.meta, stream.meta["latency"]
 
     def close(self):
-        pass
+        self._pool.shutdown(wait=False)
+
+
+async def _aiter_once(value):
+    yield value
+
+
+class AnswerStream:
+    """
+    Câu trả lời dạng stream (sync hoặc async tùy nguồn token).
+    Sau khi duyệt hết: .answer là toàn văn, .meta có "ttft" (giây tới token đầu) và "latency" (tổng thời gian).
+    """
+
+    def __init__(self, tokens, meta: dict, t0: float, on_finish=None):
+        self._tokens = tokens
+        self.meta = meta
+        self._t0 = t0
+        self._parts = []
+        self._on_finish = on_finish
+
+    @property
+    def answer(self) -> str:
+        return "".join(self._parts)
+
+    def _record(self, token: str):
+        if "ttft" not in self.meta:
+            self.meta["ttft"] = time.perf_counter() - self._t0
+        self._parts.append(token)
+
+    def _finish(self):
+        self.meta.setdefault("ttft", time.perf_counter() - self._t0)
+        self.meta["latency"] = time.perf_counter() - self._t0
+        if self._on_finish is not None:
+            self._on_finish(self)
+
+    def __iter__(self):
+        for token in self._tokens:
+            self._record(token)
+            yield token
+        self._finish()
+
+    async def __aiter__(self):
+        async for token in self._tokens:
+            self._record(token)
+            yield token
+        self._finish()
@@ -1,12 +1,14 @@
 import os
 import yaml
-from typing import List, Dict
+from typing import List, Dict, Optional
 from src.core.search_engine import HybridSearcher
-from src.core.reranker import CrossEncoderReranker
+from src.utils.timing import StartupTimer, LazyLoader
+from src.utils.tracing import get_tracer
 
 class LegalRetriever:
     def __init__(self, config_path: str = "config/config.yaml"):
         print("🔄 Đang khởi động hệ thống tìm kiếm (LegalRetriever)...")
+        self.timer = StartupTimer("LegalRetriever")
 
         self.config_path = os.path.abspath(config_path)
         if not os.path.exists(self.config_path):
@@ -14,28 +16,73 @@ class LegalRetriever:
 
         self.cfg = yaml.safe_load(open(self.config_path, "r", encoding="utf-8"))
 
+        # Tracer dùng chung: search + rerank của 1 lần retrieve nằm trong cùng 1 trace
+        self.tracer = get_tracer(self.cfg)
+
         # 1. Load Searcher
-        self.searcher = HybridSearcher(self.cfg)
+        self.searcher = HybridSearcher(self.cfg, timer=self.timer, tracer=self.tracer)
 
-        # 2. Load Reranker
+        # 2. Reranker: chỉ load model (torch/transformers) ở lần rerank đầu tiên, và chỉ khi apply=true
         rerank_cfg = self.cfg.get("reranker", {})
-        self.reranker = CrossEncoderReranker(rerank_cfg.get("model_name", "BAAI/bge-reranker-v2-m3"))
+        self.apply_rerank = rerank_cfg.get("apply", False)
+        self._reranker = LazyLoader(self._load_reranker, "Reranker model", self.timer)
         self.keep_topk = rerank_cfg.get("keep_topk", 5)
+        self.rerank_batch_size = rerank_cfg.get("batch_size", 16)
 
         print("✅ LegalRetriever đã sẵn sàng!")
 
-    def retrieve(self, query: str) -> List[str]:
-        candidates = self.searcher.search(query)
+    def _load_reranker(self):
+        from src.core.reranker import CrossEncoderReranker
+        rerank_cfg = self.cfg.get("reranker", {})
+        return CrossEncoderReranker(
+            rerank_cfg.get("model_name", "BAAI/bge-reranker-v2-m3"),
+            backend=rerank_cfg.get("backend", "torch"),
+            max_length=rerank_cfg.get("max_length", 512),
+            cache_size=rerank_cfg.get("cache_size", 4096),
+            token_cache_dir=rerank_cfg.get("token_cache_dir"),
+            onnx_dir=rerank_cfg.get("onnx_dir", "data/cache/onnx"),
+            tracer=self.tracer,
+        )
+
+    @property
+    def reranker(self):
+        return self._reranker.get()
+
+    def warmup(self):
+        """Load trước các thành phần lười (gọi từ thread nền khi chờ người dùng nhập)"""
+        self.searcher.warmup()
+        if self.apply_rerank:
+            self._reranker.get()
+
+    def retrieve(self, query: str, filters: Optional[Dict] = None) -> List[str]:
+        return self.retrieve_batch([query], filters)[0]
+
+    def retrieve_batch(self, queries: List[str], filters: Optional[Dict] = None) -> List[List[str]]:
+        """
+        Truy xuất cho nhiều câu hỏi: 1 lần search_batch + rerank chung các cặp của cả lô.
+        filters: giới hạn theo văn bản / loại / năm / khoảng điều, vd {"doc_type": "QH", "year": 2014, "article": [1, 20]}
+        Thời gian từng stage: mở trace bên ngoài (`with retriever.tracer.trace("...") as trace`) rồi đọc trace.breakdown().
+        """
+        with self.tracer.trace("retrieve"):
+            return self._retrieve_batch(queries, filters)
+
+    def _retrieve_batch(self, queries, filters):
+        candidate_lists = self.searcher.search_batch(queries, filters=filters)["hybrid"]
 
-        if self.cfg.get("reranker", {}).get("apply", False):
-            reranked_results, _ = self.reranker.rerank(query, candidates, keep_topk=self.keep_topk)
+        if self.apply_rerank:
+            reranked_lists = [r for r, _ in self.reranker.rerank_batch(
+                queries, candidate_lists, keep_topk=self.keep_topk, batch_size=self.rerank_batch_size
+            )]
         else:
-            reranked_results = candidates[:self.keep_topk]
+            reranked_lists = [c[:self.keep_topk] for c in candidate_lists]
 
-        context_list = []
-        for item in reranked_results:
-            doc_text = item.get("doc", "")
-            source = item.get("meta", {}).get("source_file", "Unknown")
-            context_list.append(f"[{source}]: {doc_text}")
+        contexts = []
+        for reranked_results in reranked_lists:
+            context_list = []
+            for item in reranked_results:
+                doc_text = item.get("doc", "")
+                source = item.get("meta", {}).get("source_file", "Unknown")
+                context_list.append(f"[{source}]: {doc_text}")
+            contexts.append(context_list)
 
-        return context_list
+        return contexts
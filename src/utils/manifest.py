@@ -0,0 +1,101 @@
+import os
+import json
+import hashlib
+from typing import Dict, List
+
+from src.utils.text_utils import chunk_hash
+
+# Manifest lưu chuỗi phụ thuộc của từng văn bản nguồn:
+# PDF (sha256) -> file cleaned -> file chunks + chunk_id -> hàng vector trong FAISS/docs.json -> node trong graph
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_manifest(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {"version": MANIFEST_VERSION, "documents": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: Dict, path: str):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def diff_sources(manifest: Dict, raw_dir: str) -> Dict[str, List[str]]:
+    """So sánh thư mục PDF với manifest -> {"added", "changed", "removed", "unchanged"} (tên file PDF)"""
+    known = manifest.get("documents", {})
+    current = {f: file_sha256(os.path.join(raw_dir, f)) for f in sorted(os.listdir(raw_dir)) if f.endswith(".pdf")}
+
+    diff = {"added": [], "changed": [], "removed": [], "unchanged": []}
+    for name, digest in current.items():
+        if name not in known:
+            diff["added"].append(name)
+        elif known[name].get("sha256") != digest:
+            diff["changed"].append(name)
+        else:
+            diff["unchanged"].append(name)
+    diff["removed"] = [name for name in known if name not in current]
+    diff["hashes"] = current
+    return diff
+
+
+def cleaned_name(pdf_name: str) -> str:
+    return pdf_name.replace(".pdf", "_clean.txt")
+
+
+def chunks_name(pdf_name: str) -> str:
+    return pdf_name.replace(".pdf", "_chunks.json")
+
+
+def build_manifest(raw_dir: str, cleaned_dir: str, chunks_dir: str, artifacts_dir: str, graph_path: str,
+                   hashes: Dict[str, str] = None) -> Dict:
+    """Dựng lại manifest từ trạng thái hiện tại của data/ (chạy sau khi pipeline xong)"""
+    pdfs = sorted(f for f in os.listdir(raw_dir) if f.endswith(".pdf"))
+    hashes = hashes or {}
+
+    # Hàng vector theo nguồn (thứ tự docs.json == thứ tự FAISS)
+    rows_by_source = {}
+    metas_path = os.path.join(artifacts_dir, "metas.json")
+    if os.path.exists(metas_path):
+        with open(metas_path, "r", encoding="utf-8") as f:
+            for row, meta in enumerate(json.load(f)):
+                rows_by_source.setdefault(meta.get("source"), []).append(row)
+
+    # Node graph theo nguồn
+    nodes_by_source = {}
+    if os.path.exists(graph_path):
+        with open(graph_path, "r", encoding="utf-8") as f:
+            for node in json.load(f).get("nodes", []):
+                for src in node.get("sources", []):
+                    nodes_by_source.setdefault(src, []).append(node["id"])
+
+    documents = {}
+    for pdf in pdfs:
+        chunk_file = os.path.join(chunks_dir, chunks_name(pdf))
+        chunk_ids = []
+        if os.path.exists(chunk_file):
+            with open(chunk_file, "r", encoding="utf-8") as f:
+                for chunk in json.load(f):
+                    text = chunk.get("page_content", "") if isinstance(chunk, dict) else str(chunk)
+                    if text.strip():
+                        chunk_ids.append(chunk_hash(text))
+        documents[pdf] = {
+            "sha256": hashes.get(pdf) or file_sha256(os.path.join(raw_dir, pdf)),
+            "cleaned": os.path.join(cleaned_dir, cleaned_name(pdf)),
+            "chunks_file": chunk_file,
+            "chunk_ids": chunk_ids,
+            "vector_rows": rows_by_source.get(pdf, []),
+            "graph_nodes": nodes_by_source.get(pdf, []),
+        }
+    return {"version": MANIFEST_VERSION, "documents": documents}
@@ -0,0 +1,47 @@
+import sys
+import resource
+
+import numpy as np
+
+
+def latency_summary(latencies):
+    """Thống kê độ trễ (giây/lần gọi) -> ms p50/p95/p99/mean + QPS khi chạy tuần tự"""
+    lat = np.asarray(latencies, dtype=np.float64) * 1000
+    if len(lat) == 0:
+        return {"n": 0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "mean_ms": 0.0, "qps": 0.0}
+    return {
+        "n": int(len(lat)),
+        "p50_ms": float(np.percentile(lat, 50)),
+        "p95_ms": float(np.percentile(lat, 95)),
+        "p99_ms": float(np.percentile(lat, 99)),
+        "mean_ms": float(lat.mean()),
+        "qps": float(len(lat) / (lat.sum() / 1000)) if lat.sum() > 0 else 0.0,
+    }
+
+
+def recall_at_k(ranked_ids, relevant, k):
+    """Tỉ lệ chunk đúng (relevant) nằm trong k kết quả đầu"""
+    if not relevant:
+        return None
+    return len(set(ranked_ids[:k]) & set(relevant)) / len(relevant)
+
+
+def reciprocal_rank(ranked_ids, relevant):
+    """1 / vị trí của chunk đúng đầu tiên (0 nếu không có)"""
+    if not relevant:
+        return None
+    for rank, chunk_id in enumerate(ranked_ids, 1):
+        if chunk_id in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def mean_metric(values):
+    values = [v for v in values if v is not None]
+    return float(np.mean(values)) if values else None
+
+
+def peak_rss_mb():
+    """RSS cao nhất của tiến trình từ lúc chạy (ru_maxrss: KB trên Linux, byte trên macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
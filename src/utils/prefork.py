@@ -0,0 +1,86 @@
+import gc
+import os
+import signal
+import socket
+import time
+
+
+def bind_socket(host: str, port: int, backlog: int = 1024) -> socket.socket:
+    """Socket lắng nghe tạo ở process cha, các worker fork ra cùng accept trên socket này"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def freeze_heap():
+    """
+    Gọi ngay trước fork: dọn rác rồi chuyển mọi object hiện có sang thế hệ "permanent" của GC.
+    GC của worker không duyệt (ghi header) các object này nữa -> page của index / model đã load ở
+    process cha không bị copy-on-write sang từng worker.
+    """
+    gc.collect()
+    gc.freeze()
+
+
+def serve_prefork(run_worker, workers: int, restart_delay: float = 1.0):
+    """
+    Fork `workers` process con chạy run_worker(worker_id) (vòng lặp phục vụ, chặn tới khi dừng).
+    Process cha chỉ giám sát: worker chết bất thường thì fork lại; SIGINT / SIGTERM -> dừng tất cả.
+    Mọi thứ load trước lời gọi này (FAISS mmap, BM25, corpus, model) được các worker dùng chung.
+    """
+    if not hasattr(os, "fork"):
+        raise RuntimeError("Chế độ pre-fork cần os.fork (Linux / macOS)")
+
+    children = {}
+    stopping = False
+
+    def spawn(worker_id):
+        pid = os.fork()
+        if pid == 0:
+            # Worker: trả lại xử lý tín hiệu mặc định cho server bên trong
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                run_worker(worker_id)
+            except KeyboardInterrupt:
+                pass
+            except Exception as e:
+                print(f"❌ Worker {worker_id} (pid {os.getpid()}) lỗi: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = worker_id
+        print(f"👷 Worker {worker_id} pid {pid}")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    freeze_heap()
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for worker_id in range(workers):
+        spawn(worker_id)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker_id = children.pop(pid, None)
+        if worker_id is None or stopping:
+            continue
+        print(f"⚠️ Worker {worker_id} (pid {pid}) thoát với mã {os.waitstatus_to_exitcode(status)}, khởi động lại...")
+        time.sleep(restart_delay)
+        spawn(worker_id)
+    print("👋 Đã dừng tất cả worker")
@@ -0,0 +1,96 @@
+import time
+import random
+import threading
+
+
+def is_rate_limit_error(error) -> bool:
+    """Nhận diện lỗi quá tải API (HTTP 429 / ResourceExhausted / quota)"""
+    msg = f"{type(error).__name__} {error}".lower()
+    return any(s in msg for s in ("429", "rate limit", "ratelimit", "resourceexhausted", "resource exhausted", "quota"))
+
+
+class CooldownGate:
+    """
+    Cổng tạm dừng dùng chung giữa các worker.
+    Khi một worker gặp lỗi 429, cả pool cùng nghỉ thay vì tiếp tục bắn request vào API đang quá tải.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._until = 0.0
+
+    def wait(self):
+        delay = self._until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def cooldown(self, seconds):
+        with self._lock:
+            self._until = max(self._until, time.monotonic() + seconds)
+
+
+def retry_with_backoff(fn, *args, max_retries=5, base_delay=1.0, max_delay=60.0, gate=None, **kwargs):
+    """
+    Gọi fn(*args, **kwargs), thử lại với exponential backoff + jitter khi lỗi.
+    Lỗi rate limit dùng thời gian chờ gấp đôi và kích hoạt gate (nếu có) để cả pool cùng chờ.
+    """
+    attempt = 0
+    while True:
+        if gate is not None:
+            gate.wait()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt >= max_retries:
+                raise
+            delay = min(max_delay, base_delay * (2 ** attempt)) * (0.5 + random.random())
+            if is_rate_limit_error(e):
+                delay = min(max_delay, delay * 2)
+                if gate is not None:
+                    gate.cooldown(delay)
+                print(f"⚠️ Quá tải API (Rate Limit), đợi {delay:.1f}s rồi thử lại ({attempt + 1}/{max_retries})...")
+            else:
+                print(f"⚠️ Lỗi {type(e).__name__}: {e} -> thử lại sau {delay:.1f}s ({attempt + 1}/{max_retries})")
+            time.sleep(delay)
+            attempt += 1
+
+
+class TokenBucket:
+    """
+    Token bucket giới hạn tốc độ theo hạn mức của provider (vd. Groq: request/phút và token/phút).
+    acquire(cost) chặn cho tới khi đủ "token" trong xô; xô được nạp lại đều theo thời gian.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, rate_per_minute)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, cost: float = 1.0):
+        cost = min(cost, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= cost:
+                    self._tokens -= cost
+                    return
+                wait = (cost - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """Gộp giới hạn request/phút và token/phút; giá trị None/0 = không giới hạn"""
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def acquire(self, estimated_tokens: float = 0):
+        if self.requests is not None:
+            self.requests.acquire(1)
+        if self.tokens is not None and estimated_tokens:
+            self.tokens.acquire(estimated_tokens)
@@ -0,0 +1,63 @@
+import re
+import time
+import asyncio
+import threading
+
+
+class StubMessage:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class StubLLM:
+    """
+    LLM giả lập chạy offline (không mạng, không API key), cùng giao diện invoke() với ChatGroq.
+    Trả lời bằng dòng nội dung đầu tiên của phần văn bản trong prompt -> kết quả xác định, dùng để test/benchmark.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+        # Được gọi đồng thời từ thread pool (tóm tắt song song, benchmark) -> đếm dưới lock
+        self._lock = threading.Lock()
+
+    def _count(self):
+        with self._lock:
+            self.calls += 1
+
+    def _answer(self, prompt: str) -> str:
+        lines = [l.strip() for l in prompt.splitlines() if l.strip()]
+        # Bỏ phần hướng dẫn, lấy dòng đầu tiên trông giống nội dung văn bản luật
+        for line in lines:
+            if re.match(r"^điều\s+\d+", line, re.IGNORECASE):
+                return line[:80]
+        return lines[-1][:80] if lines else ""
+
+    def invoke(self, prompt: str) -> StubMessage:
+        self._count()
+        if self.latency:
+            time.sleep(self.latency)
+        return StubMessage(self._answer(prompt))
+
+    def stream(self, prompt: str):
+        """Trả từng từ một như API streaming (latency chia đều cho các token)"""
+        self._count()
+        words = self._answer(prompt).split(" ")
+        for i, word in enumerate(words):
+            if self.latency:
+                time.sleep(self.latency / len(words))
+            yield StubMessage(word if i == 0 else " " + word)
+
+    async def ainvoke(self, prompt: str) -> StubMessage:
+        self._count()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return StubMessage(self._answer(prompt))
+
+    async def astream(self, prompt: str):
+        self._count()
+        words = self._answer(prompt).split(" ")
+        for i, word in enumerate(words):
+            if self.latency:
+                await asyncio.sleep(self.latency / len(words))
+            yield StubMessage(word if i == 0 else " " + word)
@@ -1,4 +1,6 @@
 import re
+import hashlib
+import unicodedata
 
 # Nếu bạn có cài pyvi hoặc underthesea thì import ở đây. 
 # Ví dụ: from pyvi import ViTokenizer
@@ -24,4 +26,147 @@ def tokenize_vn(text: str):
 
 def get_meta_id(meta: dict) -> str:
     """Lấy ID định danh cho chunk để tính toán metrics"""
-    return meta.get("stable_id") or meta.get("chunk_id")
\ No newline at end of file
+    return meta.get("stable_id") or meta.get("chunk_id")
+
+def chunk_hash(text: str) -> str:
+    """Hash nội dung chunk (dùng làm chunk_id ổn định và khóa cache)"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+# "Điều 5", "điều 13a", "ĐIỀU 106"... có ranh giới từ ở 2 đầu: "Điều 1" không khớp bên trong "Điều 106"
+ARTICLE_REF_RE = re.compile(r"(?<!\w)điều\s+(\d+[a-zđ]*)(?!\w)", re.IGNORECASE)
+
+def normalize_article_id(number: str) -> str:
+    """'5A' -> 'Điều 5a' (cùng dạng với ID node trong knowledge graph)"""
+    return f"Điều {number.lower()}"
+
+def match_article_heading(text: str):
+    """ID điều luật ở đầu đoạn văn bản (chunk bắt đầu bằng 'Điều N'), không có thì trả về None"""
+    match = ARTICLE_REF_RE.match(text)
+    return normalize_article_id(match.group(1)) if match else None
+
+def extract_article_refs(text: str):
+    """Mọi điều luật được nhắc tới trong văn bản (theo thứ tự xuất hiện, không trùng) - 1 lượt quét regex"""
+    return list(dict.fromkeys(normalize_article_id(m.group(1)) for m in ARTICLE_REF_RE.finditer(text)))
+
+# Câu kết luận trong câu trả lời: "Đáp án đúng là B", "=> Đáp án: C", "chọn c" (không tính "lựa chọn a, b, c",
+# "phương án A sai", "đáp án A hoặc C")
+MCQ_EXPLICIT_RE = re.compile(
+    r"(?:đáp\s*án|(?<!lựa\s)chọn|câu\s*trả\s*lời|answer)(?:\s*(?:đúng\s*nhất|đúng|chính\s*xác|là|:|-))*"
+    r"\s*[\(\[*\"']*([a-d])(?![a-zà-ỹđ])"
+    r"(?![\)\].*\s]*(?:sai|không\s*đúng|chưa\s*đúng))(?![\)\].*]*\s*(?:,|/|hoặc|và)\s*[\(\[*]*[a-d](?![a-zà-ỹđ]))",
+    re.IGNORECASE,
+)
+MCQ_NONE_RE = re.compile(
+    r"không\s*có\s*(?:đáp\s*án|phương\s*án|lựa\s*chọn)\s*(?:nào\s*)?(?:đúng|chính\s*xác)"
+    r"|(?:cả|tất\s*cả)(?:\s*các)?\s*(?:đáp\s*án|phương\s*án)(?:\s*\w+)?\s*đều\s*sai",
+    re.IGNORECASE,
+)
+MCQ_LEADING_RE = re.compile(r"^[\s*\(\[]*([a-d])\s*[\)\].:]", re.IGNORECASE)
+MCQ_OPTION_RE = re.compile(r"^\s*([a-d])[\.\)]\s+(.+)$", re.IGNORECASE | re.MULTILINE)
+
+def parse_mcq_options(question: str) -> dict:
+    """Các phương án trong đề: {"a": "Từ đủ 15 tuổi trở lên", ...}"""
+    return {m.group(1).lower(): m.group(2).strip() for m in MCQ_OPTION_RE.finditer(question)}
+
+def parse_mcq_choice(answer: str, options: dict = None):
+    """
+    Chữ cái (a-d) được chọn trong câu trả lời, không cần LLM:
+    1. câu kết luận ("Đáp án đúng là B", "chọn c") - lấy câu kết luận CUỐI CÙNG (phân tích từng phương án trước rồi mới chốt)
+    2. câu trả lời chỉ mở đầu bằng 1 chữ cái ("B. ...", "**c)**"), không liệt kê chữ cái khác ở đầu dòng
+    3. câu trả lời chứa nguyên văn đúng 1 phương án.
+    Không xác định được / nhắc nhiều phương án mà không chốt / "không có đáp án nào đúng" -> None (nhờ giám khảo LLM).
+    """
+    if not answer:
+        return None
+    answer = unicodedata.normalize("NFC", answer)
+    if MCQ_NONE_RE.search(answer):
+        return None
+    matches = MCQ_EXPLICIT_RE.findall(answer)
+    if matches:
+        return matches[-1].lower()
+    lines = [line for line in answer.splitlines() if line.strip()]
+    leading = [MCQ_LEADING_RE.match(line) for line in lines]
+    letters = {m.group(1).lower() for m in leading if m}
+    if leading and leading[0] and len(letters) == 1:
+        return leading[0].group(1).lower()
+    if options and not letters:
+        text = preprocess_text(answer)
+        found = [k for k, v in options.items() if preprocess_text(v) and preprocess_text(v) in text]
+        # "Cả 2 đáp án trên" chứa trong nhiều câu -> chỉ nhận khi khớp đúng 1 phương án
+        if len(found) == 1:
+            return found[0]
+    return None
+
+# Mã loại văn bản trong tên file nguồn: "117_2024_NĐ-CP.pdf", "VanBanGoc_52.2014.QH13.pdf", "01.2016.TTLT...pdf"
+DOC_TYPE_RE = re.compile(r"(?:^|[_.\s-])(TTLT|QH|NQ|NĐ|QĐ|CT|TT)(?=\d|[-._\s]|$)")
+DOC_TYPE_PREFIXES = {
+    "luật": "QH", "nghị quyết": "NQ", "nghị định": "NĐ", "quyết định": "QĐ",
+    "chỉ thị": "CT", "thông tư liên tịch": "TTLT", "thông tư": "TT",
+}
+YEAR_RE = re.compile(r"(?<!\d)((?:19|20)\d{2})(?!\d)")
+
+def parse_source_info(source: str) -> dict:
+    """Suy ra loại văn bản (mã: QH, NQ, NĐ, QĐ, CT, TT, TTLT) và năm ban hành từ tên file nguồn"""
+    name = (source or "").strip().rsplit(".pdf", 1)[0]
+    match = DOC_TYPE_RE.search(name.upper())
+    doc_type = match.group(1) if match else None
+    if doc_type is None:
+        lower = name.lower()
+        doc_type = next((code for prefix, code in DOC_TYPE_PREFIXES.items() if lower.startswith(prefix)), None)
+    year = YEAR_RE.search(name)
+    return {"doc_type": doc_type, "year": int(year.group(1)) if year else None}
+
+def article_number(text: str):
+    """Số điều của chunk bắt đầu bằng tiêu đề 'Điều N' (bỏ hậu tố chữ: 'Điều 13a' -> 13), không có thì None"""
+    match = ARTICLE_REF_RE.match(text)
+    return int(re.match(r"\d+", match.group(1)).group(0)) if match else None
+
+NODE_ID_SEP = "#"
+
+def make_node_id(source: str, article: str) -> str:
+    """ID node theo phạm vi văn bản: 'VanBanGoc_52.2014.QH13.pdf#Điều 5' (mỗi văn bản có 'Điều 5' riêng)"""
+    return f"{(source or '').strip()}{NODE_ID_SEP}{article}"
+
+def split_node_id(node_id: str):
+    """'nguồn#Điều 5' -> ('nguồn', 'Điều 5'); ID kiểu cũ 'Điều 5' -> (None, 'Điều 5')"""
+    if NODE_ID_SEP in node_id:
+        source, article = node_id.rsplit(NODE_ID_SEP, 1)
+        return source, article
+    return None, node_id
+
+class ArticleMatcher:
+    """
+    Bộ so khớp điều luật dựng sẵn 1 lần từ danh sách node ID của graph.
+    find() quét văn bản đúng 1 lượt, chỉ giữ các điều luật có trong graph.
+    Node theo phạm vi văn bản:
+    - biết source (đoạn văn bản tìm được): chỉ lấy node của chính văn bản đó, không lấy "Điều N" của văn bản khác
+    - không biết source (câu hỏi): lấy node "Điều N" của mọi văn bản, không chọn tùy ý 1 văn bản
+    Node kiểu cũ không có nguồn (graph trước khi tách theo văn bản) khớp theo số điều như trước.
+    """
+
+    def __init__(self, node_ids):
+        self.scoped = {}     # (source, article) -> node_id
+        self.legacy = {}     # article -> node_id kiểu cũ (không có nguồn)
+        self.all_of = {}     # article -> [node_id của mọi văn bản]
+        for node_id in node_ids:
+            source, label = split_node_id(node_id)
+            article = match_article_heading(label)
+            if not article:
+                continue
+            self.all_of.setdefault(article, []).append(node_id)
+            if source is None:
+                self.legacy.setdefault(article, node_id)
+            else:
+                self.scoped.setdefault((source, article), node_id)
+
+    def find(self, text: str, source: str = None):
+        source = source.strip() if source else None
+        found = []
+        for a in extract_article_refs(text):
+            if source:
+                node_id = self.scoped.get((source, a)) or self.legacy.get(a)
+                if node_id:
+                    found.append(node_id)
+            else:
+                found.extend(self.all_of.get(a, []))
+        return list(dict.fromkeys(found))
@@ -0,0 +1,63 @@
+import time
+import threading
+from contextlib import contextmanager
+
+
+class StartupTimer:
+    """
+    Ghi lại thời gian từng giai đoạn khởi động (import, load index, load model...).
+    Các bước khởi tạo lười (lần dùng đầu tiên) cũng ghi vào cùng timer để xem tổng chi phí.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.t0 = time.perf_counter()
+        self.phases = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, label: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases.append((label, time.perf_counter() - start))
+
+    def report(self) -> str:
+        lines = [f"⏱️ Khởi động {self.name}: {time.perf_counter() - self.t0:.3f}s kể từ lúc tạo"]
+        with self._lock:
+            for label, elapsed in self.phases:
+                lines.append(f"   - {label:<40} {elapsed * 1000:>9.1f} ms")
+        return "\n".join(lines)
+
+
+class LazyLoader:
+    """
+    Khởi tạo một đối tượng nặng ở lần dùng đầu tiên (thread-safe, chỉ khởi tạo 1 lần).
+    Dùng cho model / index chưa chắc đã cần tới trong phiên làm việc.
+    """
+
+    def __init__(self, factory, label: str, timer: StartupTimer = None):
+        self._factory = factory
+        self._label = label
+        self._timer = timer
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    if self._timer is not None:
+                        with self._timer.phase(f"{self._label} (lazy)"):
+                            self._value = self._factory()
+                    else:
+                        self._value = self._factory()
+                    self._loaded = True
+        return self._value
@@ -0,0 +1,279 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextvars import ContextVar
+
+# Cận trên (giây) của các bucket histogram độ trễ
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Trace đang hoạt động của luồng / task hiện tại (copy_context() / asyncio.to_thread mang theo sang thread khác)
+_current_trace = ContextVar("current_trace", default=None)
+_current_span = ContextVar("current_span", default=None)
+
+
+class _NoopScope:
+    """Context manager rỗng dùng chung khi tracing tắt -> chi phí chỉ là 1 lần gọi hàm"""
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopScope()
+
+
+class Trace:
+    """Một lần xử lý (1 câu hỏi / 1 lô): danh sách span theo thời gian, tính từ lúc bắt đầu trace"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.wall_start = time.time()
+        self.t0 = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def record(self, name: str, start: float, end: float, parent=None, **attrs):
+        """Thêm span đã đo sẵn (start/end theo time.perf_counter)"""
+        span = {"name": name, "start_ms": (start - self.t0) * 1000, "duration_ms": (end - start) * 1000,
+                "parent": parent, "thread": threading.get_ident()}
+        if attrs:
+            span["attrs"] = attrs
+        with self._lock:
+            self.spans.append(span)
+
+    def breakdown(self) -> dict:
+        """Tổng thời gian (ms) theo tên stage, đưa vào meta của câu trả lời"""
+        out = {}
+        with self._lock:
+            for span in self.spans:
+                out[span["name"]] = round(out.get(span["name"], 0.0) + span["duration_ms"], 3)
+        if self.duration is not None:
+            out["total"] = round(self.duration * 1000, 3)
+        return out
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            spans = list(self.spans)
+        return {"trace_id": self.trace_id, "name": self.name, "start": self.wall_start,
+                "duration_ms": self.duration * 1000 if self.duration is not None else None, "spans": spans}
+
+    def chrome_events(self, pid: int = 0) -> list:
+        """Sự kiện dạng Chrome Trace Event ("ph": "X"), mở bằng chrome://tracing hoặc Perfetto"""
+        base = self.wall_start * 1e6
+        events = [{"name": self.name, "ph": "X", "ts": base, "dur": (self.duration or 0.0) * 1e6,
+                   "pid": pid, "tid": 0, "args": {"trace_id": self.trace_id}}]
+        with self._lock:
+            for span in self.spans:
+                events.append({"name": span["name"], "ph": "X", "ts": base + span["start_ms"] * 1000,
+                               "dur": span["duration_ms"] * 1000, "pid": pid, "tid": span["thread"],
+                               "args": dict(span.get("attrs", {}), trace_id=self.trace_id)})
+        return events
+
+
+class _SpanScope:
+    def __init__(self, tracer, name, trace, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.trace = trace
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.parent = _current_span.get()
+        self._token = _current_span.set(self.name)
+        return self.trace or _current_trace.get()
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        _current_span.reset(self._token)
+        trace = self.trace or _current_trace.get()
+        if trace is not None:
+            trace.record(self.name, self.start, end, self.parent, **self.attrs)
+        self.tracer.metrics.observe(self.name, end - self.start, error=exc_type is not None)
+        return False
+
+
+class _ActivateScope:
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __enter__(self):
+        self._token = _current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, *exc):
+        _current_trace.reset(self._token)
+        return False
+
+
+class _TraceScope:
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self):
+        self.trace = self.tracer.start_trace(self.name)
+        self._activate = _ActivateScope(self.trace)
+        return self._activate.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        self._activate.__exit__()
+        self.tracer.finish(self.trace, error=exc_type is not None)
+        return False
+
+
+class MetricsRegistry:
+    """Counter + histogram độ trễ theo stage, xuất dạng text của Prometheus"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._errors = {}
+        self._sum = {}
+        self._bucket_counts = {}
+
+    def observe(self, stage: str, seconds: float, error: bool = False):
+        with self._lock:
+            counts = self._bucket_counts.get(stage)
+            if counts is None:
+                counts = self._bucket_counts[stage] = [0] * len(self.buckets)
+            for i, le in enumerate(self.buckets):
+                if seconds <= le:
+                    counts[i] += 1
+                    break
+            self._calls[stage] = self._calls.get(stage, 0) + 1
+            self._sum[stage] = self._sum.get(stage, 0.0) + seconds
+            if error:
+                self._errors[stage] = self._errors.get(stage, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {stage: {"calls": self._calls[stage], "errors": self._errors.get(stage, 0),
+                            "sum_seconds": self._sum[stage]} for stage in self._calls}
+
+    def render_prometheus(self, prefix: str = "rag") -> str:
+        lines = [f"# HELP {prefix}_stage_calls_total Số lần chạy mỗi stage",
+                 f"# TYPE {prefix}_stage_calls_total counter"]
+        with self._lock:
+            stages = sorted(self._calls)
+            for stage in stages:
+                lines.append(f'{prefix}_stage_calls_total{{stage="{stage}"}} {self._calls[stage]}')
+            lines += [f"# HELP {prefix}_stage_errors_total Số lần stage kết thúc bằng exception",
+                      f"# TYPE {prefix}_stage_errors_total counter"]
+            for stage in stages:
+                lines.append(f'{prefix}_stage_errors_total{{stage="{stage}"}} {self._errors.get(stage, 0)}')
+            lines += [f"# HELP {prefix}_stage_duration_seconds Độ trễ mỗi stage",
+                      f"# TYPE {prefix}_stage_duration_seconds histogram"]
+            for stage in stages:
+                cumulative = 0
+                for le, count in zip(self.buckets, self._bucket_counts[stage]):
+                    cumulative += count
+                    lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {self._calls[stage]}')
+                lines.append(f'{prefix}_stage_duration_seconds_sum{{stage="{stage}"}} {self._sum[stage]:.6f}')
+                lines.append(f'{prefix}_stage_duration_seconds_count{{stage="{stage}"}} {self._calls[stage]}')
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    """
+    Đo thời gian từng stage (embed, FAISS, BM25, fusion, rerank, graph, LLM...):
+    - span(name): đo 1 đoạn code, gắn vào trace đang hoạt động (nếu có) + cộng vào metrics
+    - trace(name): mở trace cho 1 lần xử lý; nếu đã có trace đang chạy thì chỉ là 1 span lồng bên trong
+    - start_trace / activate / finish: cho luồng không gói được trong 1 khối with (câu trả lời dạng stream)
+    enabled=False: mọi hàm trả về context rỗng dùng chung, không đo, không cấp phát.
+    """
+
+    def __init__(self, enabled: bool = True, buckets=DEFAULT_BUCKETS, keep_traces: int = 100, export_path=None):
+        self.enabled = enabled
+        self.metrics = MetricsRegistry(buckets)
+        self.traces = deque(maxlen=keep_traces)
+        self.export_path = export_path
+        self._export_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cfg) -> "Tracer":
+        tracing_cfg = (cfg or {}).get("tracing", {})
+        return cls(
+            enabled=tracing_cfg.get("enabled", True),
+            buckets=tracing_cfg.get("buckets", DEFAULT_BUCKETS),
+            keep_traces=tracing_cfg.get("keep_traces", 100),
+            export_path=tracing_cfg.get("export_path"),
+        )
+
+    def span(self, name: str, trace: Trace = None, **attrs):
+        if not self.enabled:
+            return _NOOP
+        return _SpanScope(self, name, trace, attrs)
+
+    def trace(self, name: str):
+        if not self.enabled:
+            return _NOOP
+        if _current_trace.get() is not None:
+            return _SpanScope(self, name, None, {})
+        return _TraceScope(self, name)
+
+    def start_trace(self, name: str):
+        return Trace(name) if self.enabled else None
+
+    def activate(self, trace: Trace):
+        return _ActivateScope(trace) if trace is not None else _NOOP
+
+    def record(self, name: str, start: float, end: float, trace: Trace = None, error: bool = False, **attrs):
+        """Ghi span đo thủ công (vd generator stream token chạy ngoài khối with của trace)"""
+        if not self.enabled:
+            return
+        trace = trace or _current_trace.get()
+        if trace is not None:
+            trace.record(name, start, end, **attrs)
+        self.metrics.observe(name, end - start, error=error)
+
+    @staticmethod
+    def current():
+        return _current_trace.get()
+
+    def finish(self, trace: Trace, error: bool = False):
+        """Đóng trace: ghi tổng thời gian vào metrics, giữ trong bộ nhớ đệm, ghi JSONL nếu có export_path"""
+        if trace is None or trace.duration is not None:
+            return None
+        trace.duration = time.perf_counter() - trace.t0
+        self.metrics.observe(trace.name, trace.duration, error=error)
+        self.traces.append(trace)
+        if self.export_path:
+            with self._export_lock:
+                os.makedirs(os.path.dirname(os.path.abspath(self.export_path)), exist_ok=True)
+                with open(self.export_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(trace.to_dict(), ensure_ascii=False) + "\n")
+        return trace
+
+    def export_json(self, path: str):
+        """Ghi các trace gần nhất theo định dạng Chrome Trace Event (chrome://tracing, Perfetto)"""
+        events = [event for trace in list(self.traces) for event in trace.chrome_events(pid=os.getpid())]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+        return path
+
+    def prometheus(self) -> str:
+        return self.metrics.render_prometheus()
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer(cfg=None) -> Tracer:
+    """Tracer dùng chung của tiến trình (metrics cộng dồn mọi thành phần); cấu hình từ mục `tracing` ở lần gọi đầu"""
+    global _tracer
+    if _tracer is None:
+        with _tracer_lock:
+            if _tracer is None:
+                _tracer = Tracer.from_config(cfg)
+    return _tracer
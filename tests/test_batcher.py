@@ -0,0 +1,143 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from src.services.batcher import DeadlineExceeded, MicroBatcher, QueueFullError  # noqa: E402
+
+
+class Recorder:
+    """process_batch ghi lại từng lô; gate (threading.Event) giữ worker bận tới khi được mở"""
+
+    def __init__(self, gate=None):
+        self.batches = []
+        self.gate = gate
+        self.started = threading.Event()
+
+    def __call__(self, items):
+        self.batches.append(list(items))
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        return [ValueError(f"lỗi {x}") if x == "bad" else x * 2 for x in items]
+
+
+async def wait_started(recorder):
+    await asyncio.to_thread(recorder.started.wait, 5)
+
+
+def test_concurrent_submits_coalesce_into_one_batch():
+    async def main():
+        recorder = Recorder()
+        batcher = MicroBatcher(recorder, max_batch_size=32, max_wait_ms=50)
+        await batcher.start()
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(10)))
+        await batcher.stop()
+        return recorder, batcher, results
+
+    recorder, batcher, results = asyncio.run(main())
+    assert results == [i * 2 for i in range(10)]
+    assert recorder.batches == [list(range(10))]
+    assert batcher.stats()["batches"] == 1 and batcher.stats()["avg_batch_size"] == 10
+
+
+def test_batches_are_capped_at_max_batch_size():
+    async def main():
+        recorder = Recorder()
+        batcher = MicroBatcher(recorder, max_batch_size=4, max_wait_ms=50)
+        await batcher.start()
+        await asyncio.gather(*(batcher.submit(i) for i in range(10)))
+        await batcher.stop()
+        return recorder
+
+    assert [len(b) for b in asyncio.run(main()).batches] == [4, 4, 2]
+
+
+def test_full_queue_rejects_immediately():
+    async def main():
+        gate = threading.Event()
+        recorder = Recorder(gate)
+        batcher = MicroBatcher(recorder, max_batch_size=1, max_wait_ms=0, max_queue=2)
+        await batcher.start()
+        first = asyncio.create_task(batcher.submit(1))
+        await wait_started(recorder)  # worker đang bận với request 1, hàng đợi trống
+        queued = [asyncio.create_task(batcher.submit(i)) for i in (2, 3)]
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError):
+            await batcher.submit(4)
+        gate.set()
+        results = await asyncio.gather(first, *queued)
+        await batcher.stop()
+        return batcher, results
+
+    batcher, results = asyncio.run(main())
+    assert results == [2, 4, 6]
+    assert batcher.rejected == 1 and batcher.submitted == 3
+
+
+def test_request_expiring_in_queue_is_dropped_and_counted_once():
+    async def main():
+        gate = threading.Event()
+        recorder = Recorder(gate)
+        batcher = MicroBatcher(recorder, max_batch_size=8, max_wait_ms=0)
+        await batcher.start()
+        first = asyncio.create_task(batcher.submit(1))
+        await wait_started(recorder)
+        # Worker bận -> request 2 nằm trong hàng đợi quá deadline
+        late = asyncio.create_task(batcher.submit(2, timeout=0.05))
+        await asyncio.sleep(0.1)
+        gate.set()
+        with pytest.raises(DeadlineExceeded):
+            await late
+        assert await first == 2
+        # Thêm 1 lô để chắc chắn worker đã duyệt qua request quá hạn
+        assert await batcher.submit(3) == 6
+        await batcher.stop()
+        return recorder, batcher
+
+    recorder, batcher = asyncio.run(main())
+    assert recorder.batches == [[1], [3]]
+    assert batcher.expired == 1
+    assert batcher.stats()["items"] == 2
+
+
+def test_item_exception_does_not_fail_the_batch():
+    async def main():
+        recorder = Recorder()
+        batcher = MicroBatcher(recorder, max_wait_ms=50)
+        await batcher.start()
+        results = await asyncio.gather(*(batcher.submit(x) for x in (1, "bad", 3)), return_exceptions=True)
+        await batcher.stop()
+        return recorder, results
+
+    recorder, results = asyncio.run(main())
+    assert len(recorder.batches) == 1
+    assert results[0] == 2 and results[2] == 6
+    assert isinstance(results[1], ValueError)
+
+
+def test_batch_exception_fails_every_item_and_worker_keeps_running():
+    calls = []
+
+    def process(items):
+        calls.append(list(items))
+        if len(calls) == 1:
+            raise RuntimeError("model lỗi")
+        return items
+
+    async def main():
+        batcher = MicroBatcher(process, max_wait_ms=50)
+        await batcher.start()
+        failed = await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+        ok = await batcher.submit(3)
+        await batcher.stop()
+        return failed, ok
+
+    failed, ok = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in failed)
+    assert ok == 3
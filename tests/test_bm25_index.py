@@ -0,0 +1,98 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from src.core.bm25_index import SparseBM25  # noqa: E402
+
+# "a" có trong 4/4 văn bản -> idf âm -> thay bằng epsilon * idf trung bình (vẫn âm vì corpus nhỏ)
+NEGATIVE_IDF_DOCS = [["a", "b"], ["a", "c"], ["a", "d"], ["b", "a"]]
+QUERIES = [["a"], ["b"], ["a", "b"], ["c", "c", "d"], ["a", "x"], ["x"], []]
+
+
+def make_corpus(n_docs=200, vocab_size=60, seed=0):
+    rng = np.random.default_rng(seed)
+    words = [f"w{i}" for i in range(vocab_size)]
+    # Phân phối lệch (Zipf) để có cả từ rất phổ biến lẫn từ hiếm
+    p = 1.0 / np.arange(1, vocab_size + 1)
+    p /= p.sum()
+    return [rng.choice(words, size=int(rng.integers(3, 25)), p=p).tolist() for _ in range(n_docs)]
+
+
+@pytest.mark.parametrize("docs", [NEGATIVE_IDF_DOCS, make_corpus()])
+def test_scores_match_rank_bm25(docs):
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    ref = rank_bm25.BM25Okapi(docs)
+    bm25 = SparseBM25.build(docs)
+    queries = QUERIES + [docs[0][:3], docs[-1]]
+    for q in queries:
+        # Trọng số lưu float32 -> sai khác ~1e-5 so với float64 của rank_bm25
+        np.testing.assert_allclose(bm25.get_scores(q), ref.get_scores(q), atol=1e-4)
+
+
+def test_negative_idf_term_has_negative_weights():
+    bm25 = SparseBM25.build(NEGATIVE_IDF_DOCS)
+    assert bm25.max_weights[bm25.vocab["a"]] < 0
+    assert (bm25.get_scores(["a"]) < 0).all()
+
+
+def is_mmapped(arr):
+    # scipy bọc mảng thành ndarray thường nhưng vẫn là view trên vùng memory-map (không copy)
+    while arr is not None and not isinstance(arr, np.memmap):
+        arr = arr.base
+    return arr is not None
+
+
+def test_save_load_mmap_roundtrip(tmp_path):
+    docs = make_corpus()
+    bm25 = SparseBM25.build(docs)
+    bm25.save(tmp_path / "bm25")
+    loaded = SparseBM25.load(tmp_path / "bm25", mmap=True)
+
+    assert all(is_mmapped(a) for a in (loaded.weights.data, loaded.weights.indices, loaded.weights.indptr))
+    assert loaded.vocab == bm25.vocab
+    assert loaded.params == bm25.params
+    np.testing.assert_array_equal(loaded.max_weights, bm25.max_weights)
+    for q in QUERIES + [docs[0], docs[1][:2]]:
+        np.testing.assert_array_equal(loaded.get_scores(q), bm25.get_scores(q))
+        np.testing.assert_array_equal(loaded.topk(q, 10)[0], bm25.topk(q, 10)[0])
+
+
+def test_topk_batch_equals_topk():
+    docs = make_corpus()
+    bm25 = SparseBM25.build(docs)
+    queries = QUERIES + [d[:4] for d in docs[:20]]
+    for k in (1, 10, len(docs) + 5):
+        for (ids, scores), q in zip(bm25.topk_batch(queries, k), queries):
+            ref_ids, ref_scores = bm25.topk(q, k)
+            np.testing.assert_allclose(scores, ref_scores, rtol=1e-6)
+            # Thứ tự chỉ được phép khác giữa các văn bản bằng điểm
+            np.testing.assert_allclose(bm25.get_scores(q)[ids], ref_scores, rtol=1e-6)
+
+
+def test_topk_batch_with_doc_ids_ranks_only_selected_docs():
+    docs = make_corpus()
+    bm25 = SparseBM25.build(docs)
+    doc_ids = np.arange(0, len(docs), 7)
+    q = docs[3][:4]
+    ids, scores = bm25.topk_batch([q], 5, doc_ids=doc_ids)[0]
+    assert set(ids.tolist()) <= set(doc_ids.tolist())
+    full = bm25.get_scores(q)[doc_ids]
+    np.testing.assert_allclose(scores, np.sort(full)[::-1][:5], rtol=1e-6)
+
+
+@pytest.mark.parametrize("docs", [NEGATIVE_IDF_DOCS, make_corpus()])
+def test_topk_wand_matches_topk_scores(docs):
+    bm25 = SparseBM25.build(docs)
+    for q in QUERIES + [d[:4] for d in docs[:20]]:
+        _, ref_scores = bm25.topk(q, 10)
+        term_ids = [bm25.vocab[t] for t in q if t in bm25.vocab]
+        if (bm25.max_weights[term_ids] >= 0).all():
+            # WAND chỉ trả văn bản có điểm > 0; có từ trọng số âm thì topk_wand dùng lại topk()
+            ref_scores = ref_scores[ref_scores > 0]
+        _, scores = bm25.topk_wand(q, 10)
+        np.testing.assert_allclose(scores, ref_scores, rtol=1e-5)
@@ -0,0 +1,155 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from src.core.filters import MetadataFilterIndex, pack_mask  # noqa: E402
+
+SOURCES = [
+    ("VanBanGoc_52.2014.QH13.pdf", 6),      # Luật, 2014
+    ("117_2024_NĐ-CP.pdf", 4),               # Nghị định, 2024
+    ("Luật Hôn nhân và gia đình 2014.pdf", 5),  # Luật (tên tiếng Việt), 2014
+    ("01.2016.TTLT-BTP.pdf", 3),             # Thông tư liên tịch, 2016
+]
+
+
+def make_corpus():
+    docs, metas = [], []
+    for source, n_articles in SOURCES:
+        docs.append(f"Lời nói đầu của {source}")  # chunk không bắt đầu bằng "Điều N"
+        metas.append({"source": source})
+        for number in range(1, n_articles + 1):
+            docs.append(f"Điều {number}. Nội dung điều {number}")
+            metas.append({"source": source})
+    return docs, metas
+
+
+@pytest.fixture
+def index():
+    docs, metas = make_corpus()
+    return MetadataFilterIndex.build(docs, metas)
+
+
+def ids_where(pred):
+    docs, metas = make_corpus()
+    out = []
+    for i, (doc, meta) in enumerate(zip(docs, metas)):
+        number = int(doc.split(".")[0].split()[1]) if doc.startswith("Điều") else None
+        if pred(meta["source"], number):
+            out.append(i)
+    return out
+
+
+def selected_ids(index, filters):
+    selected = index.select(filters)
+    return None if selected is None else selected[1].tolist()
+
+
+def test_no_filter_selects_nothing(index):
+    assert index.select(None) is None
+    assert index.select({}) is None
+    assert index.select({"year": None}) is None
+
+
+def test_or_within_field_and_across_fields(index):
+    assert selected_ids(index, {"year": 2014}) == ids_where(lambda s, n: "2014" in s)
+    assert selected_ids(index, {"year": [2016, 2024]}) == ids_where(lambda s, n: "2016" in s or "2024" in s)
+    assert selected_ids(index, {"doc_type": ["NĐ", "TTLT"]}) == ids_where(lambda s, n: "NĐ" in s or "TTLT" in s)
+    # AND giữa các field: Luật năm 2014 trong 1 văn bản cụ thể
+    assert selected_ids(index, {"doc_type": "QH", "year": 2014, "source": "VanBanGoc_52.2014.QH13"}) == \
+        ids_where(lambda s, n: s.startswith("VanBanGoc"))
+    assert selected_ids(index, {"doc_type": "NĐ", "year": 2014}) == []
+
+
+def test_doc_type_alias_and_source_normalisation(index):
+    luat = ids_where(lambda s, n: "QH" in s or s.startswith("Luật"))
+    assert selected_ids(index, {"doc_type": "Luật"}) == luat
+    assert selected_ids(index, {"doc_type": "qh"}) == luat
+    assert selected_ids(index, {"doc_type": "Nghị định"}) == ids_where(lambda s, n: "NĐ" in s)
+    # Đuôi .pdf và hoa / thường không quan trọng
+    assert selected_ids(index, {"source": " 117_2024_nđ-cp "}) == ids_where(lambda s, n: s.startswith("117"))
+
+
+def test_article_ranges(index):
+    assert selected_ids(index, {"article": 5}) == ids_where(lambda s, n: n == 5)
+    assert selected_ids(index, {"article": [2, 4]}) == ids_where(lambda s, n: n is not None and 2 <= n <= 4)
+    assert selected_ids(index, {"article": [5, None]}) == ids_where(lambda s, n: n is not None and n >= 5)
+    assert selected_ids(index, {"article": [None, 1]}) == ids_where(lambda s, n: n == 1)
+    assert selected_ids(index, {"article": [3, 4], "year": 2024}) == \
+        ids_where(lambda s, n: "2024" in s and n in (3, 4))
+
+
+def test_empty_selection(index):
+    selected = index.select({"source": "khong_ton_tai.pdf"})
+    assert selected is not None and len(selected[1]) == 0
+    assert selected_ids(index, {"article": 99}) == []
+
+
+def test_unknown_field_raises(index):
+    with pytest.raises(ValueError, match="Bộ lọc không hỗ trợ"):
+        index.select({"author": "Quốc hội"})
+
+
+def test_bitmap_layout_and_save_load(index, tmp_path):
+    filters = {"year": 2014, "article": [1, 3]}
+    bits, ids = index.select(filters)
+    mask = np.zeros(index.n_docs, dtype=bool)
+    mask[ids] = True
+    np.testing.assert_array_equal(bits, pack_mask(mask))
+
+    index.save(tmp_path / "filters")
+    assert MetadataFilterIndex.exists(tmp_path / "filters")
+    loaded = MetadataFilterIndex.load(tmp_path / "filters", mmap=True)
+    assert selected_ids(loaded, filters) == ids.tolist()
+
+
+def test_searcher_returns_empty_results_for_empty_selection(tmp_path):
+    from src.core.search_engine import HybridSearcher
+
+    docs, metas = make_corpus()
+    arts = tmp_path / "artifacts"
+    arts.mkdir()
+    json.dump(docs, open(arts / "docs.json", "w", encoding="utf-8"), ensure_ascii=False)
+    json.dump(metas, open(arts / "metas.json", "w", encoding="utf-8"), ensure_ascii=False)
+    cfg = {
+        "paths": {"artifacts_dir": str(arts)},
+        "index": {},
+        "retrieval": {"bm25_topk": 10, "dense_topk": 10, "rrf_K": 60, "final_topk": 5},
+    }
+    searcher = HybridSearcher(cfg)
+
+    # Không văn bản nào thỏa bộ lọc -> [] ngay, không cần FAISS / embedding
+    for mode in ("hybrid", "vector_only", "bm25_only"):
+        assert searcher.search("nội dung điều", mode=mode, filters={"year": 1999}) == []
+    results = searcher.search("nội dung điều 3", mode="bm25_only", filters={"doc_type": "Luật", "article": 3})
+    assert [r["id"] for r in results] == ids_where(lambda s, n: ("QH" in s or s.startswith("Luật")) and n == 3)
+
+
+@pytest.mark.parametrize("spec", ["Flat", "IVF32,Flat", "HNSW32,Flat"])
+def test_selective_filter_keeps_recall_on_approximate_indexes(spec):
+    faiss = pytest.importorskip("faiss")
+    from src.core.faiss_index import filter_search_params
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((2000, 16)).astype(np.float32)
+    queries = rng.standard_normal((10, 16)).astype(np.float32)
+    index = faiss.index_factory(16, spec)
+    index.train(vectors)
+    index.add(vectors)
+    if spec.startswith("IVF"):
+        faiss.extract_index_ivf(index).nprobe = 1
+    if spec.startswith("HNSW"):
+        faiss.downcast_index(index).hnsw.efSearch = 16
+
+    for ids in (np.sort(rng.choice(len(vectors), 5, replace=False)), np.arange(100, 105)):
+        params, _keep = filter_search_params(index, ids)
+        _, found = index.search(queries, 10, params=params)
+        # Chỉ 5 vector được phép -> mọi truy vấn phải thấy đủ cả 5 (chỉ kiểm tra selector trong cụm / node đã duyệt
+        # thì IVF / HNSW trả thiếu)
+        for row in found:
+            assert sorted(row[row >= 0].tolist()) == ids.tolist()
@@ -0,0 +1,95 @@
+import os
+import sys
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from src.core.fusion import fuse  # noqa: E402
+
+
+def rrf_reference(ranked_lists, weights=None, K=60, topk=10):
+    """Bản dict trước khi vector hóa (rrf_fuse cũ); -1 của FAISS bị bỏ ở bước format kết quả"""
+    if weights is None:
+        weights = [1.0] * len(ranked_lists)
+    scores = defaultdict(float)
+    for lst, w in zip(ranked_lists, weights):
+        for rank, idx in enumerate(lst, start=1):
+            scores[idx] += w * (1.0 / (K + rank))
+    ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    return [i for i, _ in ranked if i != -1][:topk]
+
+
+def test_rrf_matches_dict_reference_on_random_lists():
+    rng = np.random.default_rng(0)
+    for _ in range(500):
+        n_docs = int(rng.integers(1, 30))
+        lists = []
+        for _ in range(int(rng.integers(1, 4))):
+            lst = rng.permutation(n_docs)[: int(rng.integers(0, n_docs + 1))].tolist()
+            # FAISS đệm -1 ở cuối khi không đủ kết quả
+            lst += [-1] * int(rng.integers(0, 3))
+            lists.append(lst)
+        weights = rng.choice([0.5, 1.0, 2.0], size=len(lists)).tolist()
+        topk = int(rng.integers(1, 15))
+
+        ids, _, _ = fuse(lists, method="rrf", weights=weights, K=60, topk=topk)
+        assert ids.tolist() == rrf_reference(lists, weights, K=60, topk=topk)
+
+
+def test_rrf_ties_keep_first_appearance():
+    # 1 và 4 cùng hạng 1, 2 và 3 cùng hạng 2 -> điểm bằng nhau, giữ thứ tự xuất hiện đầu tiên
+    lists = [[1, 2], [4, 3]]
+    ids, fused, _ = fuse(lists, method="rrf", K=60, topk=4)
+    assert ids.tolist() == [1, 4, 2, 3] == rrf_reference(lists, topk=4)
+    assert fused[0] == fused[1] == pytest.approx(1 / 61)
+    # Cắt top-k ngay giữa nhóm bằng điểm
+    assert fuse(lists, method="rrf", K=60, topk=3)[0].tolist() == [1, 4, 2]
+
+
+def test_padding_keeps_rank_positions_and_is_not_returned():
+    ids, fused, hits = fuse([[-1, 5], [5, -1, -1]], method="rrf", K=60, topk=5)
+    assert ids.tolist() == [5]
+    # -1 vẫn chiếm hạng 1 ở danh sách đầu -> 5 ở hạng 2
+    assert fused[0] == pytest.approx(1 / 62 + 1 / 61)
+    assert hits.tolist() == [[True], [True]]
+
+
+def test_hits_matrix():
+    ids, _, hits = fuse([[7, 8, 9], [9, 10]], method="rrf", K=60, topk=10)
+    assert hits.shape == (2, len(ids))
+    expected = {7: (True, False), 8: (True, False), 9: (True, True), 10: (False, True)}
+    for i, doc in enumerate(ids.tolist()):
+        assert tuple(hits[:, i]) == expected[doc]
+
+
+def test_combsum_and_combmnz_hand_worked():
+    lists = [[1, 2, 3], [3, 4]]
+    scores = [[3.0, 2.0, 1.0], [10.0, 0.0]]
+    # min-max: danh sách 1 -> {1: 1, 2: 0.5, 3: 0}, danh sách 2 -> {3: 1, 4: 0}
+    ids, fused, hits = fuse(lists, scores=scores, method="combsum", topk=10)
+    assert ids.tolist() == [1, 3, 2, 4]  # 1 và 3 cùng 1.0 -> 1 xuất hiện trước
+    assert fused.tolist() == pytest.approx([1.0, 1.0, 0.5, 0.0])
+    assert hits.tolist() == [[True, True, True, False], [False, True, False, True]]
+
+    # CombMNZ nhân thêm số danh sách chứa văn bản: 3 -> 1.0 * 2
+    ids, fused, _ = fuse(lists, scores=scores, method="combmnz", topk=10)
+    assert ids.tolist() == [3, 1, 2, 4]
+    assert fused.tolist() == pytest.approx([2.0, 1.0, 0.5, 0.0])
+
+
+def test_combsum_without_scores_uses_rank_scores():
+    # Thiếu điểm -> 1 - rank/len: danh sách 1 -> {1: 1, 2: 0.5}, danh sách 2 -> {2: 1}
+    ids, fused, _ = fuse([[1, 2], [2]], method="combsum", weights=[1.0, 2.0], topk=10)
+    assert ids.tolist() == [2, 1]
+    assert fused.tolist() == pytest.approx([2.5, 1.0])
+
+
+def test_empty_and_invalid_method():
+    ids, fused, hits = fuse([[], [-1, -1]], method="rrf")
+    assert len(ids) == len(fused) == 0 and hits.shape == (2, 0)
+    with pytest.raises(ValueError):
+        fuse([[1]], method="borda")
@@ -0,0 +1,66 @@
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+from build_knowledge_graph import SummaryCache, fallback_topic, summarize_all  # noqa: E402
+from src.utils.stub_llm import StubLLM  # noqa: E402
+from src.utils.text_utils import chunk_hash  # noqa: E402
+
+CFG = {"requests_per_minute": None, "tokens_per_minute": None, "workers": 8, "max_retries": 0}
+
+
+def make_texts(n):
+    texts = [f"Điều {i}. Quy định số {i} về quyền và nghĩa vụ" for i in range(1, n + 1)]
+    return {chunk_hash(t): t for t in texts}
+
+
+class FailingLLM(StubLLM):
+    def invoke(self, prompt):
+        self._count()
+        raise RuntimeError("LLM lỗi")
+
+
+def test_summarize_all_concurrent_with_stub(tmp_path):
+    texts = make_texts(60)
+    llm = StubLLM(latency=0.002)
+    cache = SummaryCache(str(tmp_path / "summaries.json"))
+
+    topics = summarize_all(texts, llm, cache, CFG)
+
+    assert llm.calls == len(texts)
+    assert set(topics) == set(texts)
+    for h, text in texts.items():
+        # StubLLM trả về dòng "Điều N..." đầu tiên trong prompt -> chính nội dung điều luật
+        assert topics[h] == text[:80]
+    assert os.path.exists(tmp_path / "summaries.json")
+
+
+def test_summary_cache_skips_llm_on_rebuild(tmp_path):
+    path = str(tmp_path / "summaries.json")
+    texts = make_texts(20)
+    first = summarize_all(texts, StubLLM(), SummaryCache(path), CFG)
+
+    llm = StubLLM()
+    second = summarize_all(texts, llm, SummaryCache(path), CFG)
+    assert llm.calls == 0
+    assert second == first
+
+    # Chỉ điều luật mới phải gọi LLM
+    texts.update(make_texts(25))
+    llm = StubLLM()
+    summarize_all(texts, llm, SummaryCache(path), CFG)
+    assert llm.calls == 5
+
+
+def test_failed_summaries_fall_back_and_are_not_cached(tmp_path):
+    path = str(tmp_path / "summaries.json")
+    texts = make_texts(10)
+    topics = summarize_all(texts, FailingLLM(), SummaryCache(path), CFG)
+
+    assert topics == {h: fallback_topic(t) for h, t in texts.items()}
+    llm = StubLLM()
+    summarize_all(texts, llm, SummaryCache(path), CFG)
+    assert llm.calls == len(texts)
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from src.utils.text_utils import parse_mcq_choice, parse_mcq_options  # noqa: E402
+
+QUESTION = """Người lao động được nghỉ hằng năm bao nhiêu ngày?
+a. 10 ngày
+b. 12 ngày
+c. 14 ngày
+d. 16 ngày"""
+
+
+@pytest.mark.parametrize("answer, expected", [
+    ("Đáp án đúng là B", "b"),
+    ("Đáp án: c. 14 ngày", "c"),
+    ("Tôi chọn d vì Điều 113 quy định như vậy", "d"),
+    ("**B.** 12 ngày làm việc", "b"),
+    ("c) 14 ngày", "c"),
+    ("Theo Điều 113, người lao động được nghỉ 12 ngày", "b"),
+    # Phân tích từng phương án rồi mới chốt -> lấy câu kết luận cuối cùng
+    ("Phương án A sai vì thiếu điều kiện. Phương án C đúng. Đáp án: C", "c"),
+    ("Xét từng phương án:\na) 10 ngày - sai\nb) 12 ngày - sai\nc) 14 ngày - đúng\n=> Đáp án đúng là C", "c"),
+    ("Đáp án A sai, đáp án đúng nhất là D", "d"),
+    # Chuỗi đã tách dấu (NFD) vẫn đọc được
+    ("Đáp án đúng là B".replace("á", "a\u0301"), "b"),
+])
+def test_parse_mcq_choice(answer, expected):
+    assert parse_mcq_choice(answer, parse_mcq_options(QUESTION)) == expected
+
+
+@pytest.mark.parametrize("answer", [
+    "",
+    "Không có đáp án nào đúng trong các lựa chọn a, b, c",
+    "Tất cả các đáp án trên đều sai",
+    "Đáp án A hoặc C đều có thể đúng tùy trường hợp",
+    # Nhắc nhiều phương án mà không chốt -> để giám khảo LLM quyết định
+    "a) 10 ngày - chưa rõ\nb) 12 ngày - có thể",
+    "Cần thêm thông tin để trả lời",
+])
+def test_parse_mcq_choice_ambiguous_returns_none(answer):
+    assert parse_mcq_choice(answer, parse_mcq_options(QUESTION)) is None
+
+
+def test_parse_mcq_options():
+    assert parse_mcq_options(QUESTION) == {"a": "10 ngày", "b": "12 ngày", "c": "14 ngày", "d": "16 ngày"}